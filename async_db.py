@@ -0,0 +1,131 @@
+"""
+Асинхронный слой доступа к данным.
+
+Функции модуля делегируют хранилищу, выбранному переменной DB_BACKEND:
+SQLite (repositories.sqlite) или PostgreSQL (repositories.postgres).
+Хранилище создаётся при запуске бота вызовом init() и закрывается
+shutdown(); обработчики импортируют отсюда функции и не знают, с какой
+БД работают. Каждый вызов замеряется (metrics.db_calls) вместе с ожиданием
+свободного соединения — именно это время видит обработчик.
+"""
+import functools
+import time
+from typing import Optional
+
+import grading
+from config import DB_BACKEND, DATABASE_URL, DB_POOL_SIZE
+from metrics import metrics
+from repositories.base import Repository
+
+_repository: Optional[Repository] = None
+
+
+def get_repository() -> Repository:
+    if _repository is None:
+        raise RuntimeError("Хранилище не подключено: сначала вызовите async_db.init()")
+    return _repository
+
+
+async def init(repository: Repository = None) -> Repository:
+    """Подключает хранилище (по умолчанию — из настроек) и применяет миграции схемы"""
+    global _repository
+    if repository is None:
+        if DB_BACKEND == "postgres":
+            from repositories.postgres import PostgresRepository
+            repository = PostgresRepository(DATABASE_URL, pool_size=DB_POOL_SIZE)
+        else:
+            from repositories.sqlite import SQLiteRepository
+            repository = SQLiteRepository(pool_size=DB_POOL_SIZE)
+    await repository.start()
+    _repository = repository
+    return repository
+
+
+async def shutdown():
+    global _repository
+    if _repository is not None:
+        await _repository.close()
+        _repository = None
+
+
+def _delegate(name: str):
+    method = getattr(Repository, name)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        call = getattr(get_repository(), name)
+        failed = False
+        start = time.perf_counter()
+        try:
+            return await call(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            metrics.observe_db(name, time.perf_counter() - start, failed)
+    return wrapper
+
+
+# --- Пользователи ---
+add_user = _delegate("add_user")
+user_exists = _delegate("user_exists")
+touch_user = _delegate("touch_user")
+save_user_name = _delegate("save_user_name")
+
+# --- Профиль ученика ---
+get_user_summary = _delegate("get_user_summary")
+get_user_history_page = _delegate("get_user_history_page")
+
+# --- Админы ---
+add_admin = _delegate("add_admin")
+remove_admin = _delegate("remove_admin")
+get_all_admins = _delegate("get_all_admins")
+sync_admin_info = _delegate("sync_admin_info")
+
+# --- Тесты ---
+generate_code = _delegate("generate_code")
+create_test = _delegate("create_test")
+add_question = _delegate("add_question")
+create_test_with_questions = _delegate("create_test_with_questions")
+get_tests_by_admin = _delegate("get_tests_by_admin")
+get_test_with_answers = _delegate("get_test_with_answers")
+delete_test = _delegate("delete_test")
+regrade_test = _delegate("regrade_test")
+
+# --- Логика ответов и дедлайна ---
+get_test_session = _delegate("get_test_session")
+is_valid_code = _delegate("is_valid_code")
+get_test_id_by_code = _delegate("get_test_id_by_code")
+get_test_deadline = _delegate("get_test_deadline")
+has_submitted = _delegate("has_submitted")
+get_correct_answers = _delegate("get_correct_answers")
+get_answer_key = _delegate("get_answer_key")
+preload_answer_keys = _delegate("preload_answer_keys")
+save_answers = _delegate("save_answers")
+
+# --- Напоминания о дедлайне ---
+add_reminders = _delegate("add_reminders")
+delete_user_reminders = _delegate("delete_user_reminders")
+delete_reminders = _delegate("delete_reminders")
+get_pending_reminders = _delegate("get_pending_reminders")
+get_submitted_pairs = _delegate("get_submitted_pairs")
+
+# --- Состояния FSM ---
+load_fsm_record = _delegate("load_fsm_record")
+save_fsm_records = _delegate("save_fsm_records")
+delete_stale_fsm_records = _delegate("delete_stale_fsm_records")
+
+# --- Результаты ---
+get_test_results = _delegate("get_test_results")
+get_user_answers_detailed = _delegate("get_user_answers_detailed")
+get_results_page = _delegate("get_results_page")
+get_participant_result = _delegate("get_participant_result")
+export_results_csv = _delegate("export_results_csv")
+
+
+# --- Кэши (без обращения к БД) ---
+def answer_key_cache_stats() -> dict:
+    return get_repository().answer_key_cache_stats()
+
+
+grading_memo_stats = grading.grading_memo_stats
@@ -0,0 +1,76 @@
+"""Общие заготовки для бенчмарков: окружение, временная БД и тестовые данные."""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# config.py требует эти переменные; для бенчмарков подойдут любые значения
+os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("OWNER_ID", "1")
+
+import db  # noqa: E402
+from migrations import migrate  # noqa: E402
+from utils.normalizer import canonical_key  # noqa: E402
+
+
+def scratch_db(name: str = "bench.sqlite3") -> str:
+    """Переключает db.py на новую пустую БД во временном каталоге и создаёт схему"""
+    path = os.path.join(tempfile.mkdtemp(prefix="tg_bench_"), name)
+    db.close_connections()
+    db.DB_NAME = path
+    migrate()
+    return path
+
+
+def seed(users: int = 200, tests: int = 20, questions: int = 30, answers_per_test: int = 100, rnd_seed: int = 42):
+    """Заполняет БД пользователями, тестами с ключами и ответами. Возвращает [(test_id, code)]"""
+    rnd = random.Random(rnd_seed)
+    letters = "ABCD"
+    conn = db.get_connection()
+    now = datetime.utcnow()
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, first_name, last_name, username, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(1000 + i, f"First{i}", f"Last{i}", f"user{i}", now.isoformat()) for i in range(users)],
+        )
+
+    created = []
+    for t in range(tests):
+        code = f"T{t:05d}"
+        with conn:
+            test_id = conn.execute(
+                "INSERT INTO tests (title, code, is_active, created_by, deadline) VALUES (?, ?, 1, ?, ?)",
+                (f"Test {t}", code, 1 + t % 5, (now + timedelta(days=1)).isoformat()),
+            ).lastrowid
+            key = {q: rnd.choice(letters) for q in range(1, questions + 1)}
+            conn.executemany(
+                "INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(test_id, q, a, 1.0, canonical_key(a)) for q, a in key.items()],
+            )
+            participants = rnd.sample(range(users), min(users, answers_per_test))
+            rows = []
+            for u in participants:
+                answers = {q: key[q] if rnd.random() < 0.7 else rnd.choice(letters) for q in key}
+                solved = sum(1 for q in key if answers[q] == key[q])
+                rows.append((
+                    1000 + u, test_id, "\n".join(f"{q} {a}" for q, a in answers.items()),
+                    now.isoformat(), float(solved), solved, float(questions),
+                ))
+            conn.executemany(
+                "INSERT INTO answers (user_id, test_id, answer_text, submitted_at, score, solved, max_score)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        created.append((test_id, code))
+    return created
+
+
+def timeit(func, repeat: int) -> float:
+    """Среднее время одного вызова в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
@@ -0,0 +1,55 @@
+"""
+Сравнение подключения на каждый вызов и постоянных соединений db.py.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_connections [--repeat 2000]
+"""
+import argparse
+import sqlite3
+
+from benchmarks._fixtures import scratch_db, seed, timeit
+
+import db
+
+
+def connect_per_call():
+    # Поведение до появления менеджера соединений
+    return sqlite3.connect(db.DB_NAME)
+
+
+def run(repeat: int):
+    scratch_db()
+    tests = seed()
+    test_id, code = tests[len(tests) // 2]
+
+    cases = [
+        ("is_valid_code", lambda: db.is_valid_code(code)),
+        ("get_test_id_by_code", lambda: db.get_test_id_by_code(code)),
+        ("has_submitted", lambda: db.has_submitted(1001, test_id)),
+        ("get_test_deadline", lambda: db.get_test_deadline(test_id)),
+        ("get_correct_answers", lambda: db.get_correct_answers(test_id)),
+        ("get_tests_by_admin", lambda: db.get_tests_by_admin(1)),
+        ("is_admin", lambda: db.is_admin(1001)),
+        ("get_test_results", lambda: db.get_test_results(test_id)),
+    ]
+
+    pooled_get_connection = db.get_connection
+    print(f"{'function':<24}{'per-call, us':>14}{'pooled, us':>14}{'speedup':>10}")
+    for name, call in cases:
+        per_call_repeat = repeat if name != "get_test_results" else max(1, repeat // 20)
+        db.get_connection = connect_per_call
+        try:
+            per_call = timeit(call, per_call_repeat)
+        finally:
+            db.get_connection = pooled_get_connection
+        call()  # прогрев кэша выражений
+        pooled = timeit(call, per_call_repeat)
+        print(f"{name:<24}{per_call:>14.1f}{pooled:>14.1f}{per_call / pooled:>9.1f}x")
+
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    run(parser.parse_args().repeat)
@@ -0,0 +1,217 @@
+"""
+Время функций db.py на большой БД.
+
+БД берётся из --db; если её нет, сначала создаётся generate_dataset
+(по умолчанию в полном объёме, --scale уменьшает). Для каждой функции
+входные данные (тесты, ученики, админы) выбираются из БД с фиксированным
+зерном, делается один прогревочный проход (кэш ключей ответов, страницы
+SQLite), затем --repeat замеренных вызовов. delete_test после каждого
+вызова возвращает удалённые строки на место, так что БД не меняется
+и прогоны повторяемы.
+
+Результат — таблица и JSON (--json), который можно сохранить для одной
+версии кода и сравнить с другой через --compare.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_db_scale [--db путь] [--scale 0.1] [--repeat 200]
+                                        [--json out.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from benchmarks.generate_dataset import DEFAULT_PATH, FIRST_USER, generate, load_params, scaled
+
+import db
+
+INPUTS = 200            # сколько разных входов берётся для каждой функции
+DELETE_REPEAT = 10      # delete_test с восстановлением дорогой — замеряется реже
+HEAVY_SHARE = 10        # get_test_results и первая страница результатов — в --repeat / HEAVY_SHARE вызовов
+_RESTORED_TABLES = ("tests", "questions", "answers", "answer_items")
+
+
+def _inputs(conn: sqlite3.Connection, rnd: random.Random, params: dict) -> dict:
+    tests = [r[0] for r in conn.execute("SELECT test_id FROM tests ORDER BY test_id")]
+    codes = dict(conn.execute("SELECT test_id, code FROM tests"))
+    sample_tests = rnd.sample(tests, min(INPUTS, len(tests)))
+    # Пары из сданных работ: для деталей и итога участника
+    submitted = [
+        conn.execute("SELECT user_id FROM answers WHERE test_id = ? ORDER BY answer_id LIMIT 1 OFFSET ?",
+                     (t, rnd.randrange(max(1, params["answers"] // params["tests"] // 5)))).fetchone()
+        for t in sample_tests
+    ]
+    pairs = [(u[0], t) for u, t in zip(submitted, sample_tests) if u]
+    users = [FIRST_USER + rnd.randrange(params["users"]) for _ in range(INPUTS)]
+    return {
+        "tests": sample_tests,
+        "codes": [codes[t] for t in sample_tests],
+        "pairs": pairs,
+        # has_submitted: половина — сдавшие, половина — случайные пары
+        "has_submitted": [p for pair in zip(pairs, zip(users, sample_tests)) for p in pair],
+        "users": users,
+        "admins": [rnd.randint(1, params["admins"]) for _ in range(INPUTS)],
+        "delete": rnd.sample(tests, min(DELETE_REPEAT, len(tests))),
+    }
+
+
+def _snapshot(conn: sqlite3.Connection, test_id: int) -> dict:
+    return {table: conn.execute(f"SELECT * FROM {table} WHERE test_id = ?", (test_id,)).fetchall()
+            for table in _RESTORED_TABLES}
+
+
+def _restore(conn: sqlite3.Connection, snapshot: dict):
+    with conn:
+        for table in _RESTORED_TABLES:
+            rows = snapshot[table]
+            if rows:
+                conn.executemany(f"INSERT INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows)
+        db._refresh_user_stats(conn, list({row[1] for row in snapshot["answers"]}))
+
+
+def _time_calls(func, args_list: list[tuple], repeat: int) -> list[float]:
+    for args in args_list:
+        func(*args)   # прогрев
+    timings = []
+    for i in range(repeat):
+        args = args_list[i % len(args_list)]
+        start = time.perf_counter_ns()
+        func(*args)
+        timings.append((time.perf_counter_ns() - start) / 1000)
+    return timings
+
+
+def _time_delete(tests: list[int]) -> list[float]:
+    conn = db.get_connection()
+    timings = []
+    for test_id in tests:
+        snapshot = _snapshot(conn, test_id)
+        start = time.perf_counter_ns()
+        db.delete_test(test_id)
+        timings.append((time.perf_counter_ns() - start) / 1000)
+        _restore(conn, snapshot)
+    return timings
+
+
+def _summary(timings: list[float]) -> dict:
+    ordered = sorted(timings)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 1)
+
+    return {
+        "calls": len(ordered),
+        "mean_us": round(statistics.fmean(ordered), 1),
+        "p50_us": pct(0.5),
+        "p95_us": pct(0.95),
+        "p99_us": pct(0.99),
+        "min_us": round(ordered[0], 1),
+        "max_us": round(ordered[-1], 1),
+    }
+
+
+def _revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(path: str, scale: float, repeat: int, rnd_seed: int = 7) -> dict:
+    if not os.path.exists(path):
+        generate(path, **scaled(scale))
+    params = load_params(path)
+    db.close_connections()
+    db.DB_NAME = path
+
+    conn = db.get_connection()
+    data = _inputs(conn, random.Random(rnd_seed), params)
+    tests, pairs = [(t,) for t in data["tests"]], data["pairs"]
+    heavy = max(1, repeat // HEAVY_SHARE)
+
+    # Вторая страница начинается после десятой строки первой
+    anchors = []
+    for test_id in data["tests"]:
+        rows = db.get_results_page(test_id)["rows"]
+        if rows:
+            anchors.append((test_id, (rows[-1]["score"], rows[-1]["answer_id"])))
+
+    cases = [
+        ("has_submitted", db.has_submitted, data["has_submitted"], repeat),
+        ("get_tests_by_admin", db.get_tests_by_admin, [(a,) for a in data["admins"]], repeat),
+        ("generate_code", db.generate_code, [()], repeat),
+        ("get_test_session", db.get_test_session, [(c, u) for c, u in zip(data["codes"], data["users"])], repeat),
+        ("get_test_results", db.get_test_results, tests, heavy),
+        ("get_results_page", db.get_results_page, tests, repeat),
+        ("get_results_page/next", db.get_results_page, anchors, repeat),
+        ("get_participant_result", db.get_participant_result, [(t, u) for u, t in pairs], repeat),
+        ("get_user_answers_detailed", db.get_user_answers_detailed, [(t, u) for u, t in pairs], repeat),
+        ("get_user_summary", db.get_user_summary, [(u,) for u in data["users"]], repeat),
+        ("get_user_history_page", db.get_user_history_page, [(u,) for u in data["users"]], repeat),
+    ]
+
+    results = {}
+    for name, func, args_list, calls in cases:
+        results[name] = _summary(_time_calls(func, args_list, calls))
+        print(f"  {name}: готово", flush=True)
+    results["delete_test"] = _summary(_time_delete(data["delete"]))
+    db.close_connections()
+
+    return {
+        "meta": {
+            "revision": _revision(),
+            "date": datetime.now().replace(microsecond=0).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "dataset": params,
+            "db_size_mb": round(os.path.getsize(path) / 2 ** 20),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def print_report(report: dict, baseline: dict = None):
+    meta = report["meta"]
+    dataset = meta["dataset"]
+    print(f"\nревизия {meta['revision']}, SQLite {meta['sqlite']}, {dataset['users']} учеников, "
+          f"{dataset['tests']} тестов x {dataset['questions']} вопросов, {dataset['answers']} работ")
+    header = f"{'function':<28}{'calls':>7}{'mean us':>11}{'p50 us':>11}{'p95 us':>11}{'p99 us':>11}"
+    print(header + (f"{'p50 было':>11}{'изм.':>9}" if baseline else ""))
+    for name, row in report["results"].items():
+        line = (f"{name:<28}{row['calls']:>7}{row['mean_us']:>11.1f}{row['p50_us']:>11.1f}"
+                f"{row['p95_us']:>11.1f}{row['p99_us']:>11.1f}")
+        old = (baseline or {}).get("results", {}).get(name)
+        if old:
+            line += f"{old['p50_us']:>11.1f}{(row['p50_us'] / old['p50_us'] - 1) * 100:>+8.0f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=DEFAULT_PATH)
+    parser.add_argument("--scale", type=float, default=1.0, help="объём новой БД, если её ещё нет")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", help="куда сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    report = run(args.db, args.scale, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["dataset"] != report["meta"]["dataset"]:
+            print("⚠️ Прошлый прогон сделан на другой БД — сравнение неточное")
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nJSON: {args.json}")
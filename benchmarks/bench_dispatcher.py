@@ -0,0 +1,213 @@
+"""
+Нагрузка на весь бот: настоящий Dispatcher без Telegram.
+
+Диспетчер собирается как в bot.py — роутеры common, user и admin,
+DatabaseStorage и HandlerTimingMiddleware, хранилище SQLite во временном
+каталоге. Бот ходит в «Telegram» через StubSession: запросы не покидают
+процесс, на sendMessage возвращается сообщение, на остальное — true.
+Очередь исходящих (DeliveryMiddleware) не подключается: её лимиты
+Telegram замедлили бы прогон намеренно, а не из-за кода бота.
+
+Сценарии (обновления подаются через dp.feed_update):
+  * students — N учеников одновременно: «Проверить тест», код, ответы,
+    «✅ Подтвердить»;
+  * admins — M сессий админа одновременно: «Мои тесты», таблица результатов,
+    следующая страница, ответы участника (чужие результаты админам не
+    показываются, поэтому все сессии — от автора первого теста);
+  * mixed — вторая волна учеников сдаёт другой тест, пока админы смотрят
+    результаты первого.
+Для каждого сценария печатаются обновления в секунду и p50/p95/p99
+времени обработки обновления, затем разбивка по обработчикам.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_dispatcher [--students 500] [--admins 20] [--questions 30] [--api-ms 0]
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from datetime import datetime
+from typing import Any
+
+from benchmarks._fixtures import scratch_db, seed
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendDocument, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, Update
+
+import async_db
+from fsm_storage import DatabaseStorage
+from handlers import admin, common, user
+from metrics import HandlerTimingMiddleware, metrics
+from repositories.sqlite import SQLiteRepository
+from roles import load_admins
+
+TOKEN = "123456:benchmark"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench"}
+FIRST_STUDENT = 1000   # seed() создаёт пользователей 1000, 1001, ...
+ADMINS = range(1, 6)   # seed() раздаёт тесты админам 1..5
+
+
+class StubSession(BaseSession):
+    """Сессия бота без сети: отвечает на запросы сама, по желанию — с задержкой api_delay"""
+
+    def __init__(self, api_delay: float = 0.0):
+        super().__init__()
+        self.api_delay = api_delay
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.api_delay:
+            await asyncio.sleep(self.api_delay)
+        if isinstance(method, (SendMessage, SendDocument)):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url: str, headers: dict = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class Feeder:
+    """Собирает обновления от имени пользователей и замеряет их обработку"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.latencies: list[float] = []
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    async def _feed(self, payload: dict):
+        update_id = next(self._ids)
+        update = Update.model_validate({"update_id": update_id, **payload}, context={"bot": self.bot})
+        start = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies.append(time.perf_counter() - start)
+
+    async def message(self, user_id: int, text: str):
+        await self._feed({"message": {
+            "message_id": next(self._ids), "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id),
+        }})
+
+    async def callback(self, user_id: int, data: str):
+        await self._feed({"callback_query": {
+            "id": str(next(self._ids)), "chat_instance": str(user_id), "data": data,
+            "from": self._user(user_id),
+            "message": {
+                "message_id": next(self._ids), "date": int(time.time()), "text": "…",
+                "chat": {"id": user_id, "type": "private"}, "from": BOT_USER,
+            },
+        }})
+
+
+async def student(feeder: Feeder, user_id: int, code: str, answers: str):
+    await feeder.message(user_id, "Проверить тест")
+    await feeder.message(user_id, code)
+    await feeder.message(user_id, answers)
+    await feeder.callback(user_id, "confirm_answers_submission")
+
+
+async def admin_browse(feeder: Feeder, admin_id: int, test_id: int, next_anchor: str, back_anchor: str,
+                       participant: int):
+    await feeder.message(admin_id, "Мои тесты")
+    await feeder.callback(admin_id, f"view_results:{test_id}")
+    await feeder.callback(admin_id, f"res:{test_id}:n:{next_anchor}")
+    await feeder.callback(admin_id, f"res_user:{test_id}:{participant}:{back_anchor}")
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def run_scenario(name: str, feeder: Feeder, coroutines: list) -> tuple:
+    feeder.latencies = []
+    metrics.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*coroutines)
+    elapsed = time.perf_counter() - start
+    latencies = feeder.latencies
+    row = (name, len(latencies), len(latencies) / elapsed,
+           *(percentile(latencies, p) * 1000 for p in (0.5, 0.95, 0.99)))
+    return row, metrics.top("handlers", limit=20)
+
+
+async def main(students: int, admins: int, questions: int, api_ms: float):
+    scratch_db("dispatcher.sqlite3")
+    tests = seed(users=students * 2, tests=2, questions=questions, answers_per_test=0)
+    answers = "\n".join(f"{q} A" for q in range(1, questions + 1))
+
+    storage = DatabaseStorage()
+    await async_db.init(SQLiteRepository())
+    load_admins(ADMINS)
+    dp = Dispatcher(storage=storage)
+    HandlerTimingMiddleware().setup(dp)
+    dp.include_routers(common.router, user.router, admin.router)
+    session = StubSession(api_ms / 1000)
+    bot = Bot(TOKEN, session=session)
+    feeder = Feeder(dp, bot)
+
+    (first_id, first_code), (second_id, second_code) = tests
+    # seed() отдаёт первый тест админу ADMINS[0]
+    admin_ids = [ADMINS[0]] * admins
+    results = []
+    try:
+        results.append(await run_scenario("students", feeder, [
+            student(feeder, FIRST_STUDENT + i, first_code, answers) for i in range(students)
+        ]))
+
+        page = await async_db.get_results_page(first_id)
+        next_anchor = admin._page_anchor(page["rows"][-1])
+        back_anchor = admin._page_anchor(page["rows"][0])
+        participant = page["rows"][0]["user_id"]
+
+        def browsing():
+            return [admin_browse(feeder, admin_id, first_id, next_anchor, back_anchor, participant)
+                    for admin_id in admin_ids]
+
+        results.append(await run_scenario("admins", feeder, browsing()))
+        results.append(await run_scenario("mixed", feeder, browsing() + [
+            student(feeder, FIRST_STUDENT + students + i, second_code, answers) for i in range(students)
+        ]))
+    finally:
+        await storage.close()
+        await async_db.shutdown()
+        await bot.session.close()
+
+    print(f"\nучеников: {students}, админов: {admins}, вопросов: {questions}, задержка API: {api_ms:g} мс")
+    print(f"{'scenario':<10}{'updates':>9}{'upd/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for (name, count, rate, p50, p95, p99), _ in results:
+        print(f"{name:<10}{count:>9}{rate:>10.0f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+    for (name, *_), handlers in results:
+        print(f"\n{name}: {'handler':<40}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for row in handlers:
+            print(f"{'':<{len(name) + 2}}{row['name']:<40}{row['count']:>7}"
+                  f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}")
+    print("\nзапросы к API:", ", ".join(f"{k}: {v}" for k, v in sorted(session.calls.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--admins", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--api-ms", type=float, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.students, args.admins, args.questions, args.api_ms))
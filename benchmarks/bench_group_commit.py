@@ -0,0 +1,122 @@
+"""
+Задержка подтверждения при одновременной сдаче работ.
+
+N учеников (по умолчанию 500) нажимают «подтвердить» одновременно.
+Сравниваются три способа записи:
+  * pool/NORMAL — каждая работа отдельной транзакцией в пуле потоков,
+    synchronous=NORMAL (как было до группового коммита; в WAL последние
+    коммиты могут потеряться при отключении питания);
+  * pool/FULL — то же с synchronous=FULL, то есть с той же гарантией
+    сохранности, что у группового коммита;
+  * group — GroupCommitWriter: пачки в одной транзакции, synchronous=FULL.
+Для каждого способа печатаются p50/p99 времени от вызова до подтверждения
+и общее время.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_group_commit [--submissions 500] [--dir /путь/на/диске]
+--dir задаёт каталог для временных БД: по умолчанию /tmp может быть в памяти,
+и стоимость fsync там не видна.
+"""
+import argparse
+import asyncio
+import functools
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks._fixtures import scratch_db, seed
+
+import db
+from config import DB_POOL_SIZE
+from grading import grade_answers
+from repositories.group_commit import GroupCommitWriter
+
+QUESTIONS = 30
+
+
+def _bind_full_connection():
+    db.get_connection().execute("PRAGMA synchronous=FULL")
+
+
+def _prepare(submissions: int) -> list[tuple]:
+    """Новая БД с учениками и тестами; возвращает аргументы save_answers для каждой работы"""
+    scratch_db()
+    tests = seed(users=submissions, tests=1, questions=QUESTIONS, answers_per_test=0)
+    test_id = tests[0][0]
+    key = db.get_answer_key(test_id)
+    items, score, solved = grade_answers(key, {q: "A" for q in range(1, QUESTIONS + 1)})
+    text = "\n".join(f"{q} A" for q in range(1, QUESTIONS + 1))
+    return [(1000 + u, test_id, text, items, score, solved, key["max_score"]) for u in range(submissions)]
+
+
+async def _timed(save, submission) -> float:
+    start = time.perf_counter()
+    assert await save(*submission)
+    return time.perf_counter() - start
+
+
+async def _burst(save, batch: list[tuple]) -> tuple[list[float], float]:
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(_timed(save, s) for s in batch))
+    return latencies, time.perf_counter() - start
+
+
+async def run_pool(batch: list[tuple], initializer) -> tuple[list[float], float]:
+    executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, initializer=initializer)
+    loop = asyncio.get_running_loop()
+
+    async def save(*submission):
+        return await loop.run_in_executor(executor, functools.partial(db.save_answers, *submission))
+
+    try:
+        return await _burst(save, batch)
+    finally:
+        executor.shutdown(wait=True)
+        db.close_connections()
+
+
+async def run_group(batch: list[tuple]) -> tuple[list[float], float, dict]:
+    writer = GroupCommitWriter()
+    await writer.start()
+    try:
+        latencies, total = await _burst(writer.submit, batch)
+        return latencies, total, writer.stats()
+    finally:
+        await writer.close()
+        db.close_connections()
+
+
+def _percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+
+
+def _row(name: str, latencies: list[float], total: float, extra: str = "") -> str:
+    return (f"{name:<14}{_percentile(latencies, 50) * 1000:>10.1f}{_percentile(latencies, 99) * 1000:>10.1f}"
+            f"{total * 1000:>12.1f}  {extra}")
+
+
+def run(submissions: int):
+    rows = []
+    latencies, total = asyncio.run(run_pool(_prepare(submissions), db.bind_thread_connection))
+    rows.append(_row("pool/NORMAL", latencies, total))
+
+    latencies, total = asyncio.run(run_pool(_prepare(submissions), _bind_full_connection))
+    rows.append(_row("pool/FULL", latencies, total))
+
+    latencies, total, stats = asyncio.run(run_group(_prepare(submissions)))
+    rows.append(_row("group", latencies, total, f"пачек: {stats['batches']}, в среднем {stats['avg_batch']}"))
+
+    print(f"\n{submissions} одновременных работ, пул потоков: {DB_POOL_SIZE}")
+    print(f"{'mode':<14}{'p50, ms':>10}{'p99, ms':>10}{'total, ms':>12}")
+    print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--dir", help="каталог для временных БД")
+    args = parser.parse_args()
+    if args.dir:
+        tempfile.tempdir = args.dir
+    run(args.submissions)
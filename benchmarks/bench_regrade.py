@@ -0,0 +1,122 @@
+"""
+Пересчёт работ после исправления ключа: построчный цикл против пакетного.
+
+"legacy" — цикл из прежнего get_test_results: разбор answer_text каждой
+работы и сравнение с ключом по одному вопросу. "columnar" —
+grading.regrade_columns по столбцам answer_items. С флагом --with-db
+дополнительно замеряется db.regrade_test целиком (чтение, пересчёт и
+запись одной транзакцией) на временной БД.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_regrade [--submissions 50000] [--questions 40] [--with-db]
+"""
+import argparse
+import random
+import time
+from array import array
+from datetime import datetime
+
+from benchmarks._fixtures import scratch_db
+
+import db
+from grading import regrade_columns
+from utils.normalizer import canonical_key
+
+LETTERS = "ABCD"
+
+
+def make_key(questions: int, rnd: random.Random) -> dict:
+    return {q: (rnd.choice(LETTERS).lower(), rnd.choice((1.0, 1.5, 2.0))) for q in range(1, questions + 1)}
+
+
+def make_submissions(submissions: int, correct_map: dict, rnd: random.Random) -> list[dict[int, str]]:
+    return [
+        {q: (correct.upper() if rnd.random() < 0.7 else rnd.choice(LETTERS)) for q, (correct, _) in correct_map.items()}
+        for _ in range(submissions)
+    ]
+
+
+def legacy_regrade(answer_texts: list[str], correct_map: dict) -> list[tuple[float, int]]:
+    results = []
+    for answer_text in answer_texts:
+        parsed_answers = {}
+        for line in answer_text.strip().splitlines():
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2 and parts[0].isdigit():
+                parsed_answers[int(parts[0])] = parts[1].strip().lower()
+
+        score = 0
+        solved = 0
+        for q_num, (correct_ans, score_val) in correct_map.items():
+            if parsed_answers.get(q_num, "") == correct_ans:
+                score += score_val
+                solved += 1
+        results.append((score, solved))
+    return results
+
+
+def run(submissions: int, questions: int, with_db: bool):
+    rnd = random.Random(7)
+    old_key = make_key(questions, rnd)
+    new_key = make_key(questions, rnd)
+    rows = make_submissions(submissions, old_key, rnd)
+
+    answer_texts = ["\n".join(f"{q} {a}" for q, a in answers.items()) for answers in rows]
+    answer_ids = array("q", (i for i, answers in enumerate(rows) for _ in answers))
+    numbers = array("i", (q for answers in rows for q in answers))
+    answers = [a for answers in rows for a in answers.values()]
+
+    start = time.perf_counter()
+    legacy = legacy_regrade(answer_texts, new_key)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, columnar = regrade_columns(answer_ids, numbers, answers, new_key)
+    columnar_s = time.perf_counter() - start
+
+    assert all(legacy[i] == columnar[i] for i in range(submissions)), "результаты пересчёта расходятся"
+
+    print(f"{submissions} работ x {questions} вопросов = {len(answers)} ответов")
+    print(f"{'engine':<12}{'seconds':>10}{'answers/s':>14}")
+    print(f"{'legacy':<12}{legacy_s:>10.3f}{len(answers) / legacy_s:>14,.0f}")
+    print(f"{'columnar':<12}{columnar_s:>10.3f}{len(answers) / columnar_s:>14,.0f}")
+
+    if with_db:
+        scratch_db()
+        conn = db.get_connection()
+        with conn:
+            test_id = conn.execute(
+                "INSERT INTO tests (title, code, is_active, created_by, deadline) VALUES ('bench', 'BENCH1', 1, 1, ?)",
+                (datetime.utcnow().isoformat(),),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(test_id, q, a.upper(), s, canonical_key(a)) for q, (a, s) in old_key.items()],
+            )
+            conn.executemany(
+                "INSERT INTO answers (answer_id, user_id, test_id, answer_text, score, solved, max_score)"
+                " VALUES (?, ?, ?, ?, 0, 0, 0)",
+                [(i + 1, 1000 + i, test_id, text) for i, text in enumerate(answer_texts)],
+            )
+            conn.executemany(
+                "INSERT INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)"
+                " VALUES (?, ?, ?, ?, ?, 0)",
+                ((i + 1, test_id, 1000 + i, q, a) for i, answers in enumerate(rows) for q, a in answers.items()),
+            )
+
+        changes = [(q, a.upper(), s) for q, (a, s) in new_key.items()]
+        start = time.perf_counter()
+        regraded = db.regrade_test(test_id, changes)
+        db_s = time.perf_counter() - start
+        print(f"{'db.regrade_test':<12}{db_s:>10.3f}{len(answers) / db_s:>14,.0f}  ({regraded} работ, одна транзакция)")
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=50000)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--with-db", action="store_true")
+    args = parser.parse_args()
+    run(args.submissions, args.questions, args.with_db)
@@ -0,0 +1,106 @@
+"""
+Число SQL-запросов и время на одну завершённую сдачу теста.
+
+Сравниваются прежняя цепочка вызовов (is_valid_code, get_test_id_by_code,
+has_submitted, get_test_deadline при вводе кода, затем повторные
+get_test_deadline и has_submitted, ключ ответов и запись) и новая
+(get_test_session при вводе кода, ключ из кэша, запись результата и
+ответов по вопросам одной транзакцией с проверкой повторной сдачи).
+Обе цепочки проверяют ответы grade_answers и записывают одни и те же
+строки (работу, ответы по вопросам, сводку ученика), так что разница во
+времени — только от числа обращений к БД.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_submission_flow [--submissions 500]
+"""
+import argparse
+import time
+
+from benchmarks._fixtures import scratch_db, seed
+
+import db
+from grading import grade_answers
+
+QUERY_PREFIXES = ("SELECT", "INSERT", "UPDATE", "DELETE")
+ANSWERS = {q: "A" for q in range(1, 31)}
+
+
+def count_queries(statements: list[str]) -> int:
+    """Число запросов; построчная вставка answer_items одним executemany считается за один"""
+    count = 0
+    previous = ""
+    for statement in statements:
+        statement = statement.lstrip().upper()
+        if not statement.startswith(QUERY_PREFIXES):
+            continue
+        if statement.startswith("INSERT INTO ANSWER_ITEMS") and previous.startswith("INSERT INTO ANSWER_ITEMS"):
+            continue
+        count += 1
+        previous = statement
+    return count
+
+
+def legacy_flow(code: str, user_id: int, answer_text: str):
+    if not db.is_valid_code(code):
+        return
+    test_id = db.get_test_id_by_code(code)
+    if db.has_submitted(user_id, test_id):
+        return
+    db.get_test_deadline(test_id)
+    # process_user_test_submission
+    db.get_test_deadline(test_id)
+    # handle_confirm_answers: ключ ответов каждый раз читался из таблицы questions
+    if db.has_submitted(user_id, test_id):
+        return
+    db._answer_keys.pop(test_id)
+    key = db.get_answer_key(test_id)
+    items, score, solved = grade_answers(key, ANSWERS)
+    db.save_answers(user_id, test_id, answer_text, items, score=score, solved=solved, max_score=key["max_score"])
+
+
+def session_flow(code: str, user_id: int, answer_text: str):
+    session = db.get_test_session(code, user_id)
+    if not session or not session["is_active"] or session["submitted"]:
+        return
+    test_id = session["test_id"]
+    # process_user_test_submission берёт дедлайн из FSM, ключ ответов — из кэша
+    key = db.get_answer_key(test_id)
+    items, score, solved = grade_answers(key, ANSWERS)
+    db.save_answers(user_id, test_id, answer_text, items, score=score, solved=solved, max_score=key["max_score"])
+
+
+def measure(flow, code: str, users: list[int], answer_text: str) -> tuple[float, float]:
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    start = time.perf_counter()
+    for user_id in users:
+        flow(code, user_id, answer_text)
+    elapsed = time.perf_counter() - start
+    conn.set_trace_callback(None)
+    return count_queries(statements) / len(users), elapsed / len(users) * 1e6
+
+
+def run(submissions: int):
+    scratch_db()
+    seed(users=submissions * 2, tests=4, answers_per_test=0)
+    (_, legacy_code), (_, session_code) = db.get_connection().execute(
+        "SELECT test_id, code FROM tests ORDER BY test_id LIMIT 2"
+    ).fetchall()
+    answer_text = "\n".join(f"{q} {a}" for q, a in ANSWERS.items())
+
+    users = [1000 + i for i in range(submissions)]
+    legacy_q, legacy_us = measure(legacy_flow, legacy_code, users, answer_text)
+    session_q, session_us = measure(session_flow, session_code, users, answer_text)
+
+    print(f"{'flow':<10}{'queries/submission':>20}{'us/submission':>16}")
+    print(f"{'legacy':<10}{legacy_q:>20.1f}{legacy_us:>16.1f}")
+    print(f"{'session':<10}{session_q:>20.1f}{session_us:>16.1f}")
+
+    db.close_connections()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=500)
+    run(parser.parse_args().submissions)
@@ -0,0 +1,198 @@
+"""
+Задержка доставки обновлений: long polling против вебхука.
+
+Локальный поддельный Telegram выдаёт одни и те же обновления с заданной
+частотой двумя способами: отвечает на getUpdates (long polling) или сам
+отправляет POST на webhook.LimitedRequestHandler, держа не больше
+--connections запросов одновременно, как настоящий Telegram с max_connections.
+Сеть между Telegram и ботом имитируется задержкой --rtt-ms на каждый
+запрос с ответом. Обработчик имитирует работу (await asyncio.sleep),
+задержка считается от появления обновления до конца его обработки.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_webhook [--updates 2000] [--rate 500] [--work-ms 5] [--connections 40] [--rtt-ms 40]
+"""
+import argparse
+import asyncio
+import time
+
+import benchmarks._fixtures  # noqa: F401  (переменные окружения для config.py)
+
+from aiohttp import ClientSession, TCPConnector, web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+from webhook import build_webhook_app
+
+TOKEN = "123456:benchmark"
+SECRET = "bench-secret"
+HOST = "127.0.0.1"
+API_PORT = 18081
+WEBHOOK_PORT = 18082
+WEBHOOK_PATH = "/webhook"
+
+
+def make_update(update_id: int) -> dict:
+    user = {"id": 10_000 + update_id % 500, "is_bot": False, "first_name": "Bench"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private"},
+            "from": user,
+            "text": "bench",
+        },
+    }
+
+
+class FakeTelegram:
+    """Поддельный Bot API: getMe, getUpdates с ожиданием, на остальные методы отвечает true"""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.pending: list[dict] = []
+        self.arrived = asyncio.Event()
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    def push(self, update: dict):
+        self.pending.append(update)
+        self.arrived.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench"}})
+        if method != "getupdates":
+            return web.json_response({"ok": True, "result": True})
+
+        form = await request.post()
+        # запрос идёт до Telegram половину RTT
+        await asyncio.sleep(self.rtt / 2)
+        offset = int(form.get("offset", 0))
+        timeout = float(form.get("timeout", 0))
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self.pending[:100]
+        # и столько же идёт ответ
+        await asyncio.sleep(self.rtt / 2)
+        return web.json_response({"ok": True, "result": batch})
+
+
+def make_dispatcher(work: float, sent_at: dict, latencies: list, done: asyncio.Event, total: int) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def on_message(message: Message):
+        await asyncio.sleep(work)
+        latencies.append(time.perf_counter() - sent_at[message.message_id])
+        if len(latencies) == total:
+            done.set()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def produce(updates: int, rate: float, sent_at: dict, deliver):
+    start = time.perf_counter()
+    for i in range(1, updates + 1):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sent_at[i] = time.perf_counter()
+        deliver(make_update(i))
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port).start()
+    return runner
+
+
+async def run_polling(updates: int, rate: float, work: float, rtt: float) -> list[float]:
+    fake = FakeTelegram(rtt)
+    api_runner = await serve(fake.app, API_PORT)
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://{HOST}:{API_PORT}")))
+
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(work, sent_at, latencies, done, updates)
+    polling = asyncio.create_task(dp.start_polling(bot, polling_timeout=1, handle_signals=False))
+
+    await produce(updates, rate, sent_at, fake.push)
+    await done.wait()
+    await dp.stop_polling()
+    await polling
+    await api_runner.cleanup()
+    return latencies
+
+
+async def run_webhook(updates: int, rate: float, work: float, connections: int, rtt: float) -> list[float]:
+    bot = Bot(TOKEN)
+    sent_at, latencies, done = {}, [], asyncio.Event()
+    dp = make_dispatcher(work, sent_at, latencies, done, updates)
+    app, _ = build_webhook_app(dp, bot, WEBHOOK_PATH, SECRET, max_concurrency=connections)
+    runner = await serve(app, WEBHOOK_PORT)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    url = f"http://{HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async def connection(session: ClientSession):
+        while True:
+            update = await queue.get()
+            await asyncio.sleep(rtt / 2)
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+            # соединение свободно, только когда ответ дошёл до Telegram
+            await asyncio.sleep(rtt / 2)
+
+    async with ClientSession(connector=TCPConnector(limit=connections)) as session:
+        senders = [asyncio.create_task(connection(session)) for _ in range(connections)]
+        await produce(updates, rate, sent_at, queue.put_nowait)
+        await done.wait()
+        for sender in senders:
+            sender.cancel()
+
+    await runner.cleanup()
+    return latencies
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def main(updates: int, rate: float, work_ms: float, connections: int, rtt_ms: float):
+    work, rtt = work_ms / 1000, rtt_ms / 1000
+    results = [
+        ("polling", await run_polling(updates, rate, work, rtt)),
+        ("webhook", await run_webhook(updates, rate, work, connections, rtt)),
+    ]
+
+    print(f"{updates} обновлений, {rate:g}/с, обработка {work_ms:g} мс, RTT {rtt_ms:g} мс, "
+          f"соединений вебхука: {connections}")
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, latencies in results:
+        p50, p95, p99 = (percentile(latencies, p) * 1000 for p in (0.5, 0.95, 0.99))
+        print(f"{name:<10}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{max(latencies) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500)
+    parser.add_argument("--work-ms", type=float, default=5)
+    parser.add_argument("--connections", type=int, default=40)
+    parser.add_argument("--rtt-ms", type=float, default=40)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.rate, args.work_ms, args.connections, args.rtt_ms))
@@ -0,0 +1,205 @@
+"""
+Генератор большой БД для бенчмарков.
+
+Заполняет новую БД (схема — migrations.migrate) объёмами рабочего бота
+за учебный год: по умолчанию 50 000 учеников, 2 000 тестов по 80 вопросов
+и 1 000 000 сданных работ вместе с ответами по вопросам (answer_items).
+Тесты идут по времени один за другим, у каждого свой набор участников;
+ученики различаются уровнем, поэтому баллы и места распределены как в жизни.
+Данные зависят только от параметров и --seed: повторный запуск даёт ту же
+БД, так что замеры разных версий кода сравнимы. Параметры сохраняются рядом
+с БД в <путь>.json.
+
+Запуск из корня проекта:
+    python -m benchmarks.generate_dataset [--out путь] [--scale 0.1] [--users 50000] [--tests 2000]
+                                          [--questions 80] [--answers 1000000] [--seed 42]
+На полном объёме генерация занимает минуты и несколько ГБ на диске;
+--scale уменьшает все объёмы сразу.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import benchmarks._fixtures  # noqa: F401  (переменные окружения для config.py)
+
+import db
+from migrations import migrate
+from utils.normalizer import canonical_key
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "tg_bench_large", "db.sqlite3")
+DEFAULTS = {"users": 50_000, "tests": 2_000, "questions": 80, "answers": 1_000_000, "admins": 50}
+
+FIRST_USER = 100_000   # id учеников; админы — 1..admins
+EPOCH = datetime(2025, 9, 1, 8, 0)
+TEST_WINDOW = timedelta(days=2)   # от создания теста до дедлайна
+ACTIVE_SHARE = 0.05               # доля самых свежих тестов, которые ещё открыты
+SKIPPED = 0.03                    # вероятность оставить вопрос без ответа
+COMMIT_EVERY = 20                 # тестов в одной транзакции
+
+
+def _key(rnd: random.Random, questions: int) -> list[tuple[int, str, float]]:
+    """Ключ теста: в основном варианты A–D, часть вопросов с числовым ответом и двойным баллом"""
+    key = []
+    for number in range(1, questions + 1):
+        if rnd.random() < 0.8:
+            key.append((number, rnd.choice("ABCD"), 1.0))
+        else:
+            key.append((number, str(rnd.randint(-50, 500)), 2.0))
+    return key
+
+
+def _wrong(rnd: random.Random, correct: str) -> str:
+    if correct in "ABCD":
+        return rnd.choice([letter for letter in "ABCD" if letter != correct])
+    return str(int(correct) + rnd.randint(1, 9))
+
+
+def _participants_per_test(rnd: random.Random, tests: int, answers: int, users: int) -> list[int]:
+    """Разбивает answers работ по тестам неравномерно (от 0.2 до 1.8 среднего), ровно answers в сумме"""
+    weights = [rnd.uniform(0.2, 1.8) for _ in range(tests)]
+    total = sum(weights)
+    counts = [min(users, int(answers * w / total)) for w in weights]
+    order = list(range(tests))
+    rnd.shuffle(order)
+    short = answers - sum(counts)
+    while short > 0:
+        for i in order:
+            if short and counts[i] < users:
+                counts[i] += 1
+                short -= 1
+    return counts
+
+
+def generate(path: str, users: int, tests: int, questions: int, answers: int, admins: int,
+             rnd_seed: int = 42) -> dict:
+    if answers > users * tests:
+        raise ValueError("Работ больше, чем пар (ученик, тест)")
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} уже существует — удалите его или укажите другой --out")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    started = time.perf_counter()
+    db.close_connections()
+    db.DB_NAME = path
+    migrate()
+    db.close_connections()
+
+    rnd = random.Random(rnd_seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO admins (admin_id, first_name, last_name, username, updated_at) VALUES (?, ?, ?, ?, ?)",
+            [(a, f"Admin{a}", f"Teacher{a}", f"teacher{a}", EPOCH.isoformat()) for a in range(1, admins + 1)],
+        )
+        conn.executemany(
+            "INSERT INTO users (user_id, full_name, first_name, last_name, username, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(FIRST_USER + u, f"LAST{u} FIRST{u}", f"FIRST{u}", f"LAST{u}", f"student{u}",
+              (EPOCH + timedelta(minutes=u)).isoformat()) for u in range(users)],
+        )
+    skill = [rnd.betavariate(5, 3) for _ in range(users)]
+
+    counts = _participants_per_test(rnd, tests, answers, users)
+    codes = set()
+    step = timedelta(days=365) / tests
+    for t in range(tests):
+        created = EPOCH + step * t
+        code = "".join(rnd.choices(string.ascii_uppercase + string.digits, k=6))
+        while code in codes:
+            code = "".join(rnd.choices(string.ascii_uppercase + string.digits, k=6))
+        codes.add(code)
+        key = _key(rnd, questions)
+        max_score = sum(score for _, _, score in key)
+
+        test_id = conn.execute(
+            "INSERT INTO tests (title, code, is_active, created_by, created_at, deadline) VALUES (?, ?, ?, ?, ?, ?)",
+            (f"Контрольная №{t + 1}", code, int(t >= tests * (1 - ACTIVE_SHARE)), rnd.randint(1, admins),
+             created.isoformat(), (created + TEST_WINDOW).isoformat()),
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [(test_id, number, correct, score, canonical_key(correct)) for number, correct, score in key],
+        )
+
+        participants = rnd.sample(range(users), counts[t])
+        offsets = sorted(rnd.random() for _ in participants)
+        for u, offset in zip(participants, offsets):
+            marks = []
+            total = 0.0
+            for number, correct, score in key:
+                roll = rnd.random()
+                if roll < SKIPPED:
+                    marks.append((number, "", 0))
+                elif roll < skill[u]:
+                    marks.append((number, correct, 1))
+                    total += score
+                else:
+                    marks.append((number, _wrong(rnd, correct), 0))
+            solved = sum(m[2] for m in marks)
+            answer_id = conn.execute(
+                "INSERT INTO answers (user_id, test_id, answer_text, submitted_at, score, solved, max_score)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (FIRST_USER + u, test_id, "\n".join(f"{n} {a}" for n, a, _ in marks if a),
+                 (created + TEST_WINDOW * offset).replace(microsecond=0).isoformat(),
+                 total, solved, max_score),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(answer_id, test_id, FIRST_USER + u, n, a, c) for n, a, c in marks],
+            )
+
+        if (t + 1) % COMMIT_EVERY == 0 or t + 1 == tests:
+            conn.commit()
+            print(f"  тестов: {t + 1}/{tests}, {time.perf_counter() - started:.0f} с", flush=True)
+
+    with conn:
+        conn.execute("DELETE FROM user_stats")
+        conn.execute(f"""
+            INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+            SELECT a.user_id, COUNT(*), SUM({db._PERCENT}) FROM answers a GROUP BY a.user_id
+        """)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    params = {"users": users, "tests": tests, "questions": questions, "answers": answers,
+              "admins": admins, "seed": rnd_seed}
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+    print(f"БД готова за {time.perf_counter() - started:.0f} с: {path} "
+          f"({os.path.getsize(path) / 2 ** 20:.0f} МБ)")
+    return params
+
+
+def scaled(scale: float, **overrides) -> dict:
+    """Объёмы по умолчанию, умноженные на scale; явно заданные значения не масштабируются"""
+    params = {name: max(1, round(value * scale)) for name, value in DEFAULTS.items()}
+    params["questions"] = DEFAULTS["questions"]
+    params.update({name: value for name, value in overrides.items() if value is not None})
+    return params
+
+
+def load_params(path: str) -> dict:
+    with open(path + ".json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    parser.add_argument("--scale", type=float, default=1.0)
+    for name in DEFAULTS:
+        parser.add_argument(f"--{name}", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.out, rnd_seed=args.seed, **scaled(args.scale, **{n: getattr(args, n) for n in DEFAULTS}))
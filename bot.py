@@ -1,10 +1,18 @@
 import asyncio
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
-from config import BOT_TOKEN
-from db import create_tables
+from config import (
+    BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_CONCURRENCY, METRICS_HOST, METRICS_PORT
+)
+from async_db import init as init_db, shutdown as shutdown_db, preload_answer_keys, get_all_admins
+from roles import load_admins
+from scheduler import reminders
+from delivery import outbox, DeliveryMiddleware
+from fsm_storage import DatabaseStorage
+from metrics import HandlerTimingMiddleware, start_metrics_server
+from webhook import run_webhook
 from handlers import common, user, admin
 
 
@@ -13,12 +21,20 @@ async def main():
         token=BOT_TOKEN,
         default=DefaultBotProperties(parse_mode="HTML")
     )
+    # Все исходящие сообщения идут через очередь с лимитами Telegram
+    bot.session.middleware(DeliveryMiddleware(outbox))
 
 
-    dp = Dispatcher(storage=MemoryStorage())
+    # Состояния диалогов хранятся в БД и переживают перезапуск
+    dp = Dispatcher(storage=DatabaseStorage())
+    # Время обработки каждого обновления по обработчикам (/stats, /metrics)
+    HandlerTimingMiddleware().setup(dp)
 
-    # Создание таблиц при запуске
-    create_tables()
+    # Подключение к хранилищу (DB_BACKEND), создание и обновление схемы БД при запуске
+    await init_db()
+    load_admins(await get_all_admins())
+    preloaded = await preload_answer_keys()
+    print(f"🔑 Загружено ключей ответов активных тестов: {preloaded}")
 
     # Подключение всех хендлеров
     dp.include_routers(
@@ -27,8 +43,28 @@ async def main():
         admin.router
     )
 
+    # Напоминания о дедлайне, в том числе не отправленные до перезапуска
+    await reminders.start(bot, dp.storage)
+
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
     print("🤖 Бот запущен")
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(
+                dp, bot,
+                url=WEBHOOK_URL, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                host=WEBHOOK_HOST, port=WEBHOOK_PORT, max_concurrency=WEBHOOK_MAX_CONCURRENCY
+            )
+        else:
+            # Вебхук, оставшийся от запуска в другом режиме, мешает getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await reminders.stop()
+        await shutdown_db()
 
 
 if __name__ == "__main__":
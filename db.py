@@ -1,80 +1,84 @@
 import sqlite3
 import random
+import threading
 import string
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from config import OWNER_ID
+from config import DB_PATH
 from zoneinfo import ZoneInfo  # добавь в начало файла
+from utils.cache import LRUCache
+import roles
+from array import array
+from itertools import compress
+from operator import ne
+from grading import compile_answer_key, regrade_columns, forget_test
+from utils.normalizer import canonical_key
+from repositories.base import RESULTS_PAGE_SIZE, HISTORY_PAGE_SIZE
+
+
+DB_NAME = DB_PATH
+
+# --- Настройки соединений ---
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16 * 1024         # кэш страниц на соединение
+MMAP_SIZE = 128 * 1024 * 1024     # отображение файла БД в память
+STATEMENT_CACHE_SIZE = 256        # подготовленные выражения на соединение
+
+# Ключ ответов не меняется после создания теста, поэтому кэшируется в памяти процесса
+ANSWER_KEY_CACHE_SIZE = 512
+_answer_keys = LRUCache(ANSWER_KEY_CACHE_SIZE)
+
+# Соединение живёт до конца процесса: одно на поток (см. repositories/sqlite.py)
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+
+def open_connection(path: str = None) -> sqlite3.Connection:
+    """Открывает новое соединение с WAL, кэшем страниц, mmap и кэшем подготовленных выражений"""
+    conn = sqlite3.connect(
+        path or DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает постоянное соединение текущего потока, при необходимости открывая его"""
+    key = (DB_NAME, _generation)
+    if getattr(_local, "key", None) != key:
+        conn = open_connection()
+        with _connections_lock:
+            _connections.append(conn)
+        _local.conn = conn
+        _local.key = key
+    return _local.conn
+
+
+def bind_thread_connection():
+    """Заранее открывает соединение потока пула, чтобы первый запрос не платил за подключение"""
+    get_connection()
+
+
+def close_connections():
+    """Закрывает все открытые соединения; потоки переподключатся при следующем запросе"""
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
 
 
-DB_NAME = "data/db.sqlite3"
-
-
-def get_connection():
-    return sqlite3.connect(DB_NAME)
-
-
-def create_tables():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            username TEXT,
-            created_at TEXT
-        )
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS admins (
-            admin_id INTEGER PRIMARY KEY,
-            first_name TEXT,
-            last_name TEXT,
-            username TEXT,
-            updated_at TEXT
-        )
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tests (
-            test_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            code TEXT UNIQUE,
-            is_active BOOLEAN DEFAULT 1,
-            created_by INTEGER,
-            created_at TEXT,
-            deadline TIMESTAMP
-        )
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS questions (
-            question_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            test_id INTEGER,
-            question_number INTEGER,
-            correct_answer TEXT,
-            score REAL,
-            FOREIGN KEY (test_id) REFERENCES tests(test_id)
-        )
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS answers (
-            answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            test_id INTEGER,
-            answer_text TEXT,
-            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (test_id) REFERENCES tests(test_id)
-        )
-        """)
-
-        conn.commit()
-
 # --- Пользователи ---
 def add_user(user_id: int, first_name: str, last_name: str, username: str = None):
     created_at = (datetime.utcnow() + timedelta(hours=5)).replace(microsecond=0).isoformat(timespec='seconds')
@@ -92,27 +96,152 @@ def user_exists(user_id: int) -> bool:
         return row.fetchone() is not None
 
 
+def touch_user(user_id: int, username: Optional[str]) -> Optional[str]:
+    """Добавляет пользователя или обновляет его username. Возвращает full_name, если он уже указан"""
+    with get_connection() as conn:
+        exists = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if exists:
+            conn.execute("UPDATE users SET username = ? WHERE user_id = ?", (username, user_id))
+        else:
+            conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
+        conn.commit()
+
+        row = conn.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row and row[0] else None
+
+
+def save_user_name(user_id: int, full_name: str, first_name: str, last_name: str, username: Optional[str]):
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO users (user_id, full_name, first_name, last_name, username)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                full_name = excluded.full_name,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                username = excluded.username
+        """, (user_id, full_name, first_name, last_name, username))
+        conn.commit()
+
+
+# --- Профиль ученика ---
+# Процент работы от максимального балла; одно и то же выражение при записи и пересчёте сводки
+_PERCENT = "CASE WHEN a.max_score > 0 THEN a.score * 100.0 / a.max_score ELSE 0 END"
+
+
+def _percent(score: float, max_score: float) -> float:
+    return score * 100.0 / max_score if max_score > 0 else 0.0
+
+
+def _refresh_user_stats(conn, user_ids: list[int]):
+    """Пересчитывает сводку учеников по их работам (после исправления ключа или удаления теста)"""
+    for chunk in _chunks(list(user_ids), _MAX_VARIABLES):
+        placeholders = ",".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM user_stats WHERE user_id IN ({placeholders})", chunk)
+        conn.execute(f"""
+            INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+            SELECT a.user_id, COUNT(*), SUM({_PERCENT})
+            FROM answers a
+            WHERE a.user_id IN ({placeholders})
+            GROUP BY a.user_id
+        """, chunk)
+
+
+def get_user_summary(user_id: int) -> Optional[dict]:
+    """Сводка ученика: сколько тестов сдано и средний процент. Обновляется при сдаче, здесь только читается"""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT tests_taken, percent_sum FROM user_stats WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    if not row or not row[0]:
+        return None
+    tests_taken, percent_sum = row
+    return {"tests_taken": tests_taken, "average_percent": round(percent_sum / tests_taken, 1)}
+
+
+def _fetch_history_page(conn, user_id: int, anchor: Optional[int], direction: str, limit: int):
+    condition, order = ("a.answer_id > ?", "ASC") if direction == "prev" else ("a.answer_id < ?", "DESC")
+    params = [user_id]
+    if anchor is None:
+        condition = "1"
+    else:
+        params.append(anchor)
+
+    # Место считается по индексу (test_id, score DESC) только для строк страницы
+    return conn.execute(f"""
+        SELECT a.answer_id, a.test_id, t.title, a.submitted_at, a.score, a.max_score, a.solved,
+               1 + (SELECT COUNT(*) FROM answers b WHERE b.test_id = a.test_id AND b.score > a.score),
+               (SELECT COUNT(*) FROM answers b WHERE b.test_id = a.test_id)
+        FROM answers a
+        JOIN tests t ON t.test_id = a.test_id
+        WHERE a.user_id = ? AND {condition}
+        ORDER BY a.answer_id {order}
+        LIMIT ?
+    """, (*params, limit)).fetchall()
+
+
+def get_user_history_page(user_id: int, anchor: Optional[int] = None, direction: str = "next",
+                          limit: int = HISTORY_PAGE_SIZE) -> dict:
+    """
+    Страница истории сдач ученика от новых к старым с листанием по answer_id.
+    anchor — answer_id строки, от которой листать: "next" — более старые, "prev" — более новые.
+    """
+    with get_connection() as conn:
+        rows = _fetch_history_page(conn, user_id, anchor, direction, limit + 1)
+        if direction == "prev":
+            rows = rows[:limit][::-1]
+            if len(rows) < limit:
+                # дошли до начала — показываем полную первую страницу
+                rows = _fetch_history_page(conn, user_id, None, "next", limit + 1)
+                direction = "next"
+        has_next = direction == "prev" or len(rows) > limit
+        rows = rows[:limit]
+
+        has_prev = bool(rows) and conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM answers WHERE user_id = ? AND answer_id > ?)", (user_id, rows[0][0])
+        ).fetchone()[0]
+
+    return {
+        "rows": [
+            {
+                "answer_id": answer_id,
+                "test_id": test_id,
+                "title": title,
+                "submitted_at": submitted_at,
+                "score": score,
+                "max_score": max_score,
+                "solved": solved,
+                "place": place,
+                "participants": participants
+            }
+            for answer_id, test_id, title, submitted_at, score, max_score, solved, place, participants in rows
+        ],
+        "has_prev": bool(has_prev),
+        "has_next": has_next,
+    }
+
+
 # --- Админы ---
 def is_admin(user_id: int) -> bool:
-    with get_connection() as conn:
-        row = conn.execute("SELECT 1 FROM admins WHERE admin_id = ?", (user_id,))
-        return row.fetchone() is not None
+    return roles.is_admin(user_id)
 
 
 def is_admin_or_owner(user_id: int) -> bool:
-    return user_id == OWNER_ID or is_admin(user_id)
+    return roles.is_admin_or_owner(user_id)
 
 
 def add_admin(user_id: int):
     with get_connection() as conn:
         conn.execute("INSERT OR IGNORE INTO admins (admin_id) VALUES (?)", (user_id,))
         conn.commit()
+    roles.grant_admin(user_id)
 
 
 def remove_admin(user_id: int):
     with get_connection() as conn:
         conn.execute("DELETE FROM admins WHERE admin_id = ?", (user_id,))
         conn.commit()
+    roles.revoke_admin(user_id)
 
 
 def get_all_admins() -> list[int]:
@@ -134,6 +263,7 @@ def sync_admin_info(user_id: int, first_name: str, last_name: str, username: str
                 updated_at=excluded.updated_at
         """, (user_id, first_name, last_name, username, updated_at))
         conn.commit()
+    roles.grant_admin(user_id)
 
 
 # --- Тесты ---
@@ -157,10 +287,31 @@ def create_test(title: str, code: str, admin_id: int, deadline: datetime) -> int
 def add_question(test_id: int, number: int, answer: str, score: float):
     with get_connection() as conn:
         conn.execute("""
-            INSERT INTO questions (test_id, question_number, correct_answer, score)
-            VALUES (?, ?, ?, ?)
-        """, (test_id, number, answer, score))
+            INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)
+            VALUES (?, ?, ?, ?, ?)
+        """, (test_id, number, answer, score, canonical_key(answer)))
         conn.commit()
+    _answer_keys.pop(test_id)
+
+
+def create_test_with_questions(title: str, code: str, admin_id: int, deadline: datetime,
+                               questions: list[tuple[int, str, float]]) -> int:
+    """Создаёт тест вместе с ключом одной транзакцией (один коммит вместо коммита на каждый вопрос)"""
+    conn = get_connection()
+    with conn:
+        test_id = conn.execute("""
+            INSERT INTO tests (title, code, is_active, created_by, deadline)
+            VALUES (?, ?, 1, ?, ?)
+        """, (title, code, admin_id, deadline.isoformat())).lastrowid
+        rows = sorted((q, answer, score, canonical_key(answer)) for q, answer, score in questions)
+        conn.executemany("""
+            INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(test_id, *row) for row in rows])
+
+    # Новый тест скоро начнут решать — ключ кладём в кэш сразу
+    _answer_keys.put(test_id, compile_answer_key(rows, 1))
+    return test_id
 
 
 def get_tests_by_admin(admin_id: int):
@@ -184,13 +335,100 @@ def get_test_with_answers(test_id: int):
 
 def delete_test(test_id: int):
     with get_connection() as conn:
+        user_ids = [r[0] for r in conn.execute("SELECT user_id FROM answers WHERE test_id = ?", (test_id,))]
         conn.execute("DELETE FROM questions WHERE test_id = ?", (test_id,))
+        conn.execute("DELETE FROM answer_items WHERE test_id = ?", (test_id,))
         conn.execute("DELETE FROM answers WHERE test_id = ?", (test_id,))
+        conn.execute("DELETE FROM reminders WHERE test_id = ?", (test_id,))
         conn.execute("DELETE FROM tests WHERE test_id = ?", (test_id,))
+        _refresh_user_stats(conn, user_ids)
         conn.commit()
+    _answer_keys.pop(test_id)
+    forget_test(test_id)
+
+
+def regrade_test(test_id: int, changes: list[tuple[int, str, float]]) -> int:
+    """
+    Исправляет ключ ответов и пересчитывает все работы теста одной транзакцией.
+    changes — [(номер вопроса, правильный ответ, балл)] для уже существующих вопросов.
+    Возвращает число пересчитанных работ.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            """
+            UPDATE questions SET correct_answer = ?, score = ?, canonical_answer = ?
+            WHERE test_id = ? AND question_number = ?
+            """,
+            [(answer, score, canonical_key(answer), test_id, number) for number, answer, score in changes],
+        )
+        conn.execute("UPDATE tests SET key_version = key_version + 1 WHERE test_id = ?", (test_id,))
+
+        rows = conn.execute("""
+            SELECT question_number, correct_answer, score, canonical_answer
+            FROM questions
+            WHERE test_id = ?
+            ORDER BY question_number
+        """, (test_id,)).fetchall()
+        version = conn.execute("SELECT key_version FROM tests WHERE test_id = ?", (test_id,)).fetchone()[0]
+        key = compile_answer_key(rows, version)
+
+        items = conn.execute(
+            "SELECT answer_id, question_number, answer, is_correct FROM answer_items WHERE test_id = ?",
+            (test_id,),
+        ).fetchall()
+        results = {}
+        if items:
+            answer_ids, numbers, answers, old_flags = zip(*items)
+            correct, results = regrade_columns(array("q", answer_ids), array("i", numbers), answers, key["correct_map"])
+
+            # Переписываем только те ответы, чья оценка изменилась
+            changed = compress(zip(correct, answer_ids, numbers), map(ne, correct, old_flags))
+            conn.executemany(
+                "UPDATE answer_items SET is_correct = ? WHERE answer_id = ? AND question_number = ?",
+                changed,
+            )
+            max_score = round(key["max_score"], 2)
+            conn.executemany(
+                "UPDATE answers SET score = ?, solved = ?, max_score = ? WHERE answer_id = ?",
+                [(round(score, 2), solved, max_score, answer_id) for answer_id, (score, solved) in results.items()],
+            )
+            _refresh_user_stats(conn, [r[0] for r in conn.execute(
+                "SELECT user_id FROM answers WHERE test_id = ?", (test_id,)
+            )])
+
+    _answer_keys.put(test_id, key)
+    forget_test(test_id)
+    return len(results)
 
 
 # --- Логика ответов и дедлайна ---
+def get_test_session(code: str, user_id: int) -> Optional[dict]:
+    """
+    Всё, что нужно для начала прохождения теста, одним запросом:
+    id теста, активен ли он, дедлайн и сдавал ли его уже пользователь.
+    Возвращает None, если теста с таким кодом нет.
+    """
+    with get_connection() as conn:
+        row = conn.execute("""
+            SELECT t.test_id, t.is_active, t.deadline,
+                   EXISTS(SELECT 1 FROM answers a WHERE a.test_id = t.test_id AND a.user_id = ?)
+            FROM tests t
+            WHERE t.code = ?
+        """, (user_id, code)).fetchone()
+
+    if not row:
+        return None
+
+    test_id, is_active, deadline, submitted = row
+    return {
+        "test_id": test_id,
+        "is_active": bool(is_active),
+        "deadline": datetime.fromisoformat(deadline) if deadline else None,
+        "submitted": bool(submitted),
+    }
+
+
 def is_valid_code(code: str) -> bool:
     with get_connection() as conn:
         row = conn.execute("SELECT 1 FROM tests WHERE code = ? AND is_active = 1", (code,))
@@ -215,118 +453,436 @@ def has_submitted(user_id: int, test_id: int) -> bool:
         return row is not None
 
 
+def get_answer_key(test_id: int) -> dict:
+    """Скомпилированный ключ ответов теста. Результат общий для всех вызовов — не изменяйте его"""
+    key = _answer_keys.get(test_id)
+    if key is None:
+        with get_connection() as conn:
+            rows = conn.execute("""
+                SELECT question_number, correct_answer, score, canonical_answer
+                FROM questions
+                WHERE test_id = ?
+                ORDER BY question_number
+            """, (test_id,)).fetchall()
+            version = conn.execute("SELECT key_version FROM tests WHERE test_id = ?", (test_id,)).fetchone()
+        key = compile_answer_key(rows, version[0] if version else 1)
+        _answer_keys.put(test_id, key)
+    return key
+
+
 def get_correct_answers(test_id: int) -> list[dict]:
+    return get_answer_key(test_id)["questions"]
+
+
+def preload_answer_keys() -> int:
+    """Загружает в кэш ключи всех активных тестов одним запросом. Возвращает число тестов"""
     with get_connection() as conn:
         rows = conn.execute("""
-            SELECT question_number, correct_answer, score
-            FROM questions
-            WHERE test_id = ?
-            ORDER BY question_number
-        """, (test_id,)).fetchall()
-        return [{"question_number": r[0], "correct_answer": r[1], "score": r[2]} for r in rows]
+            SELECT q.test_id, t.key_version, q.question_number, q.correct_answer, q.score, q.canonical_answer
+            FROM questions q
+            JOIN tests t ON t.test_id = q.test_id
+            WHERE t.is_active = 1
+            ORDER BY t.test_id DESC, q.question_number
+        """).fetchall()
+
+    by_test = {}
+    versions = {}
+    for test_id, version, *question in rows:
+        by_test.setdefault(test_id, []).append(question)
+        versions[test_id] = version
+
+    # Самые новые тесты загружаются последними, чтобы при переполнении остались именно они
+    loaded = list(by_test.items())[:ANSWER_KEY_CACHE_SIZE]
+    for test_id, questions in reversed(loaded):
+        _answer_keys.put(test_id, compile_answer_key(questions, versions[test_id]))
+    return len(loaded)
+
+
+def answer_key_cache_stats() -> dict:
+    return _answer_keys.stats()
+
+
+def _insert_submission(conn: sqlite3.Connection, user_id: int, test_id: int, answer_text: str,
+                       items: list[tuple[int, str, bool]], score: float, solved: int, max_score: float) -> bool:
+    """Записывает работу в уже открытой транзакции; коммит — на вызывающем"""
+    submitted_at = (datetime.utcnow() + timedelta(hours=5)).replace(microsecond=0).isoformat()
+    # Повторную сдачу отсекает уникальный индекс (test_id, user_id) — без отдельной проверки
+    row = conn.execute("""
+        INSERT INTO answers (user_id, test_id, answer_text, submitted_at, score, solved, max_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (test_id, user_id) DO NOTHING
+        RETURNING answer_id
+    """, (user_id, test_id, answer_text, submitted_at, round(score, 2), solved, round(max_score, 2))).fetchone()
+    if row is None:
+        return False
+
+    answer_id = row[0]
+    conn.executemany("""
+        INSERT INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(answer_id, test_id, user_id, number, answer, int(is_correct)) for number, answer, is_correct in items])
+    conn.execute("""
+        INSERT INTO user_stats (user_id, tests_taken, percent_sum) VALUES (?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            tests_taken = tests_taken + 1,
+            percent_sum = percent_sum + excluded.percent_sum
+    """, (user_id, _percent(round(score, 2), round(max_score, 2))))
+    return True
+
+
+def save_answers(user_id: int, test_id: int, answer_text: str, items: list[tuple[int, str, bool]],
+                 score: float, solved: int, max_score: float) -> bool:
+    """
+    Сохраняет ответы вместе с уже подсчитанным результатом, если пользователь
+    ещё не сдавал тест, и в той же транзакции обновляет сводку ученика (user_stats).
+    items — [(номер вопроса, ответ, верно ли)] из grading.grade_answers.
+    Возвращает False при повторной отправке.
+    """
+    conn = get_connection()
+    with conn:
+        return _insert_submission(conn, user_id, test_id, answer_text, items, score, solved, max_score)
+
+
+def open_writer_connection(path: str = None) -> sqlite3.Connection:
+    """
+    Соединение для пакетной записи работ (repositories.group_commit).
+    synchronous=FULL: после коммита работа уже на диске, даже если следом отключится питание.
+    """
+    conn = open_connection(path)
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+def save_answers_batch(conn: sqlite3.Connection, submissions: list[tuple]) -> list:
+    """
+    Сохраняет пачку работ одной транзакцией — один коммит и одна синхронизация с диском на всех.
+    submissions — кортежи аргументов save_answers. Возвращает для каждой работы True/False,
+    как save_answers, или исключение, если записать именно её не удалось (остальные сохраняются).
+    """
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for submission in submissions:
+            conn.execute("SAVEPOINT submission")
+            try:
+                results.append(_insert_submission(conn, *submission))
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO submission")
+                results.append(e)
+            conn.execute("RELEASE submission")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return results
+
+
+# --- Напоминания о дедлайне ---
+# Ограничение SQLite на число параметров в одном запросе
+_MAX_VARIABLES = 900
 
 
-def save_answers(user_id: int, test_id: int, answer_text: str):
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def add_reminders(user_id: int, test_id: int, reminders: list[tuple[str, float]]) -> list[int]:
+    """Заменяет напоминания пользователя по тесту новыми [(kind, fire_at)]. Возвращает их id"""
     with get_connection() as conn:
-        conn.execute("""
-            INSERT INTO answers (user_id, test_id, answer_text, submitted_at)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, test_id, answer_text, (datetime.utcnow() + timedelta(hours=5)).replace(microsecond=0).isoformat()))
+        conn.execute("DELETE FROM reminders WHERE user_id = ? AND test_id = ?", (user_id, test_id))
+        ids = []
+        for kind, fire_at in reminders:
+            cursor = conn.execute(
+                "INSERT INTO reminders (user_id, test_id, kind, fire_at) VALUES (?, ?, ?, ?)",
+                (user_id, test_id, kind, fire_at),
+            )
+            ids.append(cursor.lastrowid)
+        conn.commit()
+        return ids
+
+
+def delete_user_reminders(user_id: int, test_id: int):
+    with get_connection() as conn:
+        conn.execute("DELETE FROM reminders WHERE user_id = ? AND test_id = ?", (user_id, test_id))
+        conn.commit()
+
+
+def delete_reminders(reminder_ids: list[int]) -> set[int]:
+    """Удаляет напоминания и возвращает id тех, что ещё были в таблице"""
+    claimed = set()
+    conn = get_connection()
+    with conn:
+        for chunk in _chunks(reminder_ids, _MAX_VARIABLES):
+            placeholders = ",".join("?" * len(chunk))
+            claimed.update(r[0] for r in conn.execute(
+                f"SELECT reminder_id FROM reminders WHERE reminder_id IN ({placeholders})", chunk
+            ))
+            conn.execute(f"DELETE FROM reminders WHERE reminder_id IN ({placeholders})", chunk)
+    return claimed
+
+
+def get_pending_reminders() -> list[tuple]:
+    """[(reminder_id, user_id, test_id, kind, fire_at)] — все неотправленные напоминания"""
+    with get_connection() as conn:
+        return conn.execute("SELECT reminder_id, user_id, test_id, kind, fire_at FROM reminders").fetchall()
+
+
+def get_submitted_pairs(pairs: list[tuple[int, int]]) -> set[tuple[int, int]]:
+    """Из пар (user_id, test_id) возвращает те, по которым ответы уже сданы"""
+    submitted = set()
+    with get_connection() as conn:
+        for chunk in _chunks(list(pairs), _MAX_VARIABLES // 2):
+            values = ",".join("(?, ?)" for _ in chunk)
+            rows = conn.execute(
+                f"""
+                SELECT a.user_id, a.test_id
+                FROM (VALUES {values}) AS p
+                JOIN answers a ON a.user_id = p.column1 AND a.test_id = p.column2
+                """,
+                [v for pair in chunk for v in pair],
+            ).fetchall()
+            submitted.update(rows)
+    return submitted
+
+
+# --- Состояния FSM ---
+# Ключ состояния: (bot_id, chat_id, user_id, thread_id, destiny), thread_id без темы — 0
+def load_fsm_record(key: tuple) -> Optional[tuple]:
+    """(state, data в JSON, updated_at) или None"""
+    with get_connection() as conn:
+        return conn.execute("""
+            SELECT state, data, updated_at FROM fsm_states
+            WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+        """, key).fetchone()
+
+
+def save_fsm_records(upserts: list[tuple], deletes: list[tuple]):
+    """
+    Записывает пачку изменённых состояний одной транзакцией.
+    upserts — (*ключ, state, data, updated_at), deletes — ключи пустых состояний.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state, data, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET
+                state = excluded.state,
+                data = excluded.data,
+                updated_at = excluded.updated_at
+        """, upserts)
+        conn.executemany("""
+            DELETE FROM fsm_states
+            WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+        """, deletes)
+
+
+def delete_stale_fsm_records(cutoff: float) -> int:
+    """Удаляет состояния, не менявшиеся с момента cutoff (unix-время). Возвращает число удалённых"""
+    with get_connection() as conn:
+        deleted = conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,)).rowcount
         conn.commit()
+    return deleted
 
 
 # --- Results and Details ---
 def get_test_results(test_id: int):
+    """Участники теста по убыванию балла. Баллы подсчитаны при сдаче, здесь только читаются"""
+    total = len(get_answer_key(test_id)["correct_map"])
     with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.user_id, u.first_name, u.last_name, u.username, a.submitted_at, a.answer_text
+        rows = conn.execute("""
+            SELECT u.user_id, u.first_name, u.last_name, u.username, a.submitted_at,
+                   a.score, a.solved, a.max_score
             FROM answers a
             JOIN users u ON u.user_id = a.user_id
             WHERE a.test_id = ?
-            ORDER BY u.user_id, a.submitted_at
-        """, (test_id,))
-        rows = cursor.fetchall()
-
-        correct_answers = get_correct_answers(test_id)
-        correct_map = {q["question_number"]: (q["correct_answer"].strip().lower(), q["score"]) for q in correct_answers}
-        total_score = sum(q["score"] for q in correct_answers)
-
-        # Сгруппируем ответы по пользователю, возьмём последний (по submitted_at)
-        from collections import defaultdict
-        user_answers = defaultdict(list)
-        user_info = {}
-
-        for row in rows:
-            user_id, first_name, last_name, username, submitted_at, answer_text = row
-            user_info[user_id] = (first_name, last_name, username)
-            user_answers[user_id].append((submitted_at, answer_text))
-
-        results = []
-        for user_id, answers_list in user_answers.items():
-            # Возьмём последний ответ по дате
-            answers_list.sort(key=lambda x: x[0], reverse=True)
-            submitted_at, answer_text = answers_list[0]
-
-            parsed_answers = {}
-            for line in answer_text.strip().splitlines():
-                parts = line.strip().split(maxsplit=1)
-                if len(parts) == 2 and parts[0].isdigit():
-                    parsed_answers[int(parts[0])] = parts[1].strip().lower()
-
-            score = 0
-            solved = 0
-            for q_num, (correct_ans, score_val) in correct_map.items():
-                user_ans = parsed_answers.get(q_num, "")
-                if user_ans == correct_ans:
-                    score += score_val
-                    solved += 1
-
-            first_name, last_name, username = user_info[user_id]
-
-            results.append({
-                "user_id": user_id,
-                "first_name": first_name,
-                "last_name": last_name,
-                "username": username,
-                "submitted_at": submitted_at,
-                "score": round(score, 2),
-                "solved": solved,
-                "total": len(correct_map),
-                "max_score": round(total_score, 2)
-            })
+            ORDER BY a.score DESC, a.answer_id
+        """, (test_id,)).fetchall()
 
-        return sorted(results, key=lambda x: x["score"], reverse=True)
+    return [
+        {
+            "user_id": user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "username": username,
+            "submitted_at": submitted_at,
+            "score": score,
+            "solved": solved,
+            "total": total,
+            "max_score": max_score
+        }
+        for user_id, first_name, last_name, username, submitted_at, score, solved, max_score in rows
+    ]
+
+
+# Листание идёт по индексу (test_id, score DESC): условие score <= ? / score >= ? даёт
+# диапазонный поиск, а равные баллы упорядочиваются по answer_id
+_PAGE_CONDITIONS = {
+    "next": ("a.score <= ? AND NOT (a.score = ? AND a.answer_id <= ?)", "a.score DESC, a.answer_id"),
+    "from": ("a.score <= ? AND NOT (a.score = ? AND a.answer_id < ?)", "a.score DESC, a.answer_id"),
+    "prev": ("a.score >= ? AND NOT (a.score = ? AND a.answer_id >= ?)", "a.score, a.answer_id DESC"),
+}
+
+def _fetch_results_page(conn, test_id: int, anchor: Optional[tuple[float, int]], direction: str, limit: int):
+    condition, order = _PAGE_CONDITIONS[direction]
+    params = [test_id]
+    if anchor is None:
+        condition, order = "1", _PAGE_CONDITIONS["next"][1]
+    else:
+        score, answer_id = anchor
+        params += [score, score, answer_id]
+
+    return conn.execute(f"""
+        SELECT a.answer_id, a.score, a.solved, a.max_score, a.submitted_at,
+               u.user_id, u.first_name, u.last_name, u.username
+        FROM answers a
+        JOIN users u ON u.user_id = a.user_id
+        WHERE a.test_id = ? AND {condition}
+        ORDER BY {order}
+        LIMIT ?
+    """, (*params, limit)).fetchall()
+
+
+def get_results_page(test_id: int, anchor: Optional[tuple[float, int]] = None,
+                     direction: str = "next", limit: int = RESULTS_PAGE_SIZE) -> dict:
+    """
+    Страница таблицы результатов с листанием по ключу (score, answer_id).
+    anchor — строка, от которой листать: "next" — строго после неё, "prev" — строго перед ней,
+    "from" — начиная с неё. Без anchor — первая страница.
+    """
+    with get_connection() as conn:
+        rows = _fetch_results_page(conn, test_id, anchor, direction, limit + 1)
+        if direction == "prev":
+            rows = rows[:limit][::-1]
+            if len(rows) < limit:
+                # дошли до начала — показываем полную первую страницу
+                rows = _fetch_results_page(conn, test_id, None, "next", limit + 1)
+                direction = "next"
+        has_next = direction == "prev" or len(rows) > limit
+        rows = rows[:limit]
+
+        before, higher = 0, 0
+        if rows:
+            first_score, first_id = rows[0][1], rows[0][0]
+            before, higher = conn.execute("""
+                SELECT COUNT(*), COALESCE(SUM(a.score > ?), 0)
+                FROM answers a
+                WHERE a.test_id = ? AND a.score >= ? AND NOT (a.score = ? AND a.answer_id >= ?)
+            """, (first_score, test_id, first_score, first_score, first_id)).fetchone()
+
+    # Места с учётом равных баллов: 1, 2, 2, 4
+    page = []
+    place, prev_score = higher + 1, None
+    for position, (answer_id, score, solved, max_score, submitted_at,
+                   user_id, first_name, last_name, username) in enumerate(rows, start=before + 1):
+        if prev_score is not None and score != prev_score:
+            place = position
+        prev_score = score
+        page.append({
+            "place": place,
+            "answer_id": answer_id,
+            "user_id": user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "username": username,
+            "submitted_at": submitted_at,
+            "score": score,
+            "solved": solved,
+            "max_score": max_score
+        })
+
+    return {"rows": page, "has_prev": before > 0, "has_next": has_next}
+
+
+def get_participant_result(test_id: int, user_id: int) -> Optional[dict]:
+    """Итог одного участника теста"""
+    with get_connection() as conn:
+        row = conn.execute("""
+            SELECT u.first_name, u.last_name, u.username, a.submitted_at, a.score, a.solved, a.max_score
+            FROM answers a
+            JOIN users u ON u.user_id = a.user_id
+            WHERE a.test_id = ? AND a.user_id = ?
+        """, (test_id, user_id)).fetchone()
+
+    if not row:
+        return None
+    first_name, last_name, username, submitted_at, score, solved, max_score = row
+    return {
+        "first_name": first_name,
+        "last_name": last_name,
+        "username": username,
+        "submitted_at": submitted_at,
+        "score": score,
+        "solved": solved,
+        "total": len(get_answer_key(test_id)["correct_map"]),
+        "max_score": max_score
+    }
+
+
+def iter_result_rows(test_id: int):
+    """
+    Построчно отдаёт результаты теста для выгрузки: (фамилия, имя, username, время сдачи,
+    решено, баллы, макс. балл, {номер вопроса: верно ли}).
+    Ответы и их пункты читаются двумя курсорами в порядке answer_id и сливаются на ходу,
+    так что память не зависит от числа участников. Генератор нужно дочитать в том же потоке.
+    """
+    conn = get_connection()
+    # Оба курсора видят один снимок БД
+    conn.execute("BEGIN")
+    try:
+        bounds = conn.execute(
+            "SELECT MIN(answer_id), MAX(answer_id) FROM answers WHERE test_id = ?", (test_id,)
+        ).fetchone()
+        if bounds[0] is None:
+            return
+
+        answers = conn.execute("""
+            SELECT a.answer_id, u.last_name, u.first_name, u.username, a.submitted_at,
+                   a.solved, a.score, a.max_score
+            FROM answers a
+            JOIN users u ON u.user_id = a.user_id
+            WHERE a.test_id = ?
+            ORDER BY a.answer_id
+        """, (test_id,))
+        # Диапазон answer_id позволяет идти по первичному ключу answer_items без сортировки;
+        # «+» не даёт планировщику выбрать индекс по test_id, которому нужна сортировка во временном дереве
+        items = conn.execute("""
+            SELECT answer_id, question_number, is_correct
+            FROM answer_items
+            WHERE answer_id BETWEEN ? AND ? AND +test_id = ?
+            ORDER BY answer_id, question_number
+        """, (*bounds, test_id))
+
+        item = items.fetchone()
+        for answer_id, *fields in answers:
+            marks = {}
+            while item is not None and item[0] <= answer_id:
+                if item[0] == answer_id:
+                    marks[item[1]] = bool(item[2])
+                item = items.fetchone()
+            yield (*fields, marks)
+    finally:
+        conn.commit()
 
 
 def get_user_answers_detailed(test_id: int, user_id: int):
     with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT answer_text FROM answers WHERE test_id = ? AND user_id = ?", (test_id, user_id))
-        row = cursor.fetchone()
-        if not row:
-            return []
-
-
-        answer_text = row[0]
-        user_answers = {}
-        for line in answer_text.strip().splitlines():
-            parts = line.strip().split(maxsplit=1)
-            if len(parts) == 2 and parts[0].isdigit():
-                user_answers[int(parts[0])] = parts[1].strip().lower()
-
-        correct_answers = get_correct_answers(test_id)
-        details = []
-        for q in correct_answers:
-            q_num = q["question_number"]
-            correct = q["correct_answer"].strip().lower()
-            user_val = user_answers.get(q_num, "")
-            is_correct = (user_val == correct)
-            details.append({
-                "question_number": q_num,
-                "user_answer": user_val,
-                "is_correct": is_correct,
-                "score": q["score"]
-            })
-
-        return details
\ No newline at end of file
+        rows = conn.execute("""
+            SELECT i.question_number, i.answer, i.is_correct
+            FROM answers a
+            JOIN answer_items i ON i.answer_id = a.answer_id
+            WHERE a.test_id = ? AND a.user_id = ?
+            ORDER BY i.question_number
+        """, (test_id, user_id)).fetchall()
+
+    correct_map = get_answer_key(test_id)["correct_map"]
+    return [
+        {
+            "question_number": q_num,
+            "user_answer": answer,
+            "is_correct": bool(is_correct),
+            "score": correct_map.get(q_num, (None, 0))[1]
+        }
+        for q_num, answer, is_correct in rows
+    ]
@@ -0,0 +1,279 @@
+"""
+Исходящие сообщения с учётом лимитов Telegram.
+
+Все запросы бота к API, адресованные конкретному чату, проходят через
+DeliveryMiddleware. Перед отправкой запрос ждёт своей очереди в Outbox:
+общий лимит ~30 сообщений в секунду, в один чат ~1 сообщение в секунду
+(с небольшим запасом на ответ + редактирование). Ответы пользователю
+имеют приоритет над массовыми рассылками (напоминания, списки), которые
+помечаются через `with bulk():`. TelegramRetryAfter и сетевые ошибки
+повторяются с ожиданием; флуд-контроль Telegram действует на весь бот,
+поэтому на время retry_after останавливаются все отправки.
+
+У каждого чата своя очередь. Диспетчер выбирает из очередей чатов, чей
+лимит позволяет отправку, а чаты с исчерпанным лимитом ждут в отдельной
+куче по времени готовности — сообщение обходится за O(log n), сколько бы
+сообщений ни ждало в других чатах.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+GLOBAL_RATE = 30          # сообщений в секунду на бота
+CHAT_RATE = 1             # сообщений в секунду в один чат
+CHAT_BURST = 3            # сколько сообщений в чат можно отправить подряд без ожидания
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5        # секунды, удваивается с каждой попыткой
+LATENCY_WINDOW = 1000     # по скольким последним сообщениям считать задержки
+
+_priority: ContextVar[int] = ContextVar("delivery_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def bulk():
+    """Сообщения, отправленные внутри блока, уступают очередь ответам пользователям"""
+    token = _priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до свободного токена (0 — можно отправлять)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class Outbox:
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        # chat_id -> куча (приоритет, порядковый номер, future, время постановки)
+        self._queues: dict[int, list[tuple]] = {}
+        # (приоритет, порядковый номер, chat_id) первых сообщений чатов, которые можно отправлять.
+        # Запись устарела, если первое сообщение чата уже другое — такие пропускаются
+        self._ready: list[tuple] = []
+        # (момент готовности, chat_id) чатов, исчерпавших лимит
+        self._delayed: list[tuple] = []
+        self._delayed_chats: set[int] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self._queue_wait = deque(maxlen=LATENCY_WINDOW)
+        self._latency = deque(maxlen=LATENCY_WINDOW)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def acquire(self, chat_id: int, priority: int):
+        """Ждёт, пока сообщение в чат можно будет отправить, не нарушая лимитов"""
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future, time.monotonic())
+        queue = self._queues.setdefault(chat_id, [])
+        heapq.heappush(queue, entry)
+        if queue[0] is entry and chat_id not in self._delayed_chats:
+            heapq.heappush(self._ready, (priority, entry[1], chat_id))
+        self._wakeup.set()
+        await future
+
+    def block_chat(self, chat_id: int, seconds: float):
+        self._chat_bucket(chat_id).block(seconds)
+
+    def block_all(self, seconds: float):
+        self._global.block(seconds)
+
+    def _schedule(self, chat_id: int):
+        """Ставит первое ещё ожидающее сообщение чата в кучу готовых"""
+        queue = self._queues[chat_id]
+        while queue and queue[0][2].done():
+            heapq.heappop(queue)
+        if queue:
+            heapq.heappush(self._ready, (queue[0][0], queue[0][1], chat_id))
+        else:
+            del self._queues[chat_id]
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, chat_id = heapq.heappop(self._delayed)
+                self._delayed_chats.discard(chat_id)
+                self._schedule(chat_id)
+
+            next_check = None
+            while self._ready:
+                global_delay = self._global.delay(now)
+                if global_delay > 0:
+                    next_check = global_delay
+                    break
+
+                priority, seq, chat_id = heapq.heappop(self._ready)
+                queue = self._queues.get(chat_id)
+                if not queue or queue[0][:2] != (priority, seq):
+                    continue
+                if queue[0][2].done():
+                    self._schedule(chat_id)
+                    continue
+
+                bucket = self._chat_bucket(chat_id)
+                chat_delay = bucket.delay(now)
+                if chat_delay > 0:
+                    # Чат исчерпал свой лимит — ждёт отдельно, пропуская вперёд сообщения в другие чаты
+                    heapq.heappush(self._delayed, (now + chat_delay, chat_id))
+                    self._delayed_chats.add(chat_id)
+                    continue
+
+                _, _, future, enqueued = heapq.heappop(queue)
+                self._global.consume()
+                bucket.consume()
+                self._queue_wait.append(now - enqueued)
+                future.set_result(None)
+                self._schedule(chat_id)
+
+            if self._delayed:
+                chat_delay = self._delayed[0][0] - now
+                next_check = chat_delay if next_check is None else min(next_check, chat_delay)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_check)
+            except asyncio.TimeoutError:
+                pass
+
+    def record(self, latency: float, ok: bool):
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self._latency.append(latency)
+
+    @staticmethod
+    def _percentile(values, pct: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": sum(1 for queue in self._queues.values() for item in queue if not item[2].done()),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "queue_wait_p50": round(self._percentile(self._queue_wait, 0.5), 3),
+            "queue_wait_p95": round(self._percentile(self._queue_wait, 0.95), 3),
+            "latency_p50": round(self._percentile(self._latency, 0.5), 3),
+            "latency_p95": round(self._percentile(self._latency, 0.95), 3),
+        }
+
+
+class DeliveryMiddleware(BaseRequestMiddleware):
+    """Пропускает запросы к API, адресованные чату, через Outbox и повторяет их при флуд-контроле"""
+
+    def __init__(self, outbox: Outbox, max_retries: int = MAX_RETRIES):
+        self.outbox = outbox
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery и т.п. не ограничиваются по чатам
+            return await make_request(bot, method)
+
+        started = time.monotonic()
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            await self.outbox.acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.outbox.flood_waits += 1
+                # Флуд-контроль действует на весь бот: другие чаты тоже ждут, иначе получат свои 429
+                self.outbox.block_chat(chat_id, e.retry_after)
+                self.outbox.block_all(e.retry_after)
+                error = e
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = e
+                await asyncio.sleep(BACKOFF_BASE * 2 ** attempt)
+            except Exception:
+                self.outbox.record(time.monotonic() - started, ok=False)
+                raise
+            else:
+                self.outbox.record(time.monotonic() - started, ok=True)
+                return response
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.outbox.record(time.monotonic() - started, ok=False)
+                raise error
+            self.outbox.retries += 1
+
+
+outbox = Outbox()
@@ -0,0 +1,69 @@
+"""
+Выгрузка результатов теста в файл.
+
+Строки читаются из курсора и сразу пишутся в CSV, поэтому память не растёт
+с числом участников. write_results_csv() блокирующая и работает с SQLite —
+из обработчиков её вызывают через async_db, в потоке работы с БД. Хранилище
+PostgreSQL пишет тот же формат через csv_header() и csv_row().
+"""
+import csv
+import os
+import tempfile
+
+from db import get_answer_key, iter_result_rows
+
+# Excel с русской локалью ожидает «;» как разделитель и BOM в начале файла
+CSV_DELIMITER = ";"
+CSV_ENCODING = "utf-8-sig"
+
+HEADER = ["Фамилия", "Имя", "Юзернейм", "Время сдачи", "Решено", "Баллы", "Макс. балл"]
+
+
+def csv_header(questions: list[int]) -> list:
+    return HEADER + [f"№{q}" for q in questions]
+
+
+def csv_row(questions: list[int], row: tuple) -> list:
+    """row — (фамилия, имя, username, время сдачи, решено, баллы, макс. балл, {номер вопроса: верно ли})"""
+    last_name, first_name, username, submitted_at, solved, score, max_score, marks = row
+    # 1 — верно, 0 — неверно, пусто — вопрос без ответа
+    cells = ["" if q not in marks else int(marks[q]) for q in questions]
+    return [
+        last_name, first_name, f"@{username}" if username else "",
+        submitted_at, solved, score, max_score, *cells
+    ]
+
+
+def open_csv(path: str):
+    return open(path, "w", newline="", encoding=CSV_ENCODING)
+
+
+def new_export_path(test_id: int) -> str:
+    """Путь нового временного файла выгрузки; удалить файл после отправки должен вызывающий"""
+    fd, path = tempfile.mkstemp(prefix=f"results_{test_id}_", suffix=".csv")
+    os.close(fd)
+    return path
+
+
+def write_results_csv(test_id: int, path: str) -> int:
+    """Пишет результаты теста в CSV по пути path и возвращает число участников"""
+    questions = sorted(get_answer_key(test_id)["correct_map"])
+    count = 0
+    with open_csv(path) as f:
+        writer = csv.writer(f, delimiter=CSV_DELIMITER)
+        writer.writerow(csv_header(questions))
+        for row in iter_result_rows(test_id):
+            writer.writerow(csv_row(questions, row))
+            count += 1
+    return count
+
+
+def export_results_csv(test_id: int) -> tuple[str, int]:
+    """Создаёт временный CSV с результатами; удалить файл после отправки должен вызывающий"""
+    path = new_export_path(test_id)
+    try:
+        count = write_results_csv(test_id, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
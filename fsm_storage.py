@@ -0,0 +1,188 @@
+"""
+Хранилище состояний FSM в БД бота (SQLite или PostgreSQL, см. async_db).
+
+Состояния переживают перезапуск бота: ученик, начавший тест, продолжит
+с того же шага. Недавно использованные состояния держатся в памяти
+(ограниченный LRU), изменения копятся и пачкой пишутся в таблицу
+fsm_states раз в FLUSH_INTERVAL или по набору FLUSH_BATCH изменений.
+Состояния, не менявшиеся дольше STATE_TTL, считаются брошенными и
+удаляются. В data допускаются только значения, сериализуемые в JSON —
+иначе set_data бросает TypeError сразу, а не после перезапуска.
+
+Недавние состояния живут в памяти экземпляра, поэтому при нескольких
+экземплярах бота обновления одного чата должны приходить в один и тот же
+экземпляр (балансировка по chat_id).
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from async_db import load_fsm_record, save_fsm_records, delete_stale_fsm_records
+
+HOT_SIZE = 5000              # состояний в памяти
+FLUSH_INTERVAL = 0.5         # секунды между записями изменений в БД
+FLUSH_BATCH = 200            # столько изменений записываются сразу, не дожидаясь интервала
+STATE_TTL = 2 * 24 * 3600    # секунды без изменений, после которых состояние удаляется
+SWEEP_INTERVAL = 3600        # как часто удалять устаревшие состояния
+
+
+class _Record:
+    __slots__ = ("state", "data", "data_json", "updated_at")
+
+    def __init__(self, state: Optional[str] = None, data_json: str = "{}", updated_at: float = 0.0):
+        self.state = state
+        self.data_json = data_json
+        self.data = json.loads(data_json)
+        self.updated_at = updated_at
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _db_key(key: StorageKey) -> tuple:
+    return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+
+class DatabaseStorage(BaseStorage):
+    def __init__(self, hot_size: int = HOT_SIZE, ttl: float = STATE_TTL):
+        self.hot_size = hot_size
+        self.ttl = ttl
+        self._hot: OrderedDict[tuple, _Record] = OrderedDict()
+        # изменённые, но ещё не записанные состояния; _flushing — записываемые прямо сейчас
+        self._dirty: dict[tuple, _Record] = {}
+        self._flushing: dict[tuple, _Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_now: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._flush_now = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def _remember(self, key: tuple, record: _Record):
+        self._hot[key] = record
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_size:
+            # Несохранённые изменения остаются в _dirty, так что вытеснять можно любую запись
+            self._hot.popitem(last=False)
+
+    async def _record(self, key: tuple) -> _Record:
+        record = self._hot.get(key)
+        if record is not None:
+            self._hot.move_to_end(key)
+        else:
+            record = self._dirty.get(key) or self._flushing.get(key)
+            if record is None:
+                row = await load_fsm_record(key)
+                # Пока шла загрузка, тот же ключ мог загрузить (и изменить) параллельный вызов —
+                # второй _Record затёр бы его изменения
+                record = self._hot.get(key) or self._dirty.get(key) or self._flushing.get(key)
+                if record is None:
+                    record = _Record(*row) if row else _Record()
+            self._remember(key, record)
+
+        if not record.is_empty() and time.time() - record.updated_at > self.ttl:
+            record = _Record()
+            self._remember(key, record)
+        return record
+
+    def _touch(self, key: tuple, record: _Record):
+        record.updated_at = time.time()
+        self._dirty[key] = record
+        self._ensure_running()
+        if len(self._dirty) >= FLUSH_BATCH:
+            self._flush_now.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _db_key(key)
+        record = await self._record(k)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(k, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(_db_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        try:
+            data_json = json.dumps(data, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            raise TypeError(f"Данные FSM должны сериализоваться в JSON: {e}") from e
+
+        k = _db_key(key)
+        record = await self._record(k)
+        record.data_json = data_json
+        # Храним то, что вернётся после перезапуска (кортежи становятся списками и т.п.)
+        record.data = json.loads(data_json)
+        self._touch(k, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(_db_key(key))).data.copy()
+
+    async def flush(self):
+        """Записывает все накопленные изменения в БД"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+
+            upserts = []
+            deletes = []
+            for key, record in batch.items():
+                if record.is_empty():
+                    deletes.append(key)
+                else:
+                    upserts.append((*key, record.state, record.data_json, record.updated_at))
+            try:
+                await save_fsm_records(upserts, deletes)
+            except Exception:
+                # Не записанное вернётся в очередь, если его не успели изменить заново
+                for key, record in batch.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            finally:
+                self._flushing = {}
+
+    async def sweep(self) -> int:
+        """Удаляет состояния, не менявшиеся дольше ttl. Возвращает число удалённых из БД"""
+        cutoff = time.time() - self.ttl
+        for key in [k for k, r in self._hot.items() if r.updated_at < cutoff and k not in self._dirty]:
+            del self._hot[key]
+        return await delete_stale_fsm_records(cutoff)
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+
+            try:
+                await self.flush()
+                if time.monotonic() - last_sweep > SWEEP_INTERVAL:
+                    last_sweep = time.monotonic()
+                    removed = await self.sweep()
+                    if removed:
+                        print(f"🧹 Удалено брошенных состояний FSM: {removed}")
+            except Exception as e:
+                print(f"Ошибка записи состояний FSM: {e}")
+
+    async def close(self) -> None:
+        # Фоновую запись останавливаем между пачками, чтобы не прервать её посреди транзакции
+        async with self._flush_lock:
+            if self._task:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+        await self.flush()
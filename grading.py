@@ -0,0 +1,126 @@
+"""
+Проверка ответов по ключу.
+
+Ключ ответов — результат compile_answer_key(), его отдаёт get_answer_key()
+хранилища. В нём correct_map {номер вопроса: (ключ сравнения правильного
+ответа, балл)}. Ответ ученика верен, если его utils.normalizer.canonical_key()
+совпадает с этим ключом.
+"""
+import hashlib
+from collections import Counter
+from itertools import compress
+from operator import and_, eq
+
+from utils.cache import LRUCache
+from utils.normalizer import canonical_key
+
+# Одинаковые наборы ответов (частый случай на тестах с выбором варианта) проверяются один раз
+GRADING_MEMO_SIZE = 4096
+_memo = LRUCache(GRADING_MEMO_SIZE)
+
+
+def compile_answer_key(rows, version: int) -> dict:
+    """rows — (номер вопроса, правильный ответ, балл, ключ сравнения) по возрастанию номера"""
+    questions = [{"question_number": r[0], "correct_answer": r[1], "score": r[2]} for r in rows]
+    return {
+        "version": version,
+        "questions": questions,
+        # номер вопроса -> (ключ сравнения правильного ответа, балл)
+        "correct_map": {number: (canonical, score) for number, _, score, canonical in rows},
+        "max_score": sum(q["score"] for q in questions),
+    }
+
+
+def grade_answers(answer_key: dict, user_answers: dict[int, str]) -> tuple[list[tuple[int, str, bool]], float, int]:
+    """
+    Проверяет ответы ученика по всем вопросам ключа.
+    Возвращает:
+        - [(номер вопроса, ответ ученика или "", верно ли)] в порядке ключа
+        - сумму баллов
+        - число верных ответов
+    """
+    items = []
+    score = 0
+    solved = 0
+    for number, (correct, value) in answer_key["correct_map"].items():
+        answer = str(user_answers.get(number, "")).strip()
+        is_correct = canonical_key(answer) == correct
+        if is_correct:
+            score += value
+            solved += 1
+        items.append((number, answer, is_correct))
+    return items, score, solved
+
+
+def answers_digest(user_answers: dict[int, str]) -> bytes:
+    """Хэш набора ответов, не зависящий от порядка строк"""
+    normalized = "\n".join(f"{q} {str(a).strip()}" for q, a in sorted(user_answers.items()))
+    return hashlib.blake2b(normalized.encode(), digest_size=16).digest()
+
+
+def grade_submission(test_id: int, answer_key: dict, user_answers: dict[int, str], render) -> dict:
+    """
+    grade_answers с запоминанием результата по (тест, версия ключа, хэш ответов).
+    render(items, solved, score, max_score) строит текст для ученика; он тоже запоминается.
+    Возвращает {"items", "score", "solved", "summary"} — общий объект, не изменяйте его.
+    """
+    memo_key = (test_id, answer_key["version"], answers_digest(user_answers))
+    graded = _memo.get(memo_key)
+    if graded is None:
+        items, score, solved = grade_answers(answer_key, user_answers)
+        graded = {
+            "items": items,
+            "score": score,
+            "solved": solved,
+            "summary": render(items, solved, score, answer_key["max_score"]),
+        }
+        _memo.put(memo_key, graded)
+    return graded
+
+
+def forget_test(test_id: int):
+    """Сбрасывает запомненные проверки теста (ключ исправлен или тест удалён)"""
+    _memo.discard_if(lambda key: key[0] == test_id)
+
+
+def grading_memo_stats() -> dict:
+    return _memo.stats()
+
+
+def regrade_columns(answer_ids, numbers, answers, correct_map: dict) -> tuple[bytes, dict[int, tuple[float, int]]]:
+    """
+    Пакетная проверка всех ответов теста по новому ключу.
+
+    Ответы передаются столбцами одинаковой длины (по строке на вопрос каждой работы):
+    answer_ids — id работы, numbers — номер вопроса, answers — ответ ученика
+    (уже без пробелов по краям, как его сохраняет grade_answers).
+    Сравнение и подсчёт идут итераторами map/compress/Counter, без цикла
+    Python по отдельным ответам.
+    Возвращает:
+        - bytes с 1/0 (верно/неверно) для каждой строки
+        - {answer_id: (сумма баллов, число верных)} для каждой работы
+    """
+    expected = {number: correct for number, (correct, _) in correct_map.items()}
+    correct = bytes(map(eq, map(canonical_key, answers), map(expected.get, numbers)))
+
+    solved = Counter(compress(answer_ids, correct))
+
+    # Чаще всего у вопросов одна стоимость: она учитывается через число верных ответов,
+    # а отдельный проход по столбцам нужен только для вопросов с другой стоимостью
+    by_value = {}
+    for number, (_, value) in correct_map.items():
+        by_value.setdefault(value, set()).add(number)
+    base_value = max(by_value, key=lambda v: len(by_value[v]), default=0)
+
+    extra = dict.fromkeys(answer_ids, 0.0)
+    for value, value_numbers in by_value.items():
+        if value == base_value:
+            continue
+        mask = bytes(map(and_, correct, map(value_numbers.__contains__, numbers)))
+        for answer_id, count in Counter(compress(answer_ids, mask)).items():
+            extra[answer_id] += (value - base_value) * count
+
+    return correct, {
+        answer_id: (base_value * solved[answer_id] + delta, solved[answer_id])
+        for answer_id, delta in extra.items()
+    }
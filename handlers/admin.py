@@ -4,15 +4,24 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime
+import codecs
+import csv
+import math
 
 from config import OWNER_ID
-from db import (
-    is_admin_or_owner,
-    create_test, add_question, generate_code,
+from async_db import (
+    create_test_with_questions, generate_code,
     get_tests_by_admin, get_test_with_answers,
-    delete_test, add_admin, remove_admin, get_all_admins
+    delete_test, regrade_test, get_answer_key,
+    add_admin, remove_admin, get_all_admins,
+    answer_key_cache_stats, grading_memo_stats
 )
+from roles import is_admin_or_owner
+from delivery import outbox
+from scheduler import reminders
+from metrics import metrics
 from utils.helpers import parse_deadline_input
+from utils.normalizer import normalize_answer
 
 router = Router()
 
@@ -27,6 +36,11 @@ class CreateTestState(StatesGroup):
     confirm = State()
 
 
+class EditKeyState(StatesGroup):
+    waiting_for_changes = State()
+    confirm = State()
+
+
 class FSMOwner(StatesGroup):
     adding = State()
     removing = State()
@@ -60,28 +74,7 @@ async def confirm_test_title(message: Message, state: FSMContext):
 async def title_confirmed(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("✅ Название подтверждено. Теперь введите вопросы.")
     await state.set_state(CreateTestState.waiting_for_questions)
-    await callback.message.answer(
-        "✏️ ВВЕДИ ВОПРОСЫ И БАЛЛЫ ПОСТРОЧНО. КАЖДЫЙ В ФОРМАТЕ:\n\n"
-        "НОМЕР ОТВЕТ БАЛЛ\n"
-        "Баллы должны быть положительными и кратны 0.5 (например: 1, 2.5, 3.0)\n\n"
-        "✅ ДОПУСТИМЫЕ ОТВЕТЫ:\n"
-        "• A, B, C\n"
-        "• Целые числа (например: 1, -12, 12345)\n"
-        "• Простые дроби (например: 3/4, -2/3)\n"
-        "• Десятичные числа (например: 0.667, -0.75, 123.4)\n"
-        "• Максимум 5 символов (или 6 с минусом)\n\n"
-        "✅ ПРИМЕРЫ:\n"
-        "1 A 1\n"
-        "2 3/4 0.5\n"
-        "3 -2/3 1.5\n"
-        "4 -0.75 2\n"
-        "5 0.667 2.5\n"
-        "6 12345 1\n"
-        "7 123.4 3\n"
-        "8 -12.3 2.5\n"
-        "9 -1.5 1.5\n"
-        "10 B 1\n"
-    )
+    await callback.message.answer(QUESTIONS_FORMAT_HELP + QUESTIONS_FILE_HINT)
 
 
 @router.callback_query(F.data == "edit_title")
@@ -90,62 +83,117 @@ async def edit_title(callback: CallbackQuery, state: FSMContext):
     await state.set_state(CreateTestState.waiting_for_title)
 
 
-@router.message(CreateTestState.waiting_for_questions)
+QUESTIONS_FORMAT_HELP = (
+    "✏️ ВВЕДИ ВОПРОСЫ И БАЛЛЫ ПОСТРОЧНО. КАЖДЫЙ В ФОРМАТЕ:\n"
+    "НОМЕР ОТВЕТ БАЛЛ\n\n"
+    "Баллы должны быть положительными и кратны 0.5 (например: 1, 2.5, 3.0)\n\n"
+    "✅ ДОПУСТИМЫЕ ОТВЕТЫ:\n"
+    "• A, B, C\n"
+    "• Целые числа (например: 1, -12, 12345)\n"
+    "• Простые дроби (например: 3/4, -2/3)\n"
+    "• Десятичные числа (например: 0.667, -0.75, 123.4)\n"
+    "• Максимум 5 символов (или 6 с минусом)\n\n"
+    "✅ ПРИМЕРЫ:\n"
+    "1 A 1\n"
+    "2 3/4 0.5\n"
+    "3 -2/3 1.5\n"
+    "4 -0.75 2\n"
+    "5 0.667 2.5\n"
+    "6 12345 1\n"
+    "7 123.4 3\n"
+    "8 -12.3 2.5\n"
+    "9 -1.5 1.5\n"
+    "10 B 1\n"
+)
+QUESTIONS_FILE_HINT = "\n📎 Большой ключ можно прислать файлом .csv или .txt — по вопросу на строку."
+
+# Файлы с ключом больше этого размера не принимаются
+MAX_KEY_FILE_SIZE = 1024 * 1024
+# Сколько ошибочных строк файла показывать админу
+MAX_REPORTED_ERRORS = 15
+# Сколько вопросов показывать в предпросмотре, чтобы не упереться в лимит длины сообщения
+PREVIEW_LIMIT = 50
+
+
+def parse_question_line(line: str, seen: set = None) -> tuple[int, str, float]:
+    """
+    Разбирает строку ключа "НОМЕР ОТВЕТ БАЛЛ". При ошибке бросает ValueError с текстом для админа.
+    seen — номера уже разобранных строк того же ключа: повтор номера считается ошибкой.
+    """
+    parts = line.strip().split()
+    if len(parts) < 3:
+        raise ValueError(f"НЕДОСТАТОЧНО ЭЛЕМЕНТОВ В СТРОКЕ:\n{line}")
+    try:
+        q = int(parts[0])
+        score_val = float(parts[-1])
+    except ValueError:
+        raise ValueError(f"НОМЕР ИЛИ БАЛЛ НЕ ЧИСЛО В СТРОКЕ:\n{line}")
+    # nan, inf, ноль и отрицательные баллы сломали бы максимальный балл и порядок в таблице результатов
+    if not math.isfinite(score_val) or score_val <= 0 or (score_val * 2) % 1:
+        raise ValueError(f"БАЛЛ ДОЛЖЕН БЫТЬ ПОЛОЖИТЕЛЬНЫМ И КРАТНЫМ 0.5 (1, 2.5, 3) В СТРОКЕ:\n{line}")
+    answer = " ".join(parts[1:-1])
+
+    # Длина ответа и дроби (2/3 → 0.667) проверяются так же, как у ответов учеников
+    try:
+        answer = normalize_answer(answer)
+    except ValueError as e:
+        raise ValueError(f"{e} В СТРОКЕ:\n{line}")
+
+    if seen is not None:
+        if q in seen:
+            raise ValueError(f"НОМЕР ВОПРОСА ПОВТОРЯЕТСЯ В СТРОКЕ:\n{line}")
+        seen.add(q)
+    return q, answer, score_val
+
+
+def preview_questions(questions: list) -> str:
+    preview = "\n".join([f"{q}. {a} (+{s})" for q, a, s in questions[:PREVIEW_LIMIT]])
+    if len(questions) > PREVIEW_LIMIT:
+        preview += f"\n… и ещё {len(questions) - PREVIEW_LIMIT}"
+    return preview
+
+
+async def iter_document_lines(bot, document):
+    """Читает присланный файл по частям и отдаёт строки, не загружая его в память целиком"""
+    file = await bot.get_file(document.file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    async for chunk in bot.session.stream_content(url):
+        *lines, tail = (tail + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            yield line
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def key_row_to_line(row: str, delimiter: str) -> str:
+    """Строку CSV ("1;A;1" или "1,A,1") приводит к виду "НОМЕР ОТВЕТ БАЛЛ" """
+    cells = [cell.strip() for cell in next(csv.reader([row], delimiter=delimiter))]
+    if cells:
+        # Excel с русской локалью пишет баллы с запятой: 1,5
+        cells[-1] = cells[-1].replace(",", ".")
+    return " ".join(cells)
+
+
+@router.message(CreateTestState.waiting_for_questions, F.text)
 async def receive_questions(message: Message, state: FSMContext):
     lines = message.text.strip().splitlines()
     questions = []
+    seen = set()
 
     for line in lines:
         try:
-            parts = line.strip().split()
-            if len(parts) < 3:
-                raise ValueError(f"НЕДОСТАТОЧНО ЭЛЕМЕНТОВ В СТРОКЕ:\n{line}")
-            q = int(parts[0])
-            score_val = float(parts[-1])
-            answer = " ".join(parts[1:-1])
-
-            # Проверяем длину ответа (не более 5 символов без минуса, 6 с минусом)
-            if len(answer.replace("-", "")) > 5:
-                raise ValueError(f"ОТВЕТ ПРЕВЫШАЕТ ДОПУСТИМУЮ ДЛИНУ В СТРОКЕ:\n{line}")
-
-            # Преобразуем допустимые дроби в десятичный формат (например: 2/3 → 0.667)
-            if "/" in answer and answer.replace("-", "").count("/") == 1:
-                try:
-                    sign = "-" if answer.startswith("-") else ""
-                    num, denom = answer.replace("-", "").split("/")
-                    frac_val = float(int(num)) / int(denom)
-                    point = str(5-(len(str(int(frac_val)))+1))
-                    answer = f"{sign}{frac_val:.{point}f}".rstrip("0").rstrip(".")
-                except Exception:
-                    raise ValueError("НЕКОРРЕКТНАЯ ДРОБЬ В СТРОКЕ:\n{line}")
-
-            questions.append((q, answer.strip(), score_val))
+            questions.append(parse_question_line(line, seen))
         except Exception as e:
-            await message.answer(
-                f"❌ {e}\n\n"
-                "✏️ ВВЕДИ ВОПРОСЫ И БАЛЛЫ ПОСТРОЧНО. КАЖДЫЙ В ФОРМАТЕ:\n"
-                "НОМЕР ОТВЕТ БАЛЛ\n\n"
-                "Баллы должны быть положительными и кратны 0.5 (например: 1, 2.5, 3.0)\n\n"
-                "✅ ДОПУСТИМЫЕ ОТВЕТЫ:\n"
-                "• A, B, C\n"
-                "• Целые числа (например: 1, -12, 12345)\n"
-                "• Простые дроби (например: 3/4, -2/3)\n"
-                "• Десятичные числа (например: 0.667, -0.75, 123.4)\n"
-                "• Максимум 5 символов (или 6 с минусом)\n\n"
-                "✅ ПРИМЕРЫ:\n"
-                "1 A 1\n"
-                "2 3/4 0.5\n"
-                "3 -2/3 1.5\n"
-                "4 -0.75 2\n"
-                "5 0.667 2.5\n"
-                "6 12345 1\n"
-                "7 123.4 3\n"
-                "8 -12.3 2.5\n"
-                "9 -1.5 1.5\n"
-                "10 B 1\n"
-            )
+            await message.answer(f"❌ {e}\n\n" + QUESTIONS_FORMAT_HELP)
             return
 
+    await show_questions_preview(message, state, questions)
+
+
+async def show_questions_preview(message: Message, state: FSMContext, questions: list):
     await state.update_data(questions=questions)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -154,11 +202,56 @@ async def receive_questions(message: Message, state: FSMContext):
         ],
         [InlineKeyboardButton(text="❌ Отменить создание", callback_data="cancel_create_test")]
     ])
-    preview = "\n".join([f"{q}. {a} (+{s})" for q, a, s in questions])
-    await message.answer(f"Вот что получилось:\n\n{preview}\n\nПодтвердите?", reply_markup=keyboard)
+    await message.answer(
+        f"Вот что получилось ({len(questions)} вопр.):\n\n{preview_questions(questions)}\n\nПодтвердите?",
+        reply_markup=keyboard
+    )
     await state.set_state(CreateTestState.waiting_for_questions_confirm)
 
 
+@router.message(CreateTestState.waiting_for_questions, F.document)
+async def receive_questions_file(message: Message, state: FSMContext):
+    document = message.document
+    name = (document.file_name or "").lower()
+    if not name.endswith((".csv", ".txt")):
+        return await message.answer("❌ Пришли файл .csv или .txt.")
+    if document.file_size and document.file_size > MAX_KEY_FILE_SIZE:
+        return await message.answer("❌ Файл слишком большой (больше 1 МБ).")
+
+    questions = []
+    seen = set()
+    errors = []
+    delimiter = None
+    line_no = 0
+    async for raw in iter_document_lines(message.bot, document):
+        line_no += 1
+        if name.endswith(".csv") and raw.strip():
+            if delimiter is None:
+                delimiter = ";" if ";" in raw else ","
+            raw = key_row_to_line(raw, delimiter)
+        raw = raw.strip()
+        if not raw:
+            continue
+        if not questions and not errors and not raw.split()[0].lstrip("-").isdigit():
+            # первая непустая строка без номера — заголовок таблицы
+            continue
+
+        try:
+            questions.append(parse_question_line(raw, seen))
+        except ValueError as e:
+            errors.append(f"Строка {line_no}: {str(e).splitlines()[0].rstrip(':')}")
+
+    if errors:
+        report = "\n".join(errors[:MAX_REPORTED_ERRORS])
+        if len(errors) > MAX_REPORTED_ERRORS:
+            report += f"\n… и ещё {len(errors) - MAX_REPORTED_ERRORS} ошибок"
+        return await message.answer(f"❌ В файле есть ошибки:\n\n{report}\n\nИсправь и пришли файл снова.")
+    if not questions:
+        return await message.answer("❌ В файле нет ни одного вопроса.")
+
+    await show_questions_preview(message, state, questions)
+
+
 @router.callback_query(F.data == "confirm_questions")
 async def confirm_questions(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("✅ Вопросы подтверждены. Теперь введите дедлайн.")
@@ -168,28 +261,7 @@ async def confirm_questions(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "edit_questions")
 async def redo_questions(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text(
-        "✏️ ВВЕДИ ВОПРОСЫ И БАЛЛЫ ПОСТРОЧНО. КАЖДЫЙ В ФОРМАТЕ:\n\n"
-        "НОМЕР ОТВЕТ БАЛЛ\n"
-        "Баллы должны быть положительными и кратны 0.5 (например: 1, 2.5, 3.0)\n\n"
-        "✅ ДОПУСТИМЫЕ ОТВЕТЫ:\n"
-        "• A, B, C\n"
-        "• Целые числа (например: 1, -12, 12345)\n"
-        "• Простые дроби (например: 3/4, -2/3)\n"
-        "• Десятичные числа (например: 0.667, -0.75, 123.4)\n"
-        "• Максимум 5 символов (или 6 с минусом)\n\n"
-        "✅ ПРИМЕРЫ:\n"
-        "1 A 1\n"
-        "2 3/4 0.5\n"
-        "3 -2/3 1.5\n"
-        "4 -0.75 2\n"
-        "5 0.667 2.5\n"
-        "6 12345 1\n"
-        "7 123.4 3\n"
-        "8 -12.3 2.5\n"
-        "9 -1.5 1.5\n"
-        "10 B 1\n"
-    )
+    await callback.message.edit_text(QUESTIONS_FORMAT_HELP + QUESTIONS_FILE_HINT)
     await state.set_state(CreateTestState.waiting_for_questions)
 
 
@@ -200,13 +272,14 @@ async def receive_deadline(message: Message, state: FSMContext):
         await message.answer("❌ Неверный формат. Пример: 22:00 или 22:00 07.07.2025")
         return
 
-    await state.update_data(deadline=deadline)
+    # В состоянии FSM хранятся только JSON-совместимые значения
+    await state.update_data(deadline=deadline.isoformat())
     data = await state.get_data()
     title = data["title"]
     questions = data["questions"]
     deadline_str = deadline.strftime("%H:%M %d.%m.%Y")
 
-    preview = "\n".join([f"{q}. {a} (+{s})" for q, a, s in questions])
+    preview = preview_questions(questions)
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(text="✅ Подтвердить", callback_data="confirm_create_test"),
@@ -234,18 +307,16 @@ async def confirm_create(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     title = data["title"]
     questions = data["questions"]
-    deadline = data["deadline"]
+    deadline = datetime.fromisoformat(data["deadline"])
     # Ensure deadline is timezone-aware, default to +5:00 if not set
     from datetime import timezone, timedelta
     if deadline.tzinfo is None:
         deadline = deadline.replace(tzinfo=timezone(timedelta(hours=5)))
     admin_id = callback.from_user.id
 
-    code = generate_code()
-    test_id = create_test(title=title, code=code, admin_id=admin_id, deadline=deadline)
-
-    for q, a, s in questions:
-        add_question(test_id, q, a, s)
+    code = await generate_code()
+    await create_test_with_questions(title=title, code=code, admin_id=admin_id, deadline=deadline,
+                                     questions=questions)
 
     await callback.message.edit_text(f"✅ Тест создан!\nКод: <code>{code}</code>", parse_mode="HTML")
     await state.clear()
@@ -261,7 +332,7 @@ async def cancel_create(callback: CallbackQuery, state: FSMContext):
 async def list_admins(message: Message):
     if message.from_user.id != OWNER_ID:
         return
-    admins = get_all_admins()
+    admins = await get_all_admins()
     if not admins:
         await message.answer("Список админов пуст.")
     else:
@@ -269,6 +340,70 @@ async def list_admins(message: Message):
         await message.answer(text)
 
 
+@router.message(F.text == "/cache")
+async def show_cache_stats(message: Message):
+    if message.from_user.id != OWNER_ID:
+        return
+    lines = []
+    for title, stats in (("🔑 Кэш ключей ответов", answer_key_cache_stats()),
+                         ("🧮 Кэш проверки одинаковых ответов", grading_memo_stats())):
+        lines.append(
+            f"<b>{title}</b>\n"
+            f"Записей: {stats['size']} из {stats['maxsize']}\n"
+            f"Попаданий: {stats['hits']}\n"
+            f"Промахов: {stats['misses']}\n"
+            f"Вытеснено: {stats['evictions']}\n"
+            f"Доля попаданий: {stats['hit_rate'] * 100:.1f}%"
+        )
+    await message.answer("\n\n".join(lines), parse_mode="HTML")
+
+
+@router.message(F.text == "/queue")
+async def show_queue_stats(message: Message):
+    if message.from_user.id != OWNER_ID:
+        return
+    stats = outbox.stats()
+    await message.answer(
+        "📮 <b>Очередь исходящих сообщений</b>\n"
+        f"В очереди: {stats['queue_depth']}\n"
+        f"Отправлено: {stats['sent']}\n"
+        f"Ошибок: {stats['failed']}\n"
+        f"Повторов: {stats['retries']} (флуд-контроль: {stats['flood_waits']})\n"
+        f"Ожидание в очереди p50/p95: {stats['queue_wait_p50']} / {stats['queue_wait_p95']} с\n"
+        f"Доставка p50/p95: {stats['latency_p50']} / {stats['latency_p95']} с",
+        parse_mode="HTML"
+    )
+
+
+def _format_timings(title: str, rows: list[dict]) -> str:
+    if not rows:
+        return f"<b>{title}</b>\nПока нет данных"
+    lines = [f"<b>{title}</b>"]
+    for row in rows:
+        errors = f", ошибок: {row['errors']}" if row["errors"] else ""
+        lines.append(
+            f"<code>{row['name']}</code> — {row['count']} раз, всего {row['total']} с{errors}\n"
+            f"   p50/p95/p99: {row['p50']} / {row['p95']} / {row['p99']} мс, макс. {row['max']} мс"
+        )
+    return "\n".join(lines)
+
+
+@router.message(F.text.in_({"/stats", "/stats reset"}))
+async def show_timing_stats(message: Message):
+    if message.from_user.id != OWNER_ID:
+        return
+    if message.text == "/stats reset":
+        metrics.reset()
+        await message.answer("🧹 Замеры сброшены.")
+        return
+    await message.answer(
+        _format_timings("⏱ Обработчики (по суммарному времени)", metrics.top("handlers")) + "\n\n" +
+        _format_timings("🗄 Обращения к БД (по суммарному времени)", metrics.top("db_calls")) + "\n\n" +
+        "Сбросить замеры: /stats reset",
+        parse_mode="HTML"
+    )
+
+
 @router.message(F.text == "➕ Добавить админа")
 async def ask_add_admin(message: Message, state: FSMContext):
     if message.from_user.id != OWNER_ID:
@@ -281,7 +416,7 @@ async def ask_add_admin(message: Message, state: FSMContext):
 async def do_add_admin(message: Message, state: FSMContext):
     try:
         admin_id = int(message.text.strip())
-        add_admin(admin_id)
+        await add_admin(admin_id)
         await message.answer(f"✅ Админ {admin_id} добавлен.")
     except:
         await message.answer("❌ Неверный ID.")
@@ -300,20 +435,29 @@ async def ask_remove_admin(message: Message, state: FSMContext):
 async def do_remove_admin(message: Message, state: FSMContext):
     try:
         admin_id = int(message.text.strip())
-        remove_admin(admin_id)
+        await remove_admin(admin_id)
         await message.answer(f"✅ Админ {admin_id} удалён.")
     except:
         await message.answer("❌ Неверный ID.")
     await state.clear()
 
 
+async def can_view_results(user_id: int, test_id: int) -> bool:
+    """Результаты теста видят владелец бота и админ, создавший тест"""
+    if user_id == OWNER_ID:
+        return True
+    if not is_admin_or_owner(user_id):
+        return False
+    return any(own_test_id == test_id for own_test_id, _ in await get_tests_by_admin(user_id))
+
+
 @router.message(F.text.lower() == "мои тесты")
 async def show_my_tests(message: Message):
     user_id = message.from_user.id
     if not is_admin_or_owner(user_id):
         return
 
-    tests = get_tests_by_admin(user_id)
+    tests = await get_tests_by_admin(user_id)
     if not tests:
         await message.answer("📭 У тебя пока нет тестов.")
         return
@@ -331,8 +475,10 @@ async def show_test_info(callback: CallbackQuery):
         test_id = int(callback.data.split(":")[1])
     except:
         return await callback.message.answer("❌ Ошибка обработки запроса.")
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
 
-    data = get_test_with_answers(test_id)
+    data = await get_test_with_answers(test_id)
     if not data:
         return await callback.message.edit_text("❌ Тест не найден.")
 
@@ -349,6 +495,8 @@ async def show_test_info(callback: CallbackQuery):
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📊 Посмотреть результаты", callback_data=f"view_results:{test_id}")],
+        [InlineKeyboardButton(text="📥 Экспорт", callback_data=f"export_results:{test_id}")],
+        [InlineKeyboardButton(text="✏️ Исправить ключ", callback_data=f"edit_key:{test_id}")],
         [InlineKeyboardButton(text="🗑 Удалить тест", callback_data=f"delete_test_confirm:{test_id}")]
     ])
 
@@ -358,7 +506,9 @@ async def show_test_info(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("delete_test_confirm:"))
 async def confirm_delete(callback: CallbackQuery):
     test_id = int(callback.data.split(":")[1])
-    data = get_test_with_answers(test_id)
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+    data = await get_test_with_answers(test_id)
 
     if not data:
         return await callback.message.edit_text("❌ Тест не найден.")
@@ -389,93 +539,259 @@ async def confirm_delete(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("delete_test:"))
 async def do_delete(callback: CallbackQuery):
     test_id = int(callback.data.split(":")[1])
-    delete_test(test_id)
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+    await delete_test(test_id)
+    reminders.cancel_test(test_id)
     await callback.message.edit_text("✅ Тест успешно удалён.")
 
 
+# ====== ИСПРАВЛЕНИЕ КЛЮЧА И ПЕРЕСЧЁТ РАБОТ ======
+@router.callback_query(F.data.startswith("edit_key:"))
+async def ask_key_changes(callback: CallbackQuery, state: FSMContext):
+    test_id = int(callback.data.split(":")[1])
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+    await state.update_data(test_id=test_id)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_regrade")]
+    ])
+    await callback.message.answer(
+        "✏️ Отправьте исправленные строки ключа в формате:\n"
+        "НОМЕР ОТВЕТ БАЛЛ\n\n"
+        "Изменятся только указанные вопросы, после чего все работы по тесту будут пересчитаны.",
+        reply_markup=keyboard
+    )
+    await state.set_state(EditKeyState.waiting_for_changes)
+
+
+@router.message(EditKeyState.waiting_for_changes)
+async def receive_key_changes(message: Message, state: FSMContext):
+    if message.text is None:
+        # Файл, фото или стикер вместо строк ключа
+        await message.answer("❌ Отправьте исправленные строки ключа текстом.\n\n" + QUESTIONS_FORMAT_HELP)
+        return
+    data = await state.get_data()
+    answer_key = await get_answer_key(data["test_id"])
+    current = {q["question_number"]: q for q in answer_key["questions"]}
+
+    changes = []
+    seen = set()
+    for line in message.text.strip().splitlines():
+        try:
+            q, a, s = parse_question_line(line, seen)
+        except Exception as e:
+            await message.answer(f"❌ {e}\n\n" + QUESTIONS_FORMAT_HELP)
+            return
+        if q not in current:
+            await message.answer(f"❌ В тесте нет вопроса №{q}. Исправить можно только существующие вопросы.")
+            return
+        changes.append((q, a, s))
+
+    await state.update_data(key_changes=changes)
+    preview = "\n".join(
+        f"{q}. {current[q]['correct_answer']} (+{current[q]['score']}) → {a} (+{s})" for q, a, s in changes
+    )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Исправить и пересчитать", callback_data="confirm_regrade"),
+            InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_regrade")
+        ]
+    ])
+    await message.answer(f"Изменения ключа:\n\n{preview}\n\nПодтвердите?", reply_markup=keyboard)
+    await state.set_state(EditKeyState.confirm)
+
+
+@router.callback_query(F.data == "confirm_regrade", EditKeyState.confirm)
+async def do_regrade(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    # test_id пришёл из callback_data ещё в ask_key_changes — права проверяются заново
+    if not await can_view_results(callback.from_user.id, data["test_id"]):
+        await state.clear()
+        return await callback.answer("🚫 Недостаточно прав.")
+    await callback.message.edit_text("⏳ Пересчитываю работы...")
+    regraded = await regrade_test(data["test_id"], data["key_changes"])
+    await callback.message.edit_text(f"✅ Ключ исправлен. Пересчитано работ: {regraded}.")
+    await state.clear()
+
+
+@router.callback_query(F.data == "cancel_regrade")
+async def cancel_regrade(callback: CallbackQuery, state: FSMContext):
+    await callback.message.edit_text("❌ Исправление ключа отменено.")
+    await state.clear()
+
+
 # ====== РЕЗУЛЬТАТЫ ТЕСТА И ОТВЕТЫ УЧАСТНИКОВ ======
-from db import get_test_results, get_user_answers_detailed
-from aiogram.utils.markdown import hbold
+from async_db import get_results_page, get_participant_result, get_user_answers_detailed, export_results_csv
+from aiogram.types import FSInputFile
+from html import escape
+import os
+
+
+def _page_anchor(row: dict) -> str:
+    """Ключ строки для callback_data: балл и answer_id (укладывается в лимит 64 байта)"""
+    return f"{float(row['score'])!r}:{row['answer_id']}"
+
+
+def _parse_anchor(score: str, answer_id: str) -> tuple[float, int]:
+    return float(score), int(answer_id)
+
+
+def format_results_page(page: dict) -> str:
+    lines = ["📊 <b>Результаты участников:</b>\n"]
+    for row in page["rows"]:
+        name = escape(f"{row['last_name']} {row['first_name']}")
+        lines.append(f"<b>{row['place']}.</b> {name} — {row['score']} из {row['max_score']} (✅ {row['solved']})")
+    return "\n".join(lines)
+
+
+def results_page_keyboard(test_id: int, page: dict) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    rows = page["rows"]
+    back_anchor = _page_anchor(rows[0])
+
+    # Кнопки участников ведут к их ответам и помнят страницу, на которую вернуться
+    for row in rows:
+        name = f"{row['last_name']} {row['first_name']}"
+        builder.button(
+            text=f"{row['place']}. {name[:24]}",
+            callback_data=f"res_user:{test_id}:{row['user_id']}:{back_anchor}"
+        )
+    builder.adjust(2)
+
+    nav = []
+    if page["has_prev"]:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"res:{test_id}:p:{back_anchor}"))
+    if page["has_next"]:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"res:{test_id}:n:{_page_anchor(rows[-1])}"))
+    if nav:
+        builder.row(*nav)
+    return builder.as_markup()
+
+
+def format_user_answers(answers: list[dict]) -> str:
+    answers_block = "📋 <b>ОТВЕТЫ УЧАСТНИКА:</b>\n\n"
+    for item in answers:
+        q_num = item["question_number"]
+        # Ответы хранятся уже нормализованными (дроби — в десятичной записи)
+        answer = item["user_answer"]
+        is_correct = item["is_correct"]
+        score = item["score"]
+
+        icon = "✅" if is_correct else "❌"
+        answers_block += f"{q_num}. {escape(answer)} ({score}) {icon}\n"
+    return answers_block
+
 
 @router.callback_query(F.data.startswith("view_results:"))
 async def view_results(callback: CallbackQuery):
     test_id = int(callback.data.split(":")[1])
-    results = get_test_results(test_id)  # Должен возвращать список участников с баллами по убыванию
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+    page = await get_results_page(test_id)
 
-    if not results:
+    if not page["rows"]:
         return await callback.message.answer("📭 Пока никто не сдал этот тест.")
 
-    await callback.message.answer("📊 <b>Результаты участников:</b>", parse_mode="HTML")
+    # Вся таблица — одно сообщение, страницы листаются его редактированием
+    await callback.message.answer(
+        format_results_page(page), parse_mode="HTML", reply_markup=results_page_keyboard(test_id, page)
+    )
 
 
-    for result in results:
-        first_name = result["first_name"]
-        last_name = result["last_name"]
-        username = f'@{result["username"]}' if result.get("username") else None
-        submitted_at = datetime.fromisoformat(result["submitted_at"])
-        score = result["score"]
-        max_score = result["max_score"]
-        solved = result["solved"]
-        total = result["total"]
-        user_id = result["user_id"]
+@router.callback_query(F.data.startswith("res:"))
+async def turn_results_page(callback: CallbackQuery):
+    _, test_id, direction, score, answer_id = callback.data.split(":")
+    test_id = int(test_id)
+    direction = {"n": "next", "p": "prev", "s": "from"}[direction]
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
 
-        text = (
-            "👤 <b>УЧАСТНИК</b>\n\n"
-            f"Ф.И.О: {last_name} {first_name}\n"
-        )
+    page = await get_results_page(test_id, _parse_anchor(score, answer_id), direction)
+    if not page["rows"]:
+        # после исправления ключа баллы могли сместиться и страница опустела — начинаем сначала
+        page = await get_results_page(test_id)
+    if not page["rows"]:
+        return await callback.message.edit_text("📭 Пока никто не сдал этот тест.")
 
-        if username:
-            text += f"🆔 Юзернейм: {username}\n"
+    await callback.message.edit_text(
+        format_results_page(page), parse_mode="HTML", reply_markup=results_page_keyboard(test_id, page)
+    )
+    await callback.answer()
 
-        text += (
-            f"🕒 Время сдачи: {submitted_at.strftime('%d.%m.%Y %H:%M')}\n\n"
-            f"✅ Заданий решено: {solved} из {total}\n"
-            f"💯 Баллов набрано: {score} из {max_score}\n"
-        )
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔍 Посмотреть ответы", callback_data=f"view_user_answers:{test_id}:{user_id}")]
-        ])
+@router.callback_query(F.data.startswith("res_user:"))
+async def view_result_details(callback: CallbackQuery):
+    _, test_id, user_id, score, answer_id = callback.data.split(":")
+    test_id = int(test_id)
+    user_id = int(user_id)
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+
+    result = await get_participant_result(test_id, user_id)
+    if not result:
+        return await callback.answer("❌ Ответы не найдены.")
+    answers = await get_user_answers_detailed(test_id, user_id)
+
+    submitted_at = datetime.fromisoformat(result["submitted_at"])
+    text = (
+        "👤 <b>УЧАСТНИК</b>\n\n"
+        f"Ф.И.О: {escape(result['last_name'] or '')} {escape(result['first_name'] or '')}\n"
+    )
+    if result["username"]:
+        text += f"🆔 Юзернейм: @{result['username']}\n"
+    text += (
+        f"🕒 Время сдачи: {submitted_at.strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"✅ Заданий решено: {result['solved']} из {result['total']}\n"
+        f"💯 Баллов набрано: {result['score']} из {result['max_score']}\n\n"
+    )
+    text += format_user_answers(answers)
 
-        await callback.message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="⬅️ К таблице", callback_data=f"res:{test_id}:s:{score}:{answer_id}")]
+    ])
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("export_results:"))
+async def export_results(callback: CallbackQuery):
+    test_id = int(callback.data.split(":")[1])
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
+    await callback.answer("⏳ Готовлю файл...")
 
+    # Файл пишется в потоке БД построчно — бот не замирает даже на больших тестах
+    path, count = await export_results_csv(test_id)
+    try:
+        if not count:
+            return await callback.message.answer("📭 Пока никто не сдал этот тест.")
+        await callback.message.answer_document(
+            FSInputFile(path, filename=f"results_{test_id}.csv"),
+            caption=f"📥 Результаты теста: {count} чел."
+        )
+    finally:
+        os.remove(path)
 
+
+# Карточки участников из старых сообщений (до таблицы результатов)
 @router.callback_query(F.data.startswith("view_user_answers:"))
 async def view_user_answers(callback: CallbackQuery):
     _, test_id, user_id = callback.data.split(":")
     test_id = int(test_id)
     user_id = int(user_id)
+    if not await can_view_results(callback.from_user.id, test_id):
+        return await callback.answer("🚫 Недостаточно прав.")
 
-    answers = get_user_answers_detailed(test_id, user_id)
+    answers = await get_user_answers_detailed(test_id, user_id)
     if not answers:
         return await callback.message.answer("❌ Ответы не найдены.")
 
     # Получим текст предыдущего сообщения (где информация об участнике)
     original_text = callback.message.text or ""
 
-    # Формируем блок с ответами
-    answers_block = "\n\n📋 <b>ОТВЕТЫ УЧАСТНИКА:</b>\n\n"
-    for item in answers:
-        q_num = item["question_number"]
-        answer = item["user_answer"]
-        # Аналогичная обработка дробей для отображения
-        if "/" in answer and answer.replace("-", "").count("/") == 1:
-            try:
-                num, denom = answer.replace("-", "").split("/")
-                frac_val = float(int(num)) / int(denom)
-                if answer.startswith("-"):
-                    frac_val = -frac_val
-                answer = f"{frac_val:.3f}".rstrip("0").rstrip(".")
-            except:
-                answer = "НЕКОРРЕКТНАЯ ДРОБЬ"
-        is_correct = item["is_correct"]
-        score = item["score"]
-
-        icon = "✅" if is_correct else "❌"
-        answers_block += f"{q_num}. {answer} ({score}) {icon}\n"
-
     # Объединяем исходный текст + блок с ответами
-    updated_text = original_text.strip() + answers_block
+    updated_text = original_text.strip() + "\n\n" + format_user_answers(answers)
 
     # Кнопка "Свернуть"
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
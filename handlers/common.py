@@ -1,38 +1,19 @@
+from datetime import datetime
+from html import escape
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 
-from config import OWNER_ID
-from db import is_admin, get_connection
+from async_db import touch_user, save_user_name, get_user_summary, get_user_history_page
+from roles import get_role, ROLE_TITLES
 from keyboards import get_main_keyboard
 
 router = Router()
 
 
-def ensure_users_table_has_needed_columns():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in cursor.fetchall()]
-
-    if "full_name" not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
-        conn.commit()
-    if "first_name" not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN first_name TEXT")
-        conn.commit()
-    if "last_name" not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN last_name TEXT")
-        conn.commit()
-    if "username" not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN username TEXT")
-        conn.commit()
-
-    cursor.close()
-    conn.close()
-
-
 # --- Состояния регистрации ---
 class UserRegistration(StatesGroup):
     waiting_for_name = State()
@@ -42,48 +23,23 @@ class UserRegistration(StatesGroup):
 # --- /start ---
 @router.message(F.text == "/start")
 async def start_handler(message: Message, state: FSMContext):
-    ensure_users_table_has_needed_columns()
-
     username = message.from_user.username
     user_id = message.from_user.id
-    conn = get_connection()
-    cursor = conn.cursor()
 
     # Обновляем username (если нужно, добавляем пользователя)
-    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    exists = cursor.fetchone()
-    if exists:
-        cursor.execute("UPDATE users SET username = ? WHERE user_id = ?", (username, user_id))
-    else:
-        cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
-    conn.commit()
-
-    cursor.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-
-    if row and row[0]:
-        full_name = row[0]
-    else:
+    full_name = await touch_user(user_id, username)
+
+    if not full_name:
         await message.answer("📝 Отправьте ваше имя и фамилию на латинице\nпример: Ivanov Ivan:")
         await state.set_state(UserRegistration.waiting_for_name)
-        cursor.close()
-        conn.close()
         return
 
-    cursor.close()
-    conn.close()
-
-    if user_id == OWNER_ID:
-        role = "👑 Владелец"
-    elif is_admin(user_id):
-        role = "🛡 Админ"
-    else:
-        role = "👤 Пользователь"
+    role = get_role(user_id)
 
     await message.answer(
-        f"👋 Добро пожаловать, <b>{full_name}</b>!\nТы вошёл как: <b>{role}</b>",
+        f"👋 Добро пожаловать, <b>{full_name}</b>!\nТы вошёл как: <b>{ROLE_TITLES[role]}</b>",
         parse_mode="HTML",
-        reply_markup=get_main_keyboard(user_id, is_user=(role == '👤 Пользователь'))
+        reply_markup=get_main_keyboard(role)
     )
 
 
@@ -127,37 +83,19 @@ async def confirm_name(callback: CallbackQuery, state: FSMContext):
     first_name = data.get("first_name")
     last_name = data.get("last_name")
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO users (user_id, full_name, first_name, last_name, username)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(user_id) DO UPDATE SET
-            full_name = excluded.full_name,
-            first_name = excluded.first_name,
-            last_name = excluded.last_name,
-            username = excluded.username
-    """, (user_id, full_name, first_name, last_name, username))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    await save_user_name(user_id, full_name, first_name, last_name, username)
 
     await state.clear()
 
-    if user_id == OWNER_ID:
-        role = "👑 Владелец"
-    elif is_admin(user_id):
-        role = "🛡 Админ"
-    else:
-        role = "👤 Пользователь"
+    role = get_role(user_id)
 
     await callback.message.edit_text(
-        f"✅ Спасибо, {full_name}!\nТы вошёл как: <b>{role}</b>",
+        f"✅ Спасибо, {full_name}!\nТы вошёл как: <b>{ROLE_TITLES[role]}</b>",
         parse_mode="HTML"
     )
     await callback.message.answer(
         "📋 Главное меню:",
-        reply_markup=get_main_keyboard(user_id, is_user=(role == '👤 Пользователь'))
+        reply_markup=get_main_keyboard(role)
     )
 
 
@@ -169,31 +107,59 @@ async def redo_name(callback: CallbackQuery, state: FSMContext):
 
 
 # --- Мой профиль ---
+def format_profile(summary: dict, page: dict) -> str:
+    lines = [
+        "<b>📊 Мой профиль:</b>",
+        f"Пройдено тестов: {summary['tests_taken']}, средний результат: {summary['average_percent']}%\n",
+    ]
+    for row in page["rows"]:
+        date = datetime.fromisoformat(row["submitted_at"]).strftime("%d.%m.%Y %H:%M") if row["submitted_at"] else "—"
+        lines.append(
+            f"📄 <b>{escape(row['title'] or '')}</b>\n"
+            f"📅 {date}\n"
+            f"🏆 Место: {row['place']} из {row['participants']}\n"
+            f"Решено: {row['solved']}\n"
+            f"Баллы: {row['score']} из {row['max_score']}\n"
+        )
+    return "\n".join(lines).strip()
+
+
+def profile_keyboard(page: dict) -> Optional[InlineKeyboardMarkup]:
+    rows = page["rows"]
+    nav = []
+    if page["has_prev"]:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"prof:p:{rows[0]['answer_id']}"))
+    if page["has_next"]:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"prof:n:{rows[-1]['answer_id']}"))
+    return InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+
 @router.message(F.text == "Мой профиль")
 async def profile_handler(message: Message):
     user_id = message.from_user.id
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT t.title, a.answer_text, a.submitted_at
-        FROM answers a
-        JOIN tests t ON t.test_id = a.test_id
-        WHERE a.user_id = ?
-        ORDER BY a.submitted_at DESC
-    """, (user_id,))
-    rows = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
-
-    if not rows:
+    summary = await get_user_summary(user_id)
+    page = await get_user_history_page(user_id) if summary else None
+
+    if not page or not page["rows"]:
         return await message.answer("📭 Ты пока не проходил ни одного теста.")
 
-    response = "<b>📊 Мой профиль:</b>\n\n"
-    for title, answer_text, date in rows:
-        # 'date' is used as a string directly, no datetime conversion is done
-        num_answers = len(answer_text.strip().splitlines())
-        response += f"📄 <b>{title}</b>\n📅 {date}\nОтветов: {num_answers}\n\n"
+    # Историю листают редактированием одного сообщения, по странице за раз
+    await message.answer(format_profile(summary, page), parse_mode="HTML", reply_markup=profile_keyboard(page))
+
 
-    await message.answer(response.strip(), parse_mode="HTML")
+@router.callback_query(F.data.startswith("prof:"))
+async def turn_profile_page(callback: CallbackQuery):
+    _, direction, answer_id = callback.data.split(":")
+    user_id = callback.from_user.id
+    summary = await get_user_summary(user_id)
+    page = await get_user_history_page(user_id, int(answer_id), "prev" if direction == "p" else "next")
+    if summary and not page["rows"]:
+        # удалённый тест мог увести за конец истории — начинаем сначала
+        page = await get_user_history_page(user_id)
+    if not summary or not page["rows"]:
+        return await callback.message.edit_text("📭 Ты пока не проходил ни одного теста.")
+
+    await callback.message.edit_text(
+        format_profile(summary, page), parse_mode="HTML", reply_markup=profile_keyboard(page)
+    )
+    await callback.answer()
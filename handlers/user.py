@@ -2,20 +2,18 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime
 from zoneinfo import ZoneInfo
-from aiogram import Bot
-
-# Импортируйте ваши функции из 'db'
-from db import (
-    is_valid_code,
-    get_test_id_by_code,
-    get_correct_answers,
-    save_answers,
-    get_test_deadline,
-    has_submitted
+
+# Импортируйте ваши функции из 'async_db'
+from async_db import (
+    get_test_session,
+    get_answer_key,
+    save_answers
 )
+from scheduler import reminders
+from grading import grade_submission
+from utils.normalizer import normalize_answer
 
 router = Router()
 
@@ -28,82 +26,24 @@ class UserState(StatesGroup):
 
 
 # --- Хелпер функция для форматирования результатов ---
-def format_result_comparison(correct_data: list[dict], user_answers: dict[int, str]) -> tuple[str, int, int]:
+def format_result_comparison(items: list[tuple[int, str, bool]], correct_count: int,
+                             total_score: float, max_score: float) -> str:
     """
-    Сравнивает правильные ответы с пользовательскими.
-    Предполагается, что user_answers уже является словарем {номер_вопроса: ответ}.
-    Возвращает:
-        - текст с пометками ✅/❌
-        - число правильных
-        - общую сумму баллов
+    Текст с пометками ✅/❌ по результату grading.grade_answers:
+    items — [(номер вопроса, ответ ученика, верно ли)].
     """
     result_lines = []
-    correct_count = 0
-    total_score = 0
-    max_score = 0
-
-    for item in correct_data:
-        qnum = item["question_number"]
-        correct = item["correct_answer"]
-        score = item["score"]
-        max_score += score
-
-        user_ans = user_answers.get(qnum)
-
-        if user_ans is not None and str(user_ans).strip().lower() == str(correct).strip().lower():
+    for qnum, user_ans, is_correct in items:
+        if is_correct:
             result_lines.append(f"{qnum}: {user_ans} ✅")
-            correct_count += 1
-            total_score += score
         else:
             result_lines.append(f"{qnum}: {user_ans or '—'} ❌")  # Если ответа нет, показываем "—"
 
     summary = "\n".join(result_lines)
-    summary += f"\n\n🎯 Итог: {correct_count} из {len(correct_data)} верно"
+    summary += f"\n\n🎯 Итог: {correct_count} из {len(items)} верно"
     summary += f"\nОбщий балл: {total_score} из {max_score}"
 
-    return summary, correct_count, total_score
-
-
-# --- Хелпер функция для отправки напоминаний о дедлайне ---
-async def send_deadline_reminders(user_id: int, test_id: int, deadline: datetime, bot: Bot, state: FSMContext):
-
-    reminder_tasks = []
-
-    reminders = [
-        (timedelta(minutes=15), "⏰ Осталось 15 минут. Рассчитай время и не спеши."),
-        (timedelta(minutes=3), "⚠️ Осталось 3 минуты. Пора заканчивать.")
-    ]
-
-    for td, text in reminders:
-        now = datetime.now(ZoneInfo("Asia/Tashkent"))
-        time_to_wait = (deadline - now - td).total_seconds()
-
-        if time_to_wait > 0:
-            async def _send_single_reminder(delay_sec, message_text):
-                await asyncio.sleep(delay_sec)
-                if not has_submitted(user_id, test_id) and await state.get_state() is not None:
-                    try:
-                        await bot.send_message(user_id, message_text)
-                    except Exception as e:
-                        print(f"Ошибка при отправке напоминания пользователю {user_id}: {e}")
-
-            task = asyncio.create_task(_send_single_reminder(time_to_wait, text))
-            reminder_tasks.append(task)
-
-    final_delay = (deadline - datetime.now(ZoneInfo("Asia/Tashkent"))).total_seconds()
-    if final_delay > 0:
-        async def _send_deadline_passed_message():
-            await asyncio.sleep(final_delay)
-            if not has_submitted(user_id, test_id) and await state.get_state() is not None:
-                try:
-                    await bot.send_message(user_id, "🕰 Время вышло. Тест теперь недоступен для сдачи.")
-                except Exception as e:
-                    print(f"Ошибка при отправке сообщения о дедлайне пользователю {user_id}: {e}")
-
-        task = asyncio.create_task(_send_deadline_passed_message())
-        reminder_tasks.append(task)
-
-    await state.update_data(reminder_tasks=reminder_tasks)
+    return summary
 
 
 # --- Обработчик команды "Проверить тест" ---
@@ -122,26 +62,33 @@ async def receive_code(message: Message, state: FSMContext):
     code = message.text.strip().upper()
     user_id = message.from_user.id
 
-    if not is_valid_code(code):
+    # Код, активность, дедлайн и статус сдачи — одним запросом
+    session = await get_test_session(code, user_id)
+
+    if not session or not session["is_active"]:
         await message.answer("❌ Неверный код. Проверь и попробуй ещё раз.")
         await state.clear()
         return
 
-    test_id = get_test_id_by_code(code)
-    if has_submitted(user_id, test_id):
+    test_id = session["test_id"]
+    if session["submitted"]:
         await message.answer("⚠️ Ты уже проходил этот тест. Повторная отправка запрещена.")
         await state.clear()
         return
 
-    deadline = get_test_deadline(test_id)
+    deadline = session["deadline"]
     now = datetime.now(ZoneInfo("Asia/Tashkent"))
 
+    if deadline and deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=ZoneInfo("Asia/Tashkent"))
+
     if deadline and now > deadline:
         await message.answer("⏰ Срок сдачи теста уже истёк. Начать тест нельзя.")
         await state.clear()
         return
 
-    await state.update_data(test_id=test_id, deadline=deadline)
+    # Дальше по сценарию сессия берётся из FSM, без повторных запросов к БД
+    await state.update_data(test_id=test_id, deadline=deadline.isoformat() if deadline else None)
     # Обновленные примеры, как в admin.py
     await message.answer("✍️ Введи свои ответы в формате:\n\n"
                          "НОМЕР ОТВЕТ\n"
@@ -157,8 +104,8 @@ async def receive_code(message: Message, state: FSMContext):
                          "`6 12345`\n`7 123.4`\n`8 -12.3`\n`9 -1.5`\n`10 B`", parse_mode="Markdown")
 
     await state.set_state(UserState.waiting_for_answers)
-    bot: Bot = message.bot
-    asyncio.create_task(send_deadline_reminders(user_id, test_id, deadline, bot, state))
+    if deadline:
+        await reminders.schedule(user_id, test_id, deadline)
 
 
 # --- Основной обработчик ввода ответов и их парсинга ---
@@ -167,14 +114,10 @@ async def process_user_test_submission(message: Message, state: FSMContext):
     user_id = message.from_user.id
     answers_raw = message.text.strip()
     data = await state.get_data()
-    test_id = data.get("test_id")
-    deadline = get_test_deadline(test_id)
+    deadline = datetime.fromisoformat(data["deadline"]) if data.get("deadline") else None
 
     now = datetime.now(ZoneInfo("Asia/Tashkent"))
 
-    if deadline and deadline.tzinfo is None:
-        deadline = deadline.replace(tzinfo=ZoneInfo("Asia/Tashkent"))
-
 
     if deadline and now > deadline:
         await message.answer("❌ Срок сдачи уже прошёл. К сожалению, ответ не может быть принят.")
@@ -189,23 +132,13 @@ async def process_user_test_submission(message: Message, state: FSMContext):
             if len(parts) != 2:
                 raise ValueError(f"НЕДОСТАТОЧНО ИЛИ СЛИШКОМ МНОГО ЭЛЕМЕНТОВ В СТРОКЕ:\n{line}")
             q = int(parts[0])
-            answer = parts[1]
-
-            # Проверяем длину ответа (не более 5 символов без минуса, 6 с минусом)
-            if len(answer.replace("-", "")) > 5:
-                raise ValueError(f"ОТВЕТ ПРЕВЫШАЕТ ДОПУСТИМУЮ ДЛИНУ В СТРОКЕ:\n{line}")
-
-            # Преобразуем допустимые дроби в десятичный формат (например: 2/3 → 0.667)
-            if "/" in answer and answer.replace("-", "").count("/") == 1:
-                try:
-                    sign = "-" if answer.startswith("-") else ""
-                    num, denom = answer.replace("-", "").split("/")
-                    frac_val = float(int(num)) / int(denom)
-                    point = str(5 - (len(str(int(frac_val))) + 1))
-                    answer = f"{sign}{frac_val:.{point}f}".rstrip("0").rstrip(".")
-                except Exception:
-                    raise ValueError("НЕКОРРЕКТНАЯ ДРОБЬ В СТРОКЕ:\n{line}")
-            questions.append((q, answer.strip()))
+
+            # Длина ответа и дроби (2/3 → 0.667) — по общим правилам utils.normalizer
+            try:
+                answer = normalize_answer(parts[1])
+            except ValueError as e:
+                raise ValueError(f"{e} В СТРОКЕ:\n{line}")
+            questions.append((q, answer))
         except Exception as e:
             await message.answer(
                 f"❌ {e}\n\n"
@@ -256,20 +189,21 @@ async def handle_confirm_answers(callback_query: CallbackQuery, state: FSMContex
         await state.clear()
         return
 
-    if has_submitted(user_id, test_id):
-        await callback_query.message.edit_text("⚠️ Ты уже проходил этот тест. Повторная отправка запрещена.")
-        await state.clear()
-        return
-
-    correct_data = get_correct_answers(test_id)
+    # Оценка выставляется один раз при сдаче и сохраняется вместе с ответами
+    answer_key = await get_answer_key(test_id)
     user_answers_dict_for_comparison = {q: a for q, a, *_ in user_answers_parsed}
 
-    summary, correct_count, total_score = format_result_comparison(correct_data, user_answers_dict_for_comparison)
-
-    save_answers(user_id, test_id, answers_raw)
+    # Одинаковые наборы ответов проверяются и форматируются один раз
+    graded = grade_submission(test_id, answer_key, user_answers_dict_for_comparison, format_result_comparison)
 
+    # Проверка повторной сдачи и запись выполняются одной транзакцией
+    if not await save_answers(user_id, test_id, answers_raw, graded["items"],
+                              score=graded["score"], solved=graded["solved"], max_score=answer_key["max_score"]):
+        await callback_query.message.edit_text("⚠️ Ты уже проходил этот тест. Повторная отправка запрещена.")
+        await state.clear()
+        return
 
-    await callback_query.message.edit_text(summary, parse_mode="Markdown")
+    await callback_query.message.edit_text(graded["summary"], parse_mode="Markdown")
     await state.clear()
 
 
@@ -298,9 +232,8 @@ async def handle_re_enter_answers(callback_query: CallbackQuery, state: FSMConte
 async def handle_cancel_test_flow(callback_query: CallbackQuery, state: FSMContext):
     await callback_query.answer("Действие отменено.")
     data = await state.get_data()
-    tasks = data.get("reminder_tasks", [])
-    for task in tasks:
-        task.cancel()
+    if data.get("test_id"):
+        await reminders.cancel(callback_query.from_user.id, data["test_id"])
     await callback_query.message.edit_text(
         "❌ Проверка теста отменена. Вы можете начать заново, отправив команду 'Проверить тест'."
     )
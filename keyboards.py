@@ -1,22 +1,22 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from config import OWNER_ID
-from db import is_admin
+from roles import ROLE_OWNER, ROLE_ADMIN, ROLE_USER
 
-def get_main_keyboard(user_id: int, is_user: bool = False) -> ReplyKeyboardMarkup:
+
+def _build_main_keyboard(role: str) -> ReplyKeyboardMarkup:
     buttons = []
 
     # Пользователь
-    if is_user:
+    if role == ROLE_USER:
         buttons.append([KeyboardButton(text="Проверить тест")])
         buttons.append([KeyboardButton(text="Мой профиль")])
 
     # Админ или владелец
-    if is_admin(user_id) or user_id == OWNER_ID:
+    if role in (ROLE_ADMIN, ROLE_OWNER):
         buttons.append([KeyboardButton(text="Создать тест"),KeyboardButton(text="Проверить тест")])
         buttons.append([KeyboardButton(text="Мои тесты")])
 
     # Только владелец
-    if user_id == OWNER_ID:
+    if role == ROLE_OWNER:
         buttons.append([
             KeyboardButton(text="➕ Добавить админа"),
             KeyboardButton(text="➖ Удалить админа")
@@ -26,4 +26,12 @@ def get_main_keyboard(user_id: int, is_user: bool = False) -> ReplyKeyboardMarku
     return ReplyKeyboardMarkup(
         keyboard=buttons,
         resize_keyboard=True
-    )
\ No newline at end of file
+    )
+
+
+# Клавиатуры не зависят от пользователя, поэтому собираются один раз
+MAIN_KEYBOARDS = {role: _build_main_keyboard(role) for role in (ROLE_OWNER, ROLE_ADMIN, ROLE_USER)}
+
+
+def get_main_keyboard(role: str) -> ReplyKeyboardMarkup:
+    return MAIN_KEYBOARDS[role]
@@ -0,0 +1,184 @@
+"""
+Время обработки обновлений и обращений к БД.
+
+HandlerTimingMiddleware замеряет каждое обновление целиком — фильтры,
+загрузку состояния FSM и сам обработчик — и записывает время в гистограмму
+того обработчика, который его принял. Обращения к хранилищу замеряет
+async_db, вместе с ожиданием свободного соединения. Сводку показывает
+владельцу команда /stats; при заданном METRICS_PORT те же данные отдаются
+в текстовом формате Prometheus на /metrics.
+"""
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+# Верхние границы корзин в секундах, как у гистограмм Prometheus
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Обработчик, принявший текущее обновление; заполняется внутренним middleware
+_handler_name: ContextVar[Optional[list]] = ContextVar("handler_name", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # последняя корзина — всё, что дольше BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам (линейно внутри корзины), как histogram_quantile в Prometheus"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                if i == len(BUCKETS):
+                    return self.max
+                lower = BUCKETS[i - 1] if i else 0.0
+                return min(self.max, lower + (BUCKETS[i] - lower) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers: dict[str, Histogram] = {}
+        self.db_calls: dict[str, Histogram] = {}
+
+    @staticmethod
+    def _observe(family: dict, name: str, seconds: float, failed: bool):
+        histogram = family.get(name)
+        if histogram is None:
+            histogram = family[name] = Histogram()
+        histogram.observe(seconds)
+        if failed:
+            histogram.errors += 1
+
+    def observe_handler(self, name: str, seconds: float, failed: bool = False):
+        self._observe(self.handlers, name, seconds, failed)
+
+    def observe_db(self, name: str, seconds: float, failed: bool = False):
+        self._observe(self.db_calls, name, seconds, failed)
+
+    def top(self, family: str, limit: int = 10) -> list[dict]:
+        """Самые затратные по суммарному времени обработчики ("handlers") или обращения к БД ("db_calls")"""
+        rows = sorted(getattr(self, family).items(), key=lambda item: item[1].sum, reverse=True)
+        return [
+            {
+                "name": name,
+                "count": h.count,
+                "errors": h.errors,
+                "total": round(h.sum, 3),
+                "p50": round(h.quantile(0.5) * 1000, 1),
+                "p95": round(h.quantile(0.95) * 1000, 1),
+                "p99": round(h.quantile(0.99) * 1000, 1),
+                "max": round(h.max * 1000, 1),
+            }
+            for name, h in rows[:limit]
+        ]
+
+    def reset(self):
+        self.handlers.clear()
+        self.db_calls.clear()
+
+    def prometheus(self) -> str:
+        lines = []
+        for metric, label, family, help_text in (
+            ("bot_handler_seconds", "handler", self.handlers, "Время обработки обновления"),
+            ("bot_db_call_seconds", "call", self.db_calls, "Время обращения к хранилищу"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            for name, h in sorted(family.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {h.sum:.6f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+            errors = f"{metric[:-len('_seconds')]}_errors_total"
+            lines += [f"# HELP {errors} {help_text}: завершилось исключением", f"# TYPE {errors} counter"]
+            for name, h in sorted(family.items()):
+                lines.append(f'{errors}{{{label}="{name}"}} {h.errors}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def handler_name(callback: Callable) -> str:
+    """Имя для отчёта: модуль без пакета и имя функции, например user.handle_confirm_answers"""
+    return f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__qualname__}"
+
+
+class _HandlerLabelMiddleware(BaseMiddleware):
+    """Внутренний middleware: запоминает, какой обработчик принял обновление"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        label = _handler_name.get()
+        if label is not None:
+            label[0] = handler_name(data["handler"].callback)
+        return await handler(event, data)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений: время от получения обновления до конца обработки.
+    Обновления, которые не принял ни один обработчик, попадают в unhandled:<тип>.
+    """
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+        self._label = _HandlerLabelMiddleware()
+
+    def setup(self, dispatcher: Dispatcher):
+        dispatcher.update.outer_middleware(self)
+        # Внутренние middleware диспетчера действуют и на обработчики вложенных роутеров
+        for name, observer in dispatcher.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self._label)
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: dict[str, Any]) -> Any:
+        label = [None]
+        token = _handler_name.set(label)
+        failed = False
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _handler_name.reset(token)
+            self.registry.observe_handler(label[0] or f"unhandled:{event.event_type}", elapsed, failed)
+
+
+async def start_metrics_server(host: str, port: int, registry: Metrics = metrics) -> web.AppRunner:
+    """Отдельный от вебхука сервер с /metrics для Prometheus; наружу его открывать не нужно"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
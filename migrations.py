@@ -0,0 +1,355 @@
+"""
+Версионированные миграции схемы БД.
+
+Номер применённой версии хранится в таблице schema_version. При запуске
+бота migrate() читает его одним запросом и применяет только недостающие
+миграции, каждую в своей транзакции. Новая миграция добавляется в конец
+списка MIGRATIONS и никогда не меняется после выпуска.
+"""
+import sqlite3
+from datetime import datetime
+
+from db import get_connection
+from grading import compile_answer_key, grade_answers
+from utils.normalizer import canonical_key, normalize_answer
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        full_name TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        created_at TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS admins (
+        admin_id INTEGER PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        updated_at TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tests (
+        test_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        code TEXT UNIQUE,
+        is_active BOOLEAN DEFAULT 1,
+        created_by INTEGER,
+        created_at TEXT,
+        deadline TIMESTAMP
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS questions (
+        question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        test_id INTEGER,
+        question_number INTEGER,
+        correct_answer TEXT,
+        score REAL,
+        FOREIGN KEY (test_id) REFERENCES tests(test_id)
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS answers (
+        answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        test_id INTEGER,
+        answer_text TEXT,
+        submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (test_id) REFERENCES tests(test_id)
+    )
+    """)
+
+    # Старые базы создавались без этих колонок в users
+    columns = {col[1] for col in conn.execute("PRAGMA table_info(users)")}
+    for column in ("full_name", "first_name", "last_name", "username"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE users ADD COLUMN {column} TEXT")
+
+
+def _add_indexes(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_test_user ON answers(test_id, user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_user_submitted ON answers(user_id, submitted_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_test_number ON questions(test_id, question_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tests_created_by ON tests(created_by)")
+
+
+def _add_reminders(conn: sqlite3.Connection):
+    # fire_at — момент отправки в секундах Unix-времени
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminders (
+        reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        fire_at REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_user_test ON reminders(user_id, test_id)")
+
+
+def _parse_answer_text(answer_text: str) -> dict[int, str]:
+    answers = {}
+    for line in (answer_text or "").strip().splitlines():
+        parts = line.strip().split(maxsplit=1)
+        if len(parts) == 2 and parts[0].isdigit():
+            answers[int(parts[0])] = parts[1].strip().lower()
+    return answers
+
+
+def _add_scores(conn: sqlite3.Connection):
+    conn.execute("ALTER TABLE answers ADD COLUMN score REAL")
+    conn.execute("ALTER TABLE answers ADD COLUMN solved INTEGER")
+    conn.execute("ALTER TABLE answers ADD COLUMN max_score REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_test_score ON answers(test_id, score DESC)")
+
+    # Проставляем баллы уже сданным ответам
+    keys = {}
+    for test_id, number, correct, score in conn.execute(
+        "SELECT test_id, question_number, correct_answer, score FROM questions"
+    ):
+        keys.setdefault(test_id, {})[number] = ((correct or "").strip().lower(), score)
+
+    updates = []
+    for answer_id, test_id, answer_text in conn.execute("SELECT answer_id, test_id, answer_text FROM answers"):
+        key = keys.get(test_id, {})
+        answers = _parse_answer_text(answer_text)
+        score = solved = 0
+        for number, (correct, value) in key.items():
+            if answers.get(number, "") == correct:
+                score += value
+                solved += 1
+        updates.append((round(score, 2), solved, round(sum(v for _, v in key.values()), 2), answer_id))
+
+    conn.executemany("UPDATE answers SET score = ?, solved = ?, max_score = ? WHERE answer_id = ?", updates)
+
+
+def _add_answer_items(conn: sqlite3.Connection):
+    # Ответ ученика по каждому вопросу ключа; пустая строка — вопрос без ответа
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS answer_items (
+        answer_id INTEGER NOT NULL,
+        test_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        question_number INTEGER NOT NULL,
+        answer TEXT NOT NULL,
+        is_correct INTEGER NOT NULL,
+        PRIMARY KEY (answer_id, question_number),
+        FOREIGN KEY (answer_id) REFERENCES answers(answer_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_answer_items_question
+    ON answer_items(test_id, question_number, is_correct)
+    """)
+
+    keys = {}
+    for test_id, number, correct in conn.execute(
+        "SELECT test_id, question_number, correct_answer FROM questions ORDER BY test_id, question_number"
+    ):
+        keys.setdefault(test_id, {})[number] = (correct or "").strip().lower()
+
+    items = []
+    for answer_id, test_id, user_id, answer_text in conn.execute(
+        "SELECT answer_id, test_id, user_id, answer_text FROM answers"
+    ):
+        answers = _parse_answer_text(answer_text)
+        for number, correct in keys.get(test_id, {}).items():
+            answer = answers.get(number, "")
+            items.append((answer_id, test_id, user_id, number, answer, int(answer == correct)))
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, items)
+
+
+def _add_key_version(conn: sqlite3.Connection):
+    # Увеличивается при каждом исправлении ключа ответов
+    conn.execute("ALTER TABLE tests ADD COLUMN key_version INTEGER NOT NULL DEFAULT 1")
+
+
+def _add_canonical_answers(conn: sqlite3.Connection):
+    # Ключ сравнения правильного ответа (utils.normalizer.canonical_key), считается один раз при записи
+    conn.execute("ALTER TABLE questions ADD COLUMN canonical_answer TEXT")
+    conn.executemany(
+        "UPDATE questions SET canonical_answer = ? WHERE question_id = ?",
+        [
+            (canonical_key(correct or ""), question_id)
+            for question_id, correct in conn.execute("SELECT question_id, correct_answer FROM questions")
+        ],
+    )
+
+
+def _add_fsm_states(conn: sqlite3.Connection):
+    # Состояния диалогов (fsm_storage.DatabaseStorage); data — JSON, updated_at — unix-время
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        bot_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        thread_id INTEGER NOT NULL DEFAULT 0,
+        destiny TEXT NOT NULL,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at)")
+
+
+def _add_user_stats(conn: sqlite3.Connection):
+    # Сводка для профиля ученика: обновляется при сдаче, пересчитывается при исправлении ключа
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        tests_taken INTEGER NOT NULL,
+        percent_sum REAL NOT NULL
+    )
+    """)
+    conn.execute("""
+    INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+    SELECT a.user_id, COUNT(*), SUM(CASE WHEN a.max_score > 0 THEN a.score * 100.0 / a.max_score ELSE 0 END)
+    FROM answers a
+    WHERE NOT EXISTS (SELECT 1 FROM answers b
+                      WHERE b.test_id = a.test_id AND b.user_id = a.user_id AND b.answer_id > a.answer_id)
+    GROUP BY a.user_id
+    """)
+    # История в профиле листается по answer_id; индекс по дате сдачи больше не нужен
+    conn.execute("DROP INDEX IF EXISTS idx_answers_user_submitted")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_user_answer ON answers(user_id, answer_id)")
+
+
+def _unique_submissions(conn: sqlite3.Connection):
+    # Один ученик — одна работа на тест. Из повторных сдач старых версий оставляем последнюю
+    duplicates = """
+        SELECT a.answer_id FROM answers a
+        WHERE EXISTS (SELECT 1 FROM answers b
+                      WHERE b.test_id = a.test_id AND b.user_id = a.user_id AND b.answer_id > a.answer_id)
+    """
+    conn.execute(f"DELETE FROM answer_items WHERE answer_id IN ({duplicates})")
+    conn.execute(f"DELETE FROM answers WHERE answer_id IN ({duplicates})")
+    # Уникальный индекс заменяет обычный по тем же столбцам
+    conn.execute("DROP INDEX IF EXISTS idx_answers_test_user")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_answers_test_user ON answers(test_id, user_id)")
+    # Сводка считалась по последним сдачам, поэтому после удаления дублей не меняется
+
+
+def _regrade_with_canonical_keys(conn: sqlite3.Connection):
+    # Работы, проверенные миграциями 4–5, сравнивались по strip().lower(): 3/4 и 0.75 считались разными,
+    # а ответы хранились в нижнем регистре. Проверяем все работы заново так же, как при сдаче (grading),
+    # — для уже проверенных по-новому результат не меняется
+    rows = {}
+    for test_id, number, correct, score, canonical in conn.execute("""
+        SELECT test_id, question_number, correct_answer, score, canonical_answer
+        FROM questions ORDER BY test_id, question_number
+    """):
+        rows.setdefault(test_id, []).append((number, correct, score, canonical))
+    keys = {test_id: compile_answer_key(key_rows, 0) for test_id, key_rows in rows.items()}
+
+    updates = []
+    items = []
+    for answer_id, test_id, user_id, answer_text in conn.execute(
+        "SELECT answer_id, test_id, user_id, answer_text FROM answers"
+    ).fetchall():
+        key = keys.get(test_id)
+        if key is None:
+            continue
+        user_answers = {}
+        for line in (answer_text or "").strip().splitlines():
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2 and parts[0].isdigit():
+                # Старые работы хранят ответ как ввёл ученик — приводим к виду, в котором хранятся новые
+                try:
+                    user_answers[int(parts[0])] = normalize_answer(parts[1])
+                except ValueError:
+                    user_answers[int(parts[0])] = parts[1].strip()
+        graded, score, solved = grade_answers(key, user_answers)
+        updates.append((round(score, 2), solved, round(key["max_score"], 2), answer_id))
+        items.extend((answer_id, test_id, user_id, number, answer, int(is_correct))
+                     for number, answer, is_correct in graded)
+
+    conn.executemany("UPDATE answers SET score = ?, solved = ?, max_score = ? WHERE answer_id = ?", updates)
+    conn.executemany("""
+        INSERT OR REPLACE INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, items)
+
+    conn.execute("DELETE FROM user_stats")
+    conn.execute("""
+    INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+    SELECT a.user_id, COUNT(*), SUM(CASE WHEN a.max_score > 0 THEN a.score * 100.0 / a.max_score ELSE 0 END)
+    FROM answers a
+    GROUP BY a.user_id
+    """)
+
+
+# (версия, функция) — строго по возрастанию версии
+MIGRATIONS = [
+    (1, _initial_schema),
+    (2, _add_indexes),
+    (3, _add_reminders),
+    (4, _add_scores),
+    (5, _add_answer_items),
+    (6, _add_key_version),
+    (7, _add_canonical_answers),
+    (8, _add_fsm_states),
+    (9, _add_user_stats),
+    (10, _unique_submissions),
+    (11, _regrade_with_canonical_keys),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # Таблицы ещё нет — база новая или создана до появления миграций
+        return 0
+    return row[0] or 0
+
+
+def migrate() -> int:
+    """Применяет недостающие миграции и возвращает текущую версию схемы"""
+    conn = get_connection()
+    version = get_schema_version(conn)
+    if version >= MIGRATIONS[-1][0]:
+        return version
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at TEXT
+    )
+    """)
+
+    for target, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN")
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                (target, datetime.utcnow().replace(microsecond=0).isoformat()),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"🗄 Миграция схемы до версии {target} применена")
+        version = target
+
+    return version
@@ -0,0 +1,5 @@
+"""
+Хранилища данных бота. Реализация выбирается переменной DB_BACKEND (см. async_db.init):
+repositories.sqlite — SQLite, repositories.postgres — PostgreSQL (нужен asyncpg).
+"""
+from repositories.base import Repository, RESULTS_PAGE_SIZE
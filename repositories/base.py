@@ -0,0 +1,188 @@
+"""
+Интерфейс хранилища данных бота.
+
+Все методы асинхронные и возвращают простые значения (кортежи, словари,
+строки ISO для дат) одинаковые для любой реализации — обработчики не знают,
+с какой БД работают. Реализации: SQLiteRepository (один файл, один
+экземпляр бота) и PostgresRepository (общая БД для нескольких экземпляров).
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+
+# Размер страницы таблицы результатов
+RESULTS_PAGE_SIZE = 10
+# Сколько сдач на странице истории в профиле
+HISTORY_PAGE_SIZE = 5
+
+
+class Repository(ABC):
+    # --- Жизненный цикл ---
+    @abstractmethod
+    async def start(self):
+        """Подключается к БД и применяет недостающие миграции"""
+
+    @abstractmethod
+    async def close(self):
+        """Дожидается начатых запросов и закрывает соединения"""
+
+    # --- Пользователи ---
+    @abstractmethod
+    async def add_user(self, user_id: int, first_name: str, last_name: str, username: str = None): ...
+
+    @abstractmethod
+    async def user_exists(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def touch_user(self, user_id: int, username: Optional[str]) -> Optional[str]:
+        """Добавляет пользователя или обновляет его username. Возвращает full_name, если он уже указан"""
+
+    @abstractmethod
+    async def save_user_name(self, user_id: int, full_name: str, first_name: str, last_name: str,
+                             username: Optional[str]): ...
+
+    # --- Профиль ученика ---
+    @abstractmethod
+    async def get_user_summary(self, user_id: int) -> Optional[dict]:
+        """{"tests_taken", "average_percent"} из сводки, обновляемой при сдаче; None, если сдач нет"""
+
+    @abstractmethod
+    async def get_user_history_page(self, user_id: int, anchor: Optional[int] = None, direction: str = "next",
+                                    limit: int = HISTORY_PAGE_SIZE) -> dict:
+        """
+        Страница истории сдач от новых к старым с листанием по answer_id, см. db.get_user_history_page.
+        {"rows": [{"answer_id", "test_id", "title", "submitted_at", "score", "max_score", "solved",
+        "place", "participants"}], "has_prev", "has_next"}
+        """
+
+    # --- Админы ---
+    @abstractmethod
+    async def add_admin(self, user_id: int): ...
+
+    @abstractmethod
+    async def remove_admin(self, user_id: int): ...
+
+    @abstractmethod
+    async def get_all_admins(self) -> list[int]: ...
+
+    @abstractmethod
+    async def sync_admin_info(self, user_id: int, first_name: str, last_name: str, username: str): ...
+
+    # --- Тесты ---
+    @abstractmethod
+    async def generate_code(self, length: int = 6) -> str:
+        """Случайный код, которого ещё нет ни у одного теста"""
+
+    @abstractmethod
+    async def create_test(self, title: str, code: str, admin_id: int, deadline: datetime) -> int: ...
+
+    @abstractmethod
+    async def add_question(self, test_id: int, number: int, answer: str, score: float): ...
+
+    @abstractmethod
+    async def create_test_with_questions(self, title: str, code: str, admin_id: int, deadline: datetime,
+                                         questions: list[tuple[int, str, float]]) -> int:
+        """Создаёт тест вместе с ключом [(номер, ответ, балл)] одной транзакцией"""
+
+    @abstractmethod
+    async def get_tests_by_admin(self, admin_id: int) -> list[tuple]:
+        """[(test_id, название)]"""
+
+    @abstractmethod
+    async def get_test_with_answers(self, test_id: int) -> Optional[tuple]:
+        """(название, [(номер, ответ, балл)], число сдавших, код, дедлайн в ISO) или None"""
+
+    @abstractmethod
+    async def delete_test(self, test_id: int): ...
+
+    @abstractmethod
+    async def regrade_test(self, test_id: int, changes: list[tuple[int, str, float]]) -> int:
+        """Исправляет ключ и пересчитывает все работы теста. Возвращает число пересчитанных работ"""
+
+    # --- Логика ответов и дедлайна ---
+    @abstractmethod
+    async def get_test_session(self, code: str, user_id: int) -> Optional[dict]:
+        """{"test_id", "is_active", "deadline" (datetime или None), "submitted"} или None"""
+
+    @abstractmethod
+    async def is_valid_code(self, code: str) -> bool: ...
+
+    @abstractmethod
+    async def get_test_id_by_code(self, code: str) -> Optional[int]: ...
+
+    @abstractmethod
+    async def get_test_deadline(self, test_id: int) -> Optional[datetime]: ...
+
+    @abstractmethod
+    async def has_submitted(self, user_id: int, test_id: int) -> bool: ...
+
+    @abstractmethod
+    async def get_answer_key(self, test_id: int) -> dict:
+        """Ключ ответов из grading.compile_answer_key(); общий объект — не изменяйте его"""
+
+    @abstractmethod
+    async def get_correct_answers(self, test_id: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def preload_answer_keys(self) -> int:
+        """Загружает в кэш ключи активных тестов. Возвращает число тестов"""
+
+    @abstractmethod
+    def answer_key_cache_stats(self) -> dict:
+        """Счётчики кэша ключей; к БД не обращается"""
+
+    @abstractmethod
+    async def save_answers(self, user_id: int, test_id: int, answer_text: str, items: list[tuple[int, str, bool]],
+                           score: float, solved: int, max_score: float) -> bool:
+        """Сохраняет работу, если пользователь ещё не сдавал тест. Возвращает False при повторной отправке"""
+
+    # --- Напоминания о дедлайне ---
+    @abstractmethod
+    async def add_reminders(self, user_id: int, test_id: int, reminders: list[tuple[str, float]]) -> list[int]:
+        """Заменяет напоминания пользователя по тесту новыми [(kind, fire_at)]. Возвращает их id"""
+
+    @abstractmethod
+    async def delete_user_reminders(self, user_id: int, test_id: int): ...
+
+    @abstractmethod
+    async def delete_reminders(self, reminder_ids: list[int]) -> set[int]:
+        """Удаляет напоминания и возвращает id тех, что ещё были в БД (их и нужно отправить)"""
+
+    @abstractmethod
+    async def get_pending_reminders(self) -> list[tuple]:
+        """[(reminder_id, user_id, test_id, kind, fire_at)]"""
+
+    @abstractmethod
+    async def get_submitted_pairs(self, pairs: list[tuple[int, int]]) -> set[tuple[int, int]]:
+        """Из пар (user_id, test_id) возвращает те, по которым ответы уже сданы"""
+
+    # --- Состояния FSM ---
+    @abstractmethod
+    async def load_fsm_record(self, key: tuple) -> Optional[tuple]:
+        """(state, data в JSON, updated_at) или None"""
+
+    @abstractmethod
+    async def save_fsm_records(self, upserts: list[tuple], deletes: list[tuple]):
+        """upserts — (*ключ, state, data, updated_at), deletes — ключи; одной транзакцией"""
+
+    @abstractmethod
+    async def delete_stale_fsm_records(self, cutoff: float) -> int: ...
+
+    # --- Результаты ---
+    @abstractmethod
+    async def get_test_results(self, test_id: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def get_user_answers_detailed(self, test_id: int, user_id: int) -> list[dict]: ...
+
+    @abstractmethod
+    async def get_results_page(self, test_id: int, anchor: Optional[tuple[float, int]] = None,
+                               direction: str = "next", limit: int = RESULTS_PAGE_SIZE) -> dict:
+        """Страница таблицы результатов с листанием по ключу (score, answer_id), см. db.get_results_page"""
+
+    @abstractmethod
+    async def get_participant_result(self, test_id: int, user_id: int) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def export_results_csv(self, test_id: int) -> tuple[str, int]:
+        """Временный CSV с результатами и число участников; удалить файл должен вызывающий"""
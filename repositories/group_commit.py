@@ -0,0 +1,131 @@
+"""
+Групповой коммит работ для SQLite.
+
+Перед дедлайном сотни учеников подтверждают ответы почти одновременно.
+Если каждая работа — отдельная транзакция, все они по очереди ждут
+блокировку записи и синхронизацию с диском. Здесь работы копятся в
+очереди, и один фоновый цикл записывает их пачками: пачка уходит через
+FLUSH_DELAY после первой работы или сразу, как наберётся FLUSH_BATCH.
+Пока пачка пишется, копится следующая.
+
+Запись идёт в отдельном потоке через соединение с synchronous=FULL.
+Обработчик получает ответ только после коммита своей пачки, поэтому
+подтверждённая работа уже на диске.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import db
+
+FLUSH_DELAY = 0.002   # секунды ожидания других работ после первой
+FLUSH_BATCH = 200     # столько работ записываются сразу, не дожидаясь FLUSH_DELAY
+
+
+class GroupCommitWriter:
+    def __init__(self, flush_delay: float = FLUSH_DELAY, flush_batch: int = FLUSH_BATCH):
+        self.flush_delay = flush_delay
+        self.flush_batch = flush_batch
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+        self._arrived: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        # Один поток и одно соединение: пачки пишутся строго по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._conn = None
+        self.batches = 0
+        self.written = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._conn = await loop.run_in_executor(self._executor, db.open_writer_connection)
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, *submission) -> bool:
+        """Ставит работу (аргументы db.save_answers) в очередь и ждёт коммита её пачки"""
+        if self._closed:
+            raise RuntimeError("Запись работ остановлена")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((submission, future))
+        self._arrived.set()
+        if len(self._pending) >= self.flush_batch:
+            self._full.set()
+
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _run(self):
+        while True:
+            await self._arrived.wait()
+            if not self._pending:
+                if self._closed:
+                    return
+                self._arrived.clear()
+                continue
+            if len(self._pending) < self.flush_batch and not self._closed:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_delay)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_once()
+
+    async def _flush_once(self):
+        batch = self._pending[:self.flush_batch]
+        del self._pending[:self.flush_batch]
+        if not self._pending and not self._closed:
+            self._arrived.clear()
+        if len(self._pending) < self.flush_batch:
+            self._full.clear()
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self._executor, db.save_answers_batch, self._conn, [s for s, _ in batch]
+            )
+        except Exception as e:
+            # Транзакция откатилась целиком — ни одна работа пачки не записана
+            results = [e] * len(batch)
+
+        self.batches += 1
+        self.written += len(batch)
+        for (_, future), result in zip(batch, results):
+            # Обработчик мог быть отменён, пока пачка писалась; работа при этом сохранена
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Дописывает очередь и закрывает соединение"""
+        self._closed = True
+        if self._task is not None:
+            # Цикл не отменяем: пачка, которая пишется прямо сейчас, должна дойти до обработчиков.
+            # Он сам допишет очередь и завершится
+            self._arrived.set()
+            self._full.set()
+            try:
+                await asyncio.shield(self._task)
+            finally:
+                self._task = None
+                # Остаются, только если цикл упал; ждущие обработчики не должны зависнуть
+                for _, future in self._pending:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Запись работ остановлена"))
+                self._pending.clear()
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "batches": self.batches,
+            "written": self.written,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+        }
@@ -0,0 +1,889 @@
+"""
+Хранилище в PostgreSQL для нескольких экземпляров бота с общей БД.
+
+Запросы идут через пул асинхронных соединений asyncpg, без потоков.
+Схема создаётся своими миграциями (MIGRATIONS ниже) под advisory-блокировкой,
+так что одновременно запущенные экземпляры не мешают друг другу.
+
+Ключи ответов кэшируются в памяти каждого экземпляра. Экземпляр, изменивший
+ключ или список админов, сообщает об этом остальным через NOTIFY в канал
+CACHE_CHANNEL, и они сбрасывают свои копии. Если слушающее соединение
+обрывается, кэш ключей очищается целиком и соединение открывается заново.
+"""
+import asyncio
+import csv
+import os
+import random
+import string
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import asyncpg
+
+import export
+import roles
+from config import DB_POOL_SIZE
+from grading import compile_answer_key, regrade_columns, forget_test
+from repositories.base import Repository, RESULTS_PAGE_SIZE, HISTORY_PAGE_SIZE
+from utils.cache import LRUCache
+from utils.normalizer import canonical_key
+
+# Время в боте — UTC+5 (как и в SQLite); asyncpg отдаёт TIMESTAMPTZ в UTC, дедлайны переводятся в этот пояс
+BOT_TIMEZONE = timezone(timedelta(hours=5))
+ANSWER_KEY_CACHE_SIZE = 512
+CACHE_CHANNEL = "bot_cache"
+# Ключ advisory-блокировки на время миграций
+MIGRATION_LOCK = 7_312_019
+# Сколько строк выгрузки читается из курсора за раз
+EXPORT_BATCH = 1000
+LISTENER_RETRY = 5  # секунды между попытками переподключить слушающее соединение
+
+
+MIGRATIONS = [
+    (1, """
+    CREATE TABLE users (
+        user_id BIGINT PRIMARY KEY,
+        full_name TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        created_at TIMESTAMP
+    );
+
+    CREATE TABLE admins (
+        admin_id BIGINT PRIMARY KEY,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        updated_at TIMESTAMP
+    );
+
+    CREATE TABLE tests (
+        test_id BIGSERIAL PRIMARY KEY,
+        title TEXT,
+        code TEXT UNIQUE,
+        is_active BOOLEAN NOT NULL DEFAULT TRUE,
+        created_by BIGINT,
+        created_at TIMESTAMP,
+        deadline TIMESTAMPTZ,
+        key_version INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE INDEX idx_tests_created_by ON tests(created_by);
+
+    CREATE TABLE questions (
+        question_id BIGSERIAL PRIMARY KEY,
+        test_id BIGINT NOT NULL REFERENCES tests ON DELETE CASCADE,
+        question_number INTEGER NOT NULL,
+        correct_answer TEXT,
+        score DOUBLE PRECISION,
+        canonical_answer TEXT
+    );
+    CREATE INDEX idx_questions_test_number ON questions(test_id, question_number);
+
+    -- Одна работа на ученика и тест: повторная отправка отсекается ограничением
+    CREATE TABLE answers (
+        answer_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        test_id BIGINT NOT NULL REFERENCES tests ON DELETE CASCADE,
+        answer_text TEXT,
+        submitted_at TIMESTAMP,
+        score DOUBLE PRECISION,
+        solved INTEGER,
+        max_score DOUBLE PRECISION,
+        UNIQUE (user_id, test_id)
+    );
+    CREATE INDEX idx_answers_test_score ON answers(test_id, score DESC, answer_id);
+    CREATE INDEX idx_answers_user_submitted ON answers(user_id, submitted_at);
+
+    CREATE TABLE answer_items (
+        answer_id BIGINT NOT NULL REFERENCES answers ON DELETE CASCADE,
+        test_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        question_number INTEGER NOT NULL,
+        answer TEXT NOT NULL,
+        is_correct BOOLEAN NOT NULL,
+        PRIMARY KEY (answer_id, question_number)
+    );
+    CREATE INDEX idx_answer_items_test ON answer_items(test_id);
+
+    -- fire_at — момент отправки в секундах Unix-времени
+    CREATE TABLE reminders (
+        reminder_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        test_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        fire_at DOUBLE PRECISION NOT NULL
+    );
+    CREATE INDEX idx_reminders_user_test ON reminders(user_id, test_id);
+
+    CREATE TABLE fsm_states (
+        bot_id BIGINT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        thread_id BIGINT NOT NULL DEFAULT 0,
+        destiny TEXT NOT NULL,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+    );
+    CREATE INDEX idx_fsm_states_updated ON fsm_states(updated_at);
+    """),
+    (2, """
+    -- Сводка для профиля ученика: обновляется при сдаче, пересчитывается при исправлении ключа
+    CREATE TABLE user_stats (
+        user_id BIGINT PRIMARY KEY,
+        tests_taken INTEGER NOT NULL,
+        percent_sum DOUBLE PRECISION NOT NULL
+    );
+    INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+    SELECT a.user_id, COUNT(*), SUM(CASE WHEN a.max_score > 0 THEN a.score * 100.0 / a.max_score ELSE 0 END)
+    FROM answers a
+    GROUP BY a.user_id;
+
+    -- История в профиле листается по answer_id
+    DROP INDEX idx_answers_user_submitted;
+    CREATE INDEX idx_answers_user_answer ON answers(user_id, answer_id);
+    """),
+]
+
+_KEY_QUERY = """
+    SELECT question_number, correct_answer, score, canonical_answer
+    FROM questions
+    WHERE test_id = $1
+    ORDER BY question_number
+"""
+
+# Листание по индексу (test_id, score DESC, answer_id), см. db._PAGE_CONDITIONS
+_PAGE_CONDITIONS = {
+    "next": ("a.score <= $2 AND NOT (a.score = $2 AND a.answer_id <= $3)", "a.score DESC, a.answer_id"),
+    "from": ("a.score <= $2 AND NOT (a.score = $2 AND a.answer_id < $3)", "a.score DESC, a.answer_id"),
+    "prev": ("a.score >= $2 AND NOT (a.score = $2 AND a.answer_id >= $3)", "a.score, a.answer_id DESC"),
+}
+
+# Процент работы от максимального балла, как в db._PERCENT
+_PERCENT = "CASE WHEN a.max_score > 0 THEN a.score * 100.0 / a.max_score ELSE 0 END"
+
+_EXPORT_QUERY = """
+    SELECT u.last_name, u.first_name, u.username, a.submitted_at, a.solved, a.score, a.max_score,
+           m.numbers, m.marks
+    FROM answers a
+    JOIN users u ON u.user_id = a.user_id
+    CROSS JOIN LATERAL (
+        SELECT array_agg(i.question_number) AS numbers, array_agg(i.is_correct) AS marks
+        FROM answer_items i
+        WHERE i.answer_id = a.answer_id
+    ) m
+    WHERE a.test_id = $1
+    ORDER BY a.answer_id
+"""
+
+
+def _local_now() -> datetime:
+    return (datetime.utcnow() + timedelta(hours=5)).replace(microsecond=0)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _percent(score: float, max_score: float) -> float:
+    return score * 100.0 / max_score if max_score > 0 else 0.0
+
+
+def _deadline(value: Optional[datetime]) -> Optional[datetime]:
+    return value.astimezone(BOT_TIMEZONE) if value else None
+
+
+class PostgresRepository(Repository):
+    def __init__(self, dsn: str, pool_size: int = DB_POOL_SIZE):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self._pool: Optional[asyncpg.Pool] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._worker_id = uuid.uuid4().hex[:12]
+        self._answer_keys = LRUCache(ANSWER_KEY_CACHE_SIZE)
+        # Растёт при каждом сбросе ключей: ключ, прочитанный до сброса, в кэш не кладётся
+        self._key_generation = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+
+    # --- Жизненный цикл ---
+    async def start(self):
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        async with self._pool.acquire() as conn:
+            await self._migrate(conn)
+        await self._listen()
+
+    async def close(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _migrate(self, conn: asyncpg.Connection) -> int:
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMP
+                )
+            """)
+            version = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            for target, sql in MIGRATIONS:
+                if target <= version:
+                    continue
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_version (version, applied_at) VALUES ($1, $2)",
+                        target, datetime.utcnow().replace(microsecond=0),
+                    )
+                print(f"🗄 Миграция схемы PostgreSQL до версии {target} применена")
+                version = target
+            return version
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK)
+
+    # --- Сброс кэшей между экземплярами ---
+    async def _listen(self):
+        self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener(CACHE_CHANNEL, self._on_notify)
+        self._listener.add_termination_listener(self._on_listener_lost)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _forget_key(self, test_id: int):
+        self._key_generation += 1
+        self._answer_keys.pop(test_id)
+        forget_test(test_id)
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        worker_id, _, message = payload.partition(":")
+        if worker_id == self._worker_id:
+            return
+        if message.startswith("key:"):
+            self._forget_key(int(message[4:]))
+        elif message == "admins":
+            self._spawn(self._reload_admins())
+
+    def _on_listener_lost(self, connection):
+        if self._closing:
+            return
+        print("⚠️ Потеряно соединение для уведомлений PostgreSQL, кэш ключей сброшен")
+        self._key_generation += 1
+        self._answer_keys.clear()
+        self._spawn(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        while not self._closing:
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError) as e:
+                print(f"Ошибка подключения к PostgreSQL для уведомлений: {e}")
+                await asyncio.sleep(LISTENER_RETRY)
+                continue
+            # Пока соединения не было, уведомления могли потеряться
+            self._key_generation += 1
+            self._answer_keys.clear()
+            await self._reload_admins()
+            return
+
+    async def _reload_admins(self):
+        roles.load_admins(await self.get_all_admins())
+
+    async def _notify(self, conn: asyncpg.Connection, message: str):
+        # Внутри транзакции уведомление уходит только после коммита
+        await conn.execute("SELECT pg_notify($1, $2)", CACHE_CHANNEL, f"{self._worker_id}:{message}")
+
+    # --- Пользователи ---
+    async def add_user(self, user_id: int, first_name: str, last_name: str, username: str = None):
+        await self._pool.execute("""
+            INSERT INTO users (user_id, first_name, last_name, username, created_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (user_id) DO NOTHING
+        """, user_id, first_name, last_name, username, _local_now())
+
+    async def user_exists(self, user_id: int) -> bool:
+        return await self._pool.fetchval("SELECT 1 FROM users WHERE user_id = $1", user_id) is not None
+
+    async def touch_user(self, user_id: int, username: Optional[str]) -> Optional[str]:
+        full_name = await self._pool.fetchval("""
+            INSERT INTO users (user_id, username) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET username = excluded.username
+            RETURNING full_name
+        """, user_id, username)
+        return full_name or None
+
+    async def save_user_name(self, user_id: int, full_name: str, first_name: str, last_name: str,
+                             username: Optional[str]):
+        await self._pool.execute("""
+            INSERT INTO users (user_id, full_name, first_name, last_name, username)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (user_id) DO UPDATE SET
+                full_name = excluded.full_name,
+                first_name = excluded.first_name,
+                last_name = excluded.last_name,
+                username = excluded.username
+        """, user_id, full_name, first_name, last_name, username)
+
+    # --- Профиль ученика ---
+    async def _refresh_user_stats(self, conn: asyncpg.Connection, user_ids: list[int]):
+        await conn.execute("DELETE FROM user_stats WHERE user_id = ANY($1::bigint[])", user_ids)
+        await conn.execute(f"""
+            INSERT INTO user_stats (user_id, tests_taken, percent_sum)
+            SELECT a.user_id, COUNT(*), SUM({_PERCENT})
+            FROM answers a
+            WHERE a.user_id = ANY($1::bigint[])
+            GROUP BY a.user_id
+        """, user_ids)
+
+    async def get_user_summary(self, user_id: int) -> Optional[dict]:
+        row = await self._pool.fetchrow(
+            "SELECT tests_taken, percent_sum FROM user_stats WHERE user_id = $1", user_id
+        )
+        if not row or not row[0]:
+            return None
+        tests_taken, percent_sum = row
+        return {"tests_taken": tests_taken, "average_percent": round(percent_sum / tests_taken, 1)}
+
+    async def _fetch_history_page(self, conn, user_id: int, anchor: Optional[int], direction: str, limit: int):
+        condition, order = ("a.answer_id > $2", "ASC") if direction == "prev" else ("a.answer_id < $2", "DESC")
+        params = [user_id]
+        if anchor is None:
+            condition = "TRUE"
+        else:
+            params.append(anchor)
+
+        return await conn.fetch(f"""
+            SELECT a.answer_id, a.test_id, t.title, a.submitted_at, a.score, a.max_score, a.solved,
+                   1 + (SELECT COUNT(*) FROM answers b WHERE b.test_id = a.test_id AND b.score > a.score),
+                   (SELECT COUNT(*) FROM answers b WHERE b.test_id = a.test_id)
+            FROM answers a
+            JOIN tests t ON t.test_id = a.test_id
+            WHERE a.user_id = $1 AND {condition}
+            ORDER BY a.answer_id {order}
+            LIMIT ${len(params) + 1}
+        """, *params, limit)
+
+    async def get_user_history_page(self, user_id: int, anchor: Optional[int] = None, direction: str = "next",
+                                    limit: int = HISTORY_PAGE_SIZE) -> dict:
+        async with self._pool.acquire() as conn, conn.transaction(isolation="repeatable_read", readonly=True):
+            rows = await self._fetch_history_page(conn, user_id, anchor, direction, limit + 1)
+            if direction == "prev":
+                rows = rows[:limit][::-1]
+                if len(rows) < limit:
+                    # дошли до начала — показываем полную первую страницу
+                    rows = await self._fetch_history_page(conn, user_id, None, "next", limit + 1)
+                    direction = "next"
+            has_next = direction == "prev" or len(rows) > limit
+            rows = rows[:limit]
+
+            has_prev = bool(rows) and await conn.fetchval(
+                "SELECT EXISTS(SELECT 1 FROM answers WHERE user_id = $1 AND answer_id > $2)", user_id, rows[0][0]
+            )
+
+        return {
+            "rows": [
+                {
+                    "answer_id": answer_id,
+                    "test_id": test_id,
+                    "title": title,
+                    "submitted_at": _iso(submitted_at),
+                    "score": score,
+                    "max_score": max_score,
+                    "solved": solved,
+                    "place": place,
+                    "participants": participants
+                }
+                for answer_id, test_id, title, submitted_at, score, max_score, solved, place, participants in rows
+            ],
+            "has_prev": has_prev,
+            "has_next": has_next,
+        }
+
+    # --- Админы ---
+    async def add_admin(self, user_id: int):
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("INSERT INTO admins (admin_id) VALUES ($1) ON CONFLICT DO NOTHING", user_id)
+            await self._notify(conn, "admins")
+        roles.grant_admin(user_id)
+
+    async def remove_admin(self, user_id: int):
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM admins WHERE admin_id = $1", user_id)
+            await self._notify(conn, "admins")
+        roles.revoke_admin(user_id)
+
+    async def get_all_admins(self) -> list[int]:
+        return [r[0] for r in await self._pool.fetch("SELECT admin_id FROM admins")]
+
+    async def sync_admin_info(self, user_id: int, first_name: str, last_name: str, username: str):
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                INSERT INTO admins (admin_id, first_name, last_name, username, updated_at)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (admin_id) DO UPDATE SET
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    username = excluded.username,
+                    updated_at = excluded.updated_at
+            """, user_id, first_name, last_name, username, _local_now())
+            await self._notify(conn, "admins")
+        roles.grant_admin(user_id)
+
+    # --- Тесты ---
+    async def generate_code(self, length: int = 6) -> str:
+        async with self._pool.acquire() as conn:
+            while True:
+                code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+                if not await conn.fetchval("SELECT 1 FROM tests WHERE code = $1", code):
+                    return code
+
+    async def create_test(self, title: str, code: str, admin_id: int, deadline: datetime) -> int:
+        return await self._pool.fetchval("""
+            INSERT INTO tests (title, code, is_active, created_by, deadline)
+            VALUES ($1, $2, TRUE, $3, $4)
+            RETURNING test_id
+        """, title, code, admin_id, deadline)
+
+    async def add_question(self, test_id: int, number: int, answer: str, score: float):
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)
+                VALUES ($1, $2, $3, $4, $5)
+            """, test_id, number, answer, score, canonical_key(answer))
+            await self._notify(conn, f"key:{test_id}")
+        self._forget_key(test_id)
+
+    async def create_test_with_questions(self, title: str, code: str, admin_id: int, deadline: datetime,
+                                         questions: list[tuple[int, str, float]]) -> int:
+        rows = sorted((q, answer, score, canonical_key(answer)) for q, answer, score in questions)
+        async with self._pool.acquire() as conn, conn.transaction():
+            test_id = await conn.fetchval("""
+                INSERT INTO tests (title, code, is_active, created_by, deadline)
+                VALUES ($1, $2, TRUE, $3, $4)
+                RETURNING test_id
+            """, title, code, admin_id, deadline)
+            await conn.executemany("""
+                INSERT INTO questions (test_id, question_number, correct_answer, score, canonical_answer)
+                VALUES ($1, $2, $3, $4, $5)
+            """, [(test_id, *row) for row in rows])
+
+        # Новый тест скоро начнут решать — ключ кладём в кэш сразу
+        self._answer_keys.put(test_id, compile_answer_key(rows, 1))
+        return test_id
+
+    async def get_tests_by_admin(self, admin_id: int) -> list[tuple]:
+        rows = await self._pool.fetch(
+            "SELECT test_id, title FROM tests WHERE created_by = $1 ORDER BY test_id", admin_id
+        )
+        return [tuple(r) for r in rows]
+
+    async def get_test_with_answers(self, test_id: int) -> Optional[tuple]:
+        async with self._pool.acquire() as conn:
+            test_info = await conn.fetchrow("SELECT title, code, deadline FROM tests WHERE test_id = $1", test_id)
+            if not test_info:
+                return None
+            title, code, deadline = test_info
+            questions = await conn.fetch("""
+                SELECT question_number, correct_answer, score FROM questions
+                WHERE test_id = $1
+                ORDER BY question_number
+            """, test_id)
+            count = await conn.fetchval("SELECT COUNT(*) FROM answers WHERE test_id = $1", test_id)
+        return title, [tuple(q) for q in questions], count, code, _iso(_deadline(deadline))
+
+    async def delete_test(self, test_id: int):
+        async with self._pool.acquire() as conn, conn.transaction():
+            user_ids = [r[0] for r in await conn.fetch("SELECT user_id FROM answers WHERE test_id = $1", test_id)]
+            # Вопросы, работы и их пункты удаляются каскадом; у напоминаний внешнего ключа нет
+            await conn.execute("DELETE FROM reminders WHERE test_id = $1", test_id)
+            await conn.execute("DELETE FROM tests WHERE test_id = $1", test_id)
+            await self._refresh_user_stats(conn, user_ids)
+            await self._notify(conn, f"key:{test_id}")
+        self._forget_key(test_id)
+
+    async def regrade_test(self, test_id: int, changes: list[tuple[int, str, float]]) -> int:
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.executemany("""
+                UPDATE questions SET correct_answer = $1, score = $2, canonical_answer = $3
+                WHERE test_id = $4 AND question_number = $5
+            """, [(answer, score, canonical_key(answer), test_id, number) for number, answer, score in changes])
+            version = await conn.fetchval(
+                "UPDATE tests SET key_version = key_version + 1 WHERE test_id = $1 RETURNING key_version", test_id
+            )
+            key = compile_answer_key([tuple(r) for r in await conn.fetch(_KEY_QUERY, test_id)], version)
+
+            items = await conn.fetch(
+                "SELECT answer_id, question_number, answer, is_correct FROM answer_items WHERE test_id = $1", test_id
+            )
+            results = {}
+            if items:
+                answer_ids, numbers, answers, old_flags = zip(*items)
+                # Проверка столбцами занимает процессор — выполняем её вне цикла событий
+                correct, results = await asyncio.to_thread(
+                    regrade_columns, array("q", answer_ids), array("i", numbers), answers, key["correct_map"]
+                )
+
+                # Переписываем только те ответы, чья оценка изменилась
+                changed = [(a, n, bool(c)) for c, a, n, old in zip(correct, answer_ids, numbers, old_flags) if c != old]
+                if changed:
+                    ids, nums, flags = map(list, zip(*changed))
+                    await conn.execute("""
+                        UPDATE answer_items i SET is_correct = c.is_correct
+                        FROM unnest($1::bigint[], $2::int[], $3::bool[]) AS c(answer_id, question_number, is_correct)
+                        WHERE i.answer_id = c.answer_id AND i.question_number = c.question_number
+                    """, ids, nums, flags)
+
+                ids = list(results)
+                await conn.execute("""
+                    UPDATE answers a SET score = c.score, solved = c.solved, max_score = $4
+                    FROM unnest($1::bigint[], $2::float8[], $3::int[]) AS c(answer_id, score, solved)
+                    WHERE a.answer_id = c.answer_id
+                """, ids, [round(results[i][0], 2) for i in ids], [results[i][1] for i in ids],
+                    round(key["max_score"], 2))
+                await self._refresh_user_stats(conn, [r[0] for r in await conn.fetch(
+                    "SELECT user_id FROM answers WHERE test_id = $1", test_id
+                )])
+            await self._notify(conn, f"key:{test_id}")
+
+        self._forget_key(test_id)
+        self._answer_keys.put(test_id, key)
+        return len(results)
+
+    # --- Логика ответов и дедлайна ---
+    async def get_test_session(self, code: str, user_id: int) -> Optional[dict]:
+        row = await self._pool.fetchrow("""
+            SELECT t.test_id, t.is_active, t.deadline,
+                   EXISTS(SELECT 1 FROM answers a WHERE a.test_id = t.test_id AND a.user_id = $1)
+            FROM tests t
+            WHERE t.code = $2
+        """, user_id, code)
+        if not row:
+            return None
+
+        test_id, is_active, deadline, submitted = row
+        return {
+            "test_id": test_id,
+            "is_active": is_active,
+            "deadline": _deadline(deadline),
+            "submitted": submitted,
+        }
+
+    async def is_valid_code(self, code: str) -> bool:
+        row = await self._pool.fetchval("SELECT 1 FROM tests WHERE code = $1 AND is_active", code)
+        return row is not None
+
+    async def get_test_id_by_code(self, code: str) -> Optional[int]:
+        return await self._pool.fetchval("SELECT test_id FROM tests WHERE code = $1", code)
+
+    async def get_test_deadline(self, test_id: int) -> Optional[datetime]:
+        return _deadline(await self._pool.fetchval("SELECT deadline FROM tests WHERE test_id = $1", test_id))
+
+    async def has_submitted(self, user_id: int, test_id: int) -> bool:
+        row = await self._pool.fetchval(
+            "SELECT 1 FROM answers WHERE user_id = $1 AND test_id = $2", user_id, test_id
+        )
+        return row is not None
+
+    async def get_answer_key(self, test_id: int) -> dict:
+        key = self._answer_keys.get(test_id)
+        if key is None:
+            generation = self._key_generation
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(_KEY_QUERY, test_id)
+                version = await conn.fetchval("SELECT key_version FROM tests WHERE test_id = $1", test_id)
+            key = compile_answer_key([tuple(r) for r in rows], version or 1)
+            if generation == self._key_generation:
+                self._answer_keys.put(test_id, key)
+        return key
+
+    async def get_correct_answers(self, test_id: int) -> list[dict]:
+        return (await self.get_answer_key(test_id))["questions"]
+
+    async def preload_answer_keys(self) -> int:
+        rows = await self._pool.fetch("""
+            SELECT q.test_id, t.key_version, q.question_number, q.correct_answer, q.score, q.canonical_answer
+            FROM questions q
+            JOIN tests t ON t.test_id = q.test_id
+            WHERE t.is_active
+            ORDER BY t.test_id DESC, q.question_number
+        """)
+
+        by_test = {}
+        versions = {}
+        for test_id, version, *question in rows:
+            by_test.setdefault(test_id, []).append(question)
+            versions[test_id] = version
+
+        # Самые новые тесты загружаются последними, чтобы при переполнении остались именно они
+        loaded = list(by_test.items())[:ANSWER_KEY_CACHE_SIZE]
+        for test_id, questions in reversed(loaded):
+            self._answer_keys.put(test_id, compile_answer_key(questions, versions[test_id]))
+        return len(loaded)
+
+    def answer_key_cache_stats(self) -> dict:
+        return self._answer_keys.stats()
+
+    async def save_answers(self, user_id: int, test_id: int, answer_text: str, items: list[tuple[int, str, bool]],
+                           score: float, solved: int, max_score: float) -> bool:
+        async with self._pool.acquire() as conn, conn.transaction():
+            answer_id = await conn.fetchval("""
+                INSERT INTO answers (user_id, test_id, answer_text, submitted_at, score, solved, max_score)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ON CONFLICT (user_id, test_id) DO NOTHING
+                RETURNING answer_id
+            """, user_id, test_id, answer_text, _local_now(), round(score, 2), solved, round(max_score, 2))
+            if answer_id is None:
+                return False
+
+            await conn.execute("""
+                INSERT INTO answer_items (answer_id, test_id, user_id, question_number, answer, is_correct)
+                SELECT $1, $2, $3, i.number, i.answer, i.is_correct
+                FROM unnest($4::int[], $5::text[], $6::bool[]) AS i(number, answer, is_correct)
+            """, answer_id, test_id, user_id,
+                [n for n, _, _ in items], [a for _, a, _ in items], [bool(c) for _, _, c in items])
+            await conn.execute("""
+                INSERT INTO user_stats (user_id, tests_taken, percent_sum) VALUES ($1, 1, $2)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    tests_taken = user_stats.tests_taken + 1,
+                    percent_sum = user_stats.percent_sum + excluded.percent_sum
+            """, user_id, _percent(round(score, 2), round(max_score, 2)))
+        return True
+
+    # --- Напоминания о дедлайне ---
+    async def add_reminders(self, user_id: int, test_id: int, reminders: list[tuple[str, float]]) -> list[int]:
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM reminders WHERE user_id = $1 AND test_id = $2", user_id, test_id)
+            return [
+                await conn.fetchval(
+                    "INSERT INTO reminders (user_id, test_id, kind, fire_at) VALUES ($1, $2, $3, $4) RETURNING reminder_id",
+                    user_id, test_id, kind, fire_at,
+                )
+                for kind, fire_at in reminders
+            ]
+
+    async def delete_user_reminders(self, user_id: int, test_id: int):
+        await self._pool.execute("DELETE FROM reminders WHERE user_id = $1 AND test_id = $2", user_id, test_id)
+
+    async def delete_reminders(self, reminder_ids: list[int]) -> set[int]:
+        rows = await self._pool.fetch(
+            "DELETE FROM reminders WHERE reminder_id = ANY($1::bigint[]) RETURNING reminder_id", list(reminder_ids)
+        )
+        return {r[0] for r in rows}
+
+    async def get_pending_reminders(self) -> list[tuple]:
+        rows = await self._pool.fetch("SELECT reminder_id, user_id, test_id, kind, fire_at FROM reminders")
+        return [tuple(r) for r in rows]
+
+    async def get_submitted_pairs(self, pairs: list[tuple[int, int]]) -> set[tuple[int, int]]:
+        pairs = list(pairs)
+        rows = await self._pool.fetch("""
+            SELECT a.user_id, a.test_id
+            FROM unnest($1::bigint[], $2::bigint[]) AS p(user_id, test_id)
+            JOIN answers a ON a.user_id = p.user_id AND a.test_id = p.test_id
+        """, [u for u, _ in pairs], [t for _, t in pairs])
+        return {tuple(r) for r in rows}
+
+    # --- Состояния FSM ---
+    async def load_fsm_record(self, key: tuple) -> Optional[tuple]:
+        row = await self._pool.fetchrow("""
+            SELECT state, data, updated_at FROM fsm_states
+            WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+        """, *key)
+        return tuple(row) if row else None
+
+    async def save_fsm_records(self, upserts: list[tuple], deletes: list[tuple]):
+        async with self._pool.acquire() as conn, conn.transaction():
+            if upserts:
+                await conn.executemany("""
+                    INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id, destiny, state, data, updated_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                    ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                """, upserts)
+            if deletes:
+                await conn.executemany("""
+                    DELETE FROM fsm_states
+                    WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+                """, deletes)
+
+    async def delete_stale_fsm_records(self, cutoff: float) -> int:
+        status = await self._pool.execute("DELETE FROM fsm_states WHERE updated_at < $1", cutoff)
+        # Статус команды: "DELETE <число строк>"
+        return int(status.split()[-1])
+
+    # --- Результаты ---
+    async def get_test_results(self, test_id: int) -> list[dict]:
+        total = len((await self.get_answer_key(test_id))["correct_map"])
+        rows = await self._pool.fetch("""
+            SELECT u.user_id, u.first_name, u.last_name, u.username, a.submitted_at,
+                   a.score, a.solved, a.max_score
+            FROM answers a
+            JOIN users u ON u.user_id = a.user_id
+            WHERE a.test_id = $1
+            ORDER BY a.score DESC, a.answer_id
+        """, test_id)
+
+        return [
+            {
+                "user_id": user_id,
+                "first_name": first_name,
+                "last_name": last_name,
+                "username": username,
+                "submitted_at": _iso(submitted_at),
+                "score": score,
+                "solved": solved,
+                "total": total,
+                "max_score": max_score
+            }
+            for user_id, first_name, last_name, username, submitted_at, score, solved, max_score in rows
+        ]
+
+    async def _fetch_results_page(self, conn, test_id: int, anchor: Optional[tuple[float, int]],
+                                  direction: str, limit: int):
+        condition, order = _PAGE_CONDITIONS[direction]
+        params = [test_id]
+        if anchor is None:
+            condition, order = "TRUE", _PAGE_CONDITIONS["next"][1]
+        else:
+            params += anchor
+
+        return await conn.fetch(f"""
+            SELECT a.answer_id, a.score, a.solved, a.max_score, a.submitted_at,
+                   u.user_id, u.first_name, u.last_name, u.username
+            FROM answers a
+            JOIN users u ON u.user_id = a.user_id
+            WHERE a.test_id = $1 AND {condition}
+            ORDER BY {order}
+            LIMIT ${len(params) + 1}
+        """, *params, limit)
+
+    async def get_results_page(self, test_id: int, anchor: Optional[tuple[float, int]] = None,
+                               direction: str = "next", limit: int = RESULTS_PAGE_SIZE) -> dict:
+        # Страница и подсчёт мест читаются из одного снимка
+        async with self._pool.acquire() as conn, conn.transaction(isolation="repeatable_read", readonly=True):
+            rows = await self._fetch_results_page(conn, test_id, anchor, direction, limit + 1)
+            if direction == "prev":
+                rows = rows[:limit][::-1]
+                if len(rows) < limit:
+                    # дошли до начала — показываем полную первую страницу
+                    rows = await self._fetch_results_page(conn, test_id, None, "next", limit + 1)
+                    direction = "next"
+            has_next = direction == "prev" or len(rows) > limit
+            rows = rows[:limit]
+
+            before, higher = 0, 0
+            if rows:
+                first_score, first_id = rows[0][1], rows[0][0]
+                before, higher = await conn.fetchrow("""
+                    SELECT COUNT(*), COUNT(*) FILTER (WHERE a.score > $2)
+                    FROM answers a
+                    WHERE a.test_id = $1 AND a.score >= $2 AND NOT (a.score = $2 AND a.answer_id >= $3)
+                """, test_id, first_score, first_id)
+
+        # Места с учётом равных баллов: 1, 2, 2, 4
+        page = []
+        place, prev_score = higher + 1, None
+        for position, (answer_id, score, solved, max_score, submitted_at,
+                       user_id, first_name, last_name, username) in enumerate(rows, start=before + 1):
+            if prev_score is not None and score != prev_score:
+                place = position
+            prev_score = score
+            page.append({
+                "place": place,
+                "answer_id": answer_id,
+                "user_id": user_id,
+                "first_name": first_name,
+                "last_name": last_name,
+                "username": username,
+                "submitted_at": _iso(submitted_at),
+                "score": score,
+                "solved": solved,
+                "max_score": max_score
+            })
+
+        return {"rows": page, "has_prev": before > 0, "has_next": has_next}
+
+    async def get_participant_result(self, test_id: int, user_id: int) -> Optional[dict]:
+        row = await self._pool.fetchrow("""
+            SELECT u.first_name, u.last_name, u.username, a.submitted_at, a.score, a.solved, a.max_score
+            FROM answers a
+            JOIN users u ON u.user_id = a.user_id
+            WHERE a.test_id = $1 AND a.user_id = $2
+        """, test_id, user_id)
+
+        if not row:
+            return None
+        first_name, last_name, username, submitted_at, score, solved, max_score = row
+        return {
+            "first_name": first_name,
+            "last_name": last_name,
+            "username": username,
+            "submitted_at": _iso(submitted_at),
+            "score": score,
+            "solved": solved,
+            "total": len((await self.get_answer_key(test_id))["correct_map"]),
+            "max_score": max_score
+        }
+
+    async def get_user_answers_detailed(self, test_id: int, user_id: int) -> list[dict]:
+        rows = await self._pool.fetch("""
+            SELECT i.question_number, i.answer, i.is_correct
+            FROM answers a
+            JOIN answer_items i ON i.answer_id = a.answer_id
+            WHERE a.test_id = $1 AND a.user_id = $2
+            ORDER BY i.question_number
+        """, test_id, user_id)
+
+        correct_map = (await self.get_answer_key(test_id))["correct_map"]
+        return [
+            {
+                "question_number": q_num,
+                "user_answer": answer,
+                "is_correct": is_correct,
+                "score": correct_map.get(q_num, (None, 0))[1]
+            }
+            for q_num, answer, is_correct in rows
+        ]
+
+    async def export_results_csv(self, test_id: int) -> tuple[str, int]:
+        questions = sorted((await self.get_answer_key(test_id))["correct_map"])
+        path = export.new_export_path(test_id)
+        count = 0
+        try:
+            with export.open_csv(path) as f:
+                writer = csv.writer(f, delimiter=export.CSV_DELIMITER)
+                writer.writerow(export.csv_header(questions))
+                async with self._pool.acquire() as conn, conn.transaction(readonly=True):
+                    cursor = await conn.cursor(_EXPORT_QUERY, test_id)
+                    while rows := await cursor.fetch(EXPORT_BATCH):
+                        batch = [
+                            export.csv_row(questions, (
+                                last_name, first_name, username, _iso(submitted_at), solved, score, max_score,
+                                dict(zip(numbers or (), marks or ())),
+                            ))
+                            for last_name, first_name, username, submitted_at, solved, score, max_score,
+                            numbers, marks in rows
+                        ]
+                        # Запись на диск — в потоке, чтобы не задерживать другие обновления
+                        await asyncio.to_thread(writer.writerows, batch)
+                        count += len(batch)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, count
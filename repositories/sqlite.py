@@ -0,0 +1,117 @@
+"""
+Хранилище в SQLite.
+
+Каждая функция из db.py выполняется в отдельном пуле потоков, поэтому
+запросы к SQLite не блокируют цикл событий бота. У каждого потока пула
+своё долгоживущее соединение, так что число соединений ограничено
+размером пула. Файл БД один, поэтому экземпляр бота тоже должен быть один.
+
+Работы учеников пишет не пул, а GroupCommitWriter (repositories.group_commit):
+одновременные сдачи объединяются в одну транзакцию с одним fsync.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import export
+from config import DB_POOL_SIZE
+from migrations import migrate
+from repositories.base import Repository
+from repositories.group_commit import GroupCommitWriter
+
+
+def _in_thread(func):
+    """Метод хранилища, выполняющий синхронную функцию db.py в пуле потоков"""
+    @functools.wraps(func)
+    async def method(self, *args, **kwargs):
+        return await self.run(func, *args, **kwargs)
+    return method
+
+
+class SQLiteRepository(Repository):
+    def __init__(self, path: str = None, pool_size: int = DB_POOL_SIZE):
+        if path:
+            db.close_connections()
+            db.DB_NAME = path
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix="db",
+            initializer=db.bind_thread_connection,
+        )
+        self._writer = GroupCommitWriter()
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет синхронную функцию работы с БД в пуле и ждёт результат"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def start(self):
+        await self.run(migrate)
+        await self._writer.start()
+
+    async def close(self):
+        await self._writer.close()
+        self._executor.shutdown(wait=True)
+        db.close_connections()
+
+    # --- Пользователи ---
+    add_user = _in_thread(db.add_user)
+    user_exists = _in_thread(db.user_exists)
+    touch_user = _in_thread(db.touch_user)
+    save_user_name = _in_thread(db.save_user_name)
+
+    # --- Профиль ученика ---
+    get_user_summary = _in_thread(db.get_user_summary)
+    get_user_history_page = _in_thread(db.get_user_history_page)
+
+    # --- Админы ---
+    add_admin = _in_thread(db.add_admin)
+    remove_admin = _in_thread(db.remove_admin)
+    get_all_admins = _in_thread(db.get_all_admins)
+    sync_admin_info = _in_thread(db.sync_admin_info)
+
+    # --- Тесты ---
+    generate_code = _in_thread(db.generate_code)
+    create_test = _in_thread(db.create_test)
+    add_question = _in_thread(db.add_question)
+    create_test_with_questions = _in_thread(db.create_test_with_questions)
+    get_tests_by_admin = _in_thread(db.get_tests_by_admin)
+    get_test_with_answers = _in_thread(db.get_test_with_answers)
+    delete_test = _in_thread(db.delete_test)
+    regrade_test = _in_thread(db.regrade_test)
+
+    # --- Логика ответов и дедлайна ---
+    get_test_session = _in_thread(db.get_test_session)
+    is_valid_code = _in_thread(db.is_valid_code)
+    get_test_id_by_code = _in_thread(db.get_test_id_by_code)
+    get_test_deadline = _in_thread(db.get_test_deadline)
+    has_submitted = _in_thread(db.has_submitted)
+    get_answer_key = _in_thread(db.get_answer_key)
+    get_correct_answers = _in_thread(db.get_correct_answers)
+    preload_answer_keys = _in_thread(db.preload_answer_keys)
+
+    async def save_answers(self, user_id, test_id, answer_text, items, score, solved, max_score) -> bool:
+        return await self._writer.submit(user_id, test_id, answer_text, items, score, solved, max_score)
+
+    def answer_key_cache_stats(self) -> dict:
+        return db.answer_key_cache_stats()
+
+    # --- Напоминания о дедлайне ---
+    add_reminders = _in_thread(db.add_reminders)
+    delete_user_reminders = _in_thread(db.delete_user_reminders)
+    delete_reminders = _in_thread(db.delete_reminders)
+    get_pending_reminders = _in_thread(db.get_pending_reminders)
+    get_submitted_pairs = _in_thread(db.get_submitted_pairs)
+
+    # --- Состояния FSM ---
+    load_fsm_record = _in_thread(db.load_fsm_record)
+    save_fsm_records = _in_thread(db.save_fsm_records)
+    delete_stale_fsm_records = _in_thread(db.delete_stale_fsm_records)
+
+    # --- Результаты ---
+    get_test_results = _in_thread(db.get_test_results)
+    get_user_answers_detailed = _in_thread(db.get_user_answers_detailed)
+    get_results_page = _in_thread(db.get_results_page)
+    get_participant_result = _in_thread(db.get_participant_result)
+    export_results_csv = _in_thread(export.export_results_csv)
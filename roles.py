@@ -0,0 +1,57 @@
+"""
+Определение роли пользователя без обращения к БД.
+
+Множество админов загружается один раз при запуске (load_admins) и
+дальше поддерживается функциями db.add_admin, db.remove_admin и
+db.sync_admin_info, поэтому проверки прав не делают запросов.
+"""
+import threading
+
+from config import OWNER_ID
+
+ROLE_OWNER = "owner"
+ROLE_ADMIN = "admin"
+ROLE_USER = "user"
+
+ROLE_TITLES = {
+    ROLE_OWNER: "👑 Владелец",
+    ROLE_ADMIN: "🛡 Админ",
+    ROLE_USER: "👤 Пользователь",
+}
+
+_admin_ids: frozenset[int] = frozenset()
+_lock = threading.Lock()
+
+
+def load_admins(admin_ids):
+    global _admin_ids
+    with _lock:
+        _admin_ids = frozenset(admin_ids)
+
+
+def grant_admin(user_id: int):
+    global _admin_ids
+    with _lock:
+        _admin_ids = _admin_ids | {user_id}
+
+
+def revoke_admin(user_id: int):
+    global _admin_ids
+    with _lock:
+        _admin_ids = _admin_ids - {user_id}
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in _admin_ids
+
+
+def is_admin_or_owner(user_id: int) -> bool:
+    return user_id == OWNER_ID or user_id in _admin_ids
+
+
+def get_role(user_id: int) -> str:
+    if user_id == OWNER_ID:
+        return ROLE_OWNER
+    if user_id in _admin_ids:
+        return ROLE_ADMIN
+    return ROLE_USER
@@ -0,0 +1,177 @@
+"""
+Единый планировщик напоминаний о дедлайне.
+
+Вместо отдельных asyncio-задач на каждого ученика напоминания хранятся
+в таблице reminders и в куче в памяти. Один фоновый цикл спит до
+ближайшего напоминания, забирает все наступившие пачкой, одним
+запросом отбрасывает тех, кто уже сдал тест, и рассылает тем, кто ещё
+не вышел из теста (состояние FSM не сброшено).
+После перезапуска бота неотправленные напоминания читаются из БД.
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+from delivery import bulk
+from async_db import (
+    add_reminders, delete_user_reminders, delete_reminders,
+    get_pending_reminders, get_submitted_pairs
+)
+
+# вид напоминания -> (за сколько до дедлайна, текст)
+REMINDERS = {
+    "15m": (timedelta(minutes=15), "⏰ Осталось 15 минут. Рассчитай время и не спеши."),
+    "3m": (timedelta(minutes=3), "⚠️ Осталось 3 минуты. Пора заканчивать."),
+    "deadline": (timedelta(0), "🕰 Время вышло. Тест теперь недоступен для сдачи."),
+}
+
+# Сколько напоминаний обрабатывается за один проход
+BATCH_SIZE = 500
+# Напоминания, опоздавшие больше чем на это время (например, бот был выключен), не отправляются
+STALE_AFTER = 120
+# Пауза перед повтором пачки, если БД не ответила
+RETRY_DELAY = 5
+
+
+class ReminderScheduler:
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self._bot: Optional[Bot] = None
+        self._storage: Optional[BaseStorage] = None
+        # (fire_at, reminder_id, user_id, test_id, kind)
+        self._heap: list[tuple] = []
+        # id ещё актуальных напоминаний; отменённые остаются в куче и пропускаются
+        self._live: set[int] = set()
+        self._by_pair: dict[tuple[int, int], list[int]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _push(self, reminder_id: int, user_id: int, test_id: int, kind: str, fire_at: float):
+        heapq.heappush(self._heap, (fire_at, reminder_id, user_id, test_id, kind))
+        self._live.add(reminder_id)
+        self._by_pair.setdefault((user_id, test_id), []).append(reminder_id)
+
+    def _forget_pair(self, user_id: int, test_id: int):
+        for reminder_id in self._by_pair.pop((user_id, test_id), []):
+            self._live.discard(reminder_id)
+
+    async def start(self, bot: Bot, storage: BaseStorage):
+        self._bot = bot
+        self._storage = storage
+        for reminder_id, user_id, test_id, kind, fire_at in await get_pending_reminders():
+            self._push(reminder_id, user_id, test_id, kind, fire_at)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def schedule(self, user_id: int, test_id: int, deadline: datetime):
+        """Планирует все ещё не наступившие напоминания для ученика, начавшего тест"""
+        now = time.time()
+        planned = []
+        for kind, (before, _) in REMINDERS.items():
+            fire_at = (deadline - before).timestamp()
+            if fire_at > now:
+                planned.append((kind, fire_at))
+
+        ids = await add_reminders(user_id, test_id, planned)
+        self._forget_pair(user_id, test_id)
+        for reminder_id, (kind, fire_at) in zip(ids, planned):
+            self._push(reminder_id, user_id, test_id, kind, fire_at)
+        self._wakeup.set()
+
+    async def cancel(self, user_id: int, test_id: int):
+        self._forget_pair(user_id, test_id)
+        await delete_user_reminders(user_id, test_id)
+
+    def cancel_test(self, test_id: int):
+        """Забывает напоминания удалённого теста; строки в БД удаляет сам delete_test"""
+        for user_id, pair_test_id in [pair for pair in self._by_pair if pair[1] == test_id]:
+            self._forget_pair(user_id, pair_test_id)
+
+    def _pop_due(self, now: float) -> list[tuple]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            entry = heapq.heappop(self._heap)
+            if entry[1] in self._live:
+                due.append(entry)
+        return due
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            due = self._pop_due(now)
+            if due:
+                try:
+                    await self._fire(due, now)
+                except Exception as e:
+                    print(f"Ошибка при рассылке напоминаний: {e}")
+                    await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, due: list[tuple], now: float):
+        for _, reminder_id, user_id, test_id, _ in due:
+            self._live.discard(reminder_id)
+            ids = self._by_pair.get((user_id, test_id))
+            if ids:
+                ids.remove(reminder_id)
+                if not ids:
+                    del self._by_pair[(user_id, test_id)]
+
+        try:
+            # Один запрос на всю пачку вместо проверки каждого ученика
+            submitted = await get_submitted_pairs({(user_id, test_id) for _, _, user_id, test_id, _ in due})
+            candidates = [
+                entry for entry in due
+                if (entry[2], entry[3]) not in submitted and now - entry[0] <= STALE_AFTER
+            ]
+            # Как и раньше, напоминаем только тем, кто ещё в тесте: ученик мог уйти в другую команду без отмены
+            states = await asyncio.gather(*(
+                self._storage.get_state(StorageKey(bot_id=self._bot.id, chat_id=user_id, user_id=user_id))
+                for _, _, user_id, _, _ in candidates
+            ))
+
+            # Напоминание забирается из БД до отправки: если ботов несколько (общая PostgreSQL),
+            # его отправит только тот, кто удалил его первым
+            claimed = await delete_reminders([reminder_id for _, reminder_id, *_ in due])
+        except Exception:
+            # Из БД ещё ничего не забрано — пачка вернётся в кучу и будет разослана при следующем проходе.
+            # Отменённые за это время напоминания уже удалены из БД и не пройдут delete_reminders
+            for fire_at, reminder_id, user_id, test_id, kind in due:
+                self._push(reminder_id, user_id, test_id, kind, fire_at)
+            raise
+
+        to_send = [
+            (user_id, kind) for (_, reminder_id, user_id, _, kind), state in zip(candidates, states)
+            if reminder_id in claimed and state is not None
+        ]
+        # Отправляем одновременно: темп задаёт очередь исходящих (delivery.Outbox), а не время ответа API.
+        # Задачи создаются внутри bulk() и наследуют низкий приоритет
+        with bulk():
+            results = await asyncio.gather(
+                *(self._bot.send_message(user_id, REMINDERS[kind][1]) for user_id, kind in to_send),
+                return_exceptions=True,
+            )
+        for (user_id, _), result in zip(to_send, results):
+            if isinstance(result, Exception):
+                print(f"Ошибка при отправке напоминания пользователю {user_id}: {result}")
+
+reminders = ReminderScheduler()
@@ -0,0 +1,63 @@
+"""
+Единые правила записи и сравнения ответов.
+
+normalize_answer() проверяет ответ и приводит дробь к десятичной записи —
+так ответ показывается и хранится. canonical_key() даёт ключ для сравнения:
+числа сравниваются по значению (3/4, 0.75 и .75 дают один ключ), остальные
+ответы — без учёта регистра и лишних пробелов.
+"""
+import re
+from functools import lru_cache
+
+# Ответ не длиннее 5 символов, не считая минусов
+MAX_ANSWER_LENGTH = 5
+# Сколько знаков занимает число в десятичной записи: 2/3 → 0.667, 100/7 → 14.29
+NUMBER_WIDTH = 5
+
+_FRACTION = re.compile(r"(-?)(\d+)/(\d+)")
+_DECIMAL = re.compile(r"-?(?:\d+\.?\d*|\.\d+)")
+_SPACES = re.compile(r"\s+")
+
+
+def format_number(value: float) -> str:
+    """Десятичная запись числа с точностью, зависящей от длины целой части"""
+    digits = max(0, NUMBER_WIDTH - 1 - len(str(int(abs(value)))))
+    text = f"{value:.{digits}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _fraction_value(answer: str) -> float:
+    match = _FRACTION.fullmatch(answer)
+    if not match or int(match[3]) == 0:
+        raise ValueError("НЕКОРРЕКТНАЯ ДРОБЬ")
+    value = int(match[2]) / int(match[3])
+    return -value if match[1] else value
+
+
+def normalize_answer(answer: str) -> str:
+    """
+    Проверяет ответ и возвращает его в том виде, в каком он хранится.
+    Дробь заменяется десятичной записью. При ошибке бросает ValueError с текстом для пользователя.
+    """
+    answer = answer.strip()
+    if len(answer.replace("-", "")) > MAX_ANSWER_LENGTH:
+        raise ValueError("ОТВЕТ ПРЕВЫШАЕТ ДОПУСТИМУЮ ДЛИНУ")
+    if "/" in answer and answer.count("/") == 1:
+        return format_number(_fraction_value(answer))
+    return answer
+
+
+@lru_cache(maxsize=8192)
+def canonical_key(answer: str) -> str:
+    """Ключ для сравнения ответов: одинаков у равных чисел и у текста, отличающегося регистром"""
+    answer = _SPACES.sub(" ", answer.strip()).lower()
+    if _DECIMAL.fullmatch(answer):
+        return format_number(float(answer))
+    if _FRACTION.fullmatch(answer):
+        try:
+            return format_number(_fraction_value(answer))
+        except ValueError:
+            return answer
+    return answer
@@ -0,0 +1,113 @@
+"""
+Приём обновлений через вебхук (режим включается переменной WEBHOOK_URL).
+
+aiohttp-сервер слушает WEBHOOK_HOST:WEBHOOK_PORT за обратным прокси.
+Запросы без правильного секрета отклоняются. Обновление обрабатывается
+в фоне, а Telegram получает ответ сразу — но не раньше, чем освободится
+одно из max_concurrency мест, так что нагрузка ограничена, а лишние
+обновления ждут на стороне Telegram. При остановке сервер перестаёт
+принимать запросы и дожидается уже начатых обновлений.
+"""
+import asyncio
+import signal
+from typing import Any
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# Сколько секунд ждать обработки начатых обновлений при остановке
+DRAIN_TIMEOUT = 30
+# Больше Telegram не разрешает
+TELEGRAM_MAX_CONNECTIONS = 100
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """SimpleRequestHandler с ограничением числа одновременно обрабатываемых обновлений"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int,
+                 secret_token: str = None, drain_timeout: float = DRAIN_TIMEOUT, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._draining = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def _background_feed_update(self, bot: Bot, update: dict):
+        try:
+            await super()._background_feed_update(bot, update)
+        finally:
+            self._slots.release()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._draining:
+            # Telegram повторит доставку позже — возможно, уже новому экземпляру бота
+            return web.Response(status=503)
+
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        # Пока все места заняты, ответ Telegram задерживается — новых обновлений он не пришлёт
+        await self._slots.acquire()
+        try:
+            return await self._handle_request_background(bot=bot, request=request)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    __call__ = handle
+
+    async def close(self):
+        self._draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            print(f"⏳ Завершаем обработку {len(tasks)} обновлений")
+            _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+        await super().close()
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot, path: str, secret_token: str,
+                      max_concurrency: int) -> tuple[web.Application, LimitedRequestHandler]:
+    app = web.Application()
+    handler = LimitedRequestHandler(dispatcher, bot, max_concurrency, secret_token=secret_token)
+    # Порядок важен: on_shutdown вызываются по очереди — сначала дожидаемся обновлений,
+    # потом останавливаем диспетчер (и сохраняем состояния FSM)
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+    return app, handler
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, *, url: str, path: str, secret_token: str,
+                      host: str, port: int, max_concurrency: int):
+    """Запускает сервер, регистрирует вебхук и работает до SIGINT/SIGTERM"""
+    app, _ = build_webhook_app(dispatcher, bot, path, secret_token, max_concurrency)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    await bot.set_webhook(
+        url.rstrip("/") + path,
+        secret_token=secret_token,
+        max_connections=min(max_concurrency, TELEGRAM_MAX_CONNECTIONS),
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    print(f"🌐 Вебхук слушает {host}:{port}{path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()